@@ -0,0 +1,92 @@
+"""Load test for the HTTP API (pdf_api.py): latency percentiles and throughput.
+
+    python pdf_api.py --port 8000 &
+    python api_load_test.py sample.pdf --path "/compress?level=2" --concurrency 8 --requests 200
+
+Each client thread keeps one connection open and sends its requests over it
+back to back, so the run also exercises keep-alive.
+"""
+import argparse
+import http.client
+import json
+import math
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+def percentile(values, q):
+    """Returns the nearest-rank q-th percentile of `values`."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def client(url, path, body, content_type, count, latencies, errors, lock):
+    """Sends `count` requests on one persistent connection, recording latency or error of each."""
+    parts = urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=600)
+    for _ in range(count):
+        start = time.perf_counter()
+        try:
+            connection.request("POST", path, body=body, headers={"Content-Type": content_type})
+            response = connection.getresponse()
+            while response.read(1024 * 1024):
+                pass
+            status = response.status
+        except (OSError, http.client.HTTPException) as e:
+            status = type(e).__name__
+            connection.close()  # Reconnects on the next request
+        elapsed = time.perf_counter() - start
+        with lock:
+            if status == 200:
+                latencies.append(elapsed)
+            else:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+    connection.close()
+
+
+def run(url, path, body, content_type, concurrency, requests):
+    latencies, errors, lock = [], {}, threading.Lock()
+    counts = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+    threads = [threading.Thread(target=client, args=(url, path, body, content_type, count, latencies, errors, lock))
+               for count in counts if count]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    summary = {"path": path, "concurrency": concurrency, "requests": requests, "succeeded": len(latencies),
+               "errors": errors, "wall_seconds": round(wall, 3),
+               "requests_per_second": round(len(latencies) / wall, 2) if wall else 0.0}
+    if latencies:
+        summary.update({f"{name}_ms": round(value * 1000, 1) for name, value in (
+            ("p50", percentile(latencies, 50)), ("p99", percentile(latencies, 99)),
+            ("min", min(latencies)), ("max", max(latencies)))})
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the PDF Tool HTTP API.")
+    parser.add_argument("file", help="file sent as the body of every request")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="API base URL (default: %(default)s)")
+    parser.add_argument("--path", default="/compress", help="endpoint and query string (default: %(default)s)")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="concurrent connections (default: 4)")
+    parser.add_argument("-n", "--requests", type=int, default=100, help="total requests (default: 100)")
+    parser.add_argument("--warmup", type=int, default=2, help="requests sent first and not measured (default: 2)")
+    args = parser.parse_args(argv)
+
+    with open(args.file, "rb") as f:
+        body = f.read()
+    content_type = "application/pdf" if args.file.lower().endswith(".pdf") else "application/octet-stream"
+    if args.warmup:
+        run(args.url, args.path, body, content_type, 1, args.warmup)
+    summary = run(args.url, args.path, body, content_type, max(1, args.concurrency), args.requests)
+    json.dump(summary, sys.stdout, indent=2)
+    print()
+    return 0 if not summary["errors"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
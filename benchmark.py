@@ -0,0 +1,381 @@
+"""Benchmarks for the PDF Tool operations on a generated, reproducible corpus.
+
+    python benchmark.py run -o before.json
+    python benchmark.py run -o after.json
+    python benchmark.py compare before.json after.json
+
+Every case runs in a fresh process, so peak memory is measured per case.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from statistics import median
+
+import fitz
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+
+import operations
+import pdf_cli
+import pdf_ops
+
+
+SEED = 1234
+DEFAULT_CORPUS_DIR = os.path.join("benchmarks", "corpus")
+
+# Metric -> smallest change that counts, so noise on tiny values is not flagged
+METRIC_FLOORS = {
+    "wall_seconds": 0.05,
+    "cpu_seconds": 0.05,
+    "peak_rss_mb": 5,
+    "output_bytes": 1024,
+}
+
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore "
+         "et dolore magna aliqua enim ad minim veniam quis nostrud exercitation ullamco laboris nisi aliquip "
+         "ex ea commodo consequat duis aute irure in reprehenderit voluptate velit esse cillum").split()
+
+
+# --- Corpus ---
+
+def _sentence(rng, length):
+    return " ".join(rng.choice(WORDS) for _ in range(length)).capitalize() + "."
+
+
+def make_text_pdf(path, pages, rng):
+    """Dense text pages with a bookmark per ten-page chapter."""
+    c = canvas.Canvas(path, pagesize=letter)
+    width, height = letter
+    for page_num in range(pages):
+        if page_num % 10 == 0:
+            key = f"chapter{page_num // 10 + 1}"
+            c.bookmarkPage(key)
+            c.addOutlineEntry(f"Chapter {page_num // 10 + 1}", key, level=0)
+        text = c.beginText(54, height - 54)
+        text.setFont("Times-Roman", 10)
+        for _ in range(58):
+            text.textLine(_sentence(rng, 14))
+        c.drawText(text)
+        c.showPage()
+    c.save()
+
+
+def make_image_pdf(path, pages, rng):
+    """Pages each covered by a 200 dpi photo-like raster image."""
+    doc = fitz.open()
+    for _ in range(pages):
+        # Draw overlapping shapes on a scratch page and rasterize it, which
+        # gives smooth, compressible images without shipping any assets
+        scratch = fitz.open()
+        scratch_page = scratch.new_page()
+        for _ in range(40):
+            center = fitz.Point(rng.uniform(0, scratch_page.rect.width), rng.uniform(0, scratch_page.rect.height))
+            color = (rng.random(), rng.random(), rng.random())
+            scratch_page.draw_circle(center, rng.uniform(20, 200), color=None, fill=color, fill_opacity=0.6)
+        pixmap = scratch_page.get_pixmap(dpi=200)
+        scratch.close()
+        page = doc.new_page()
+        page.insert_image(page.rect, pixmap=pixmap)
+        page.insert_text((54, 54), _sentence(rng, 8), fontsize=12)
+    doc.save(path, deflate=True)
+    doc.close()
+
+
+def make_many_pages_pdf(path, pages, rng):
+    """Many short pages, as in long scanned-report exports."""
+    doc = fitz.open()
+    for page_num in range(pages):
+        page = doc.new_page()
+        page.insert_text((54, 72), f"Page {page_num + 1}", fontsize=14)
+        page.insert_text((54, 100), _sentence(rng, 10), fontsize=10)
+    doc.save(path, deflate=True)
+    doc.close()
+
+
+def make_python_source(path, functions, rng):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('"""Generated benchmark module."""\nimport math\n\n\n')
+        for i in range(functions):
+            f.write(f"def function_{i}(values, scale={rng.randint(1, 9)}):\n")
+            f.write(f'    """{_sentence(rng, 8)}"""\n')
+            f.write("    total = 0\n    for value in values:\n")
+            f.write(f"        total += math.sqrt(abs(value)) * scale  # {_sentence(rng, 4)}\n")
+            f.write("    return total\n\n\n")
+
+
+def make_notebook(path, cells, rng):
+    """A notebook mixing markdown (with horizontal rules) and code cells with outputs."""
+    notebook_cells = []
+    for i in range(cells):
+        if i % 2 == 0:
+            notebook_cells.append({"cell_type": "markdown", "id": f"cell-{i}", "metadata": {},
+                                   "source": [f"## Section {i // 2 + 1}\n", "\n", _sentence(rng, 20) + "\n", "\n", "---\n"]})
+        else:
+            notebook_cells.append({
+                "cell_type": "code", "id": f"cell-{i}", "execution_count": i, "metadata": {},
+                "source": [f"values = [x * {rng.randint(2, 9)} for x in range(10)]\n", "print(sum(values))"],
+                "outputs": [{"name": "stdout", "output_type": "stream", "text": [f"{rng.randint(100, 999)}\n"]}],
+            })
+    notebook = {
+        "cells": notebook_cells,
+        "metadata": {"kernelspec": {"display_name": "Python 3", "language": "python", "name": "python3"},
+                     "language_info": {"name": "python"}},
+        "nbformat": 4, "nbformat_minor": 5,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(notebook, f, indent=1)
+
+
+def make_text_file(path, lines, rng):
+    with open(path, "w", encoding="utf-8") as f:
+        for _ in range(lines):
+            f.write(_sentence(rng, rng.randint(4, 30)) + "\n")
+
+
+# File name -> (generator, size at scale 1)
+CORPUS = {
+    "text_heavy.pdf": (make_text_pdf, 60),
+    "image_heavy.pdf": (make_image_pdf, 12),
+    "many_pages.pdf": (make_many_pages_pdf, 1500),
+    "source.py": (make_python_source, 150),
+    "notebook.ipynb": (make_notebook, 40),
+    "notes.txt": (make_text_file, 5000),
+}
+
+
+def build_corpus(corpus_dir, scale=1.0):
+    """Generates the corpus into `corpus_dir` (once per scale); returns {name: path}."""
+    os.makedirs(corpus_dir, exist_ok=True)
+    paths = {}
+    for name, (generate, size) in CORPUS.items():
+        stem, extension = os.path.splitext(name)
+        path = os.path.join(corpus_dir, f"{stem}_x{scale:g}{extension}")
+        if not os.path.exists(path):
+            # Each file gets its own seeded generator, so files do not depend on each other
+            generate(path + ".part", max(1, round(size * scale)), random.Random(f"{SEED}:{name}"))
+            os.replace(path + ".part", path)
+        paths[name] = path
+    return paths
+
+
+# --- Cases ---
+
+def benchmark_cases(corpus):
+    """Returns (case id, command, inputs, params) for every operation on the corpus."""
+    cases = []
+    pdfs = [path for name, path in corpus.items() if name.endswith(".pdf")]
+    for path in pdfs:
+        name = os.path.basename(path)
+        with fitz.open(path) as doc:
+            total_pages = doc.page_count
+        cases += [
+            (f"compress/{name}", "compress", [path], {"level": 3, "sharded": False, "adaptive": False}),
+            (f"compress-sharded/{name}", "compress", [path], {"level": 3, "sharded": True, "adaptive": False}),
+            (f"compress-adaptive/{name}", "compress", [path], {"level": 3, "sharded": False, "adaptive": True}),
+            (f"extract-text/{name}", "extract-text", [path], {"workers": None}),
+            (f"extract-pages/{name}", "extract-pages", [path], {"pages": f"1-{max(1, total_pages // 2)}"}),
+            (f"split/{name}", "split", [path], {"split_mode": "Chunks of N pages", "pages_per_chunk": 10}),
+            (f"rotate/{name}", "rotate", [path], {"degrees": 90, "pages": None, "auto": False}),
+        ]
+    cases.append(("merge/all", "merge", pdfs, {}))
+    for name, path in corpus.items():
+        if name.endswith(operations.CONVERTIBLE_EXTENSIONS):
+            cases.append((f"convert/{os.path.basename(path)}", "convert", [path], {"line_numbers": False}))
+    return cases
+
+
+def _usage_totals():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def _reset_peak_rss():
+    """Resets the kernel's peak RSS of this process to its current RSS, where supported.
+
+    A spawned worker otherwise inherits the parent's peak through exec.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss_mb(pid="self"):
+    """Returns the peak RSS of this process or of the child `pid`; 0 for a child that cannot be read."""
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if pid != "self":
+        return 0.0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+
+
+def run_case(command, inputs, params):
+    """Runs one case in the current (fresh) process and returns its measurements.
+
+    CPU time includes the external tools (Ghostscript, xelatex) the operation
+    waited for and the shared process pool's workers (e.g. for text
+    extraction); peak memory is the sum of this process's and the workers'
+    peaks.
+    """
+    _reset_peak_rss()
+    cpu_start = _usage_totals()
+    start = time.perf_counter()
+    measurement = {}
+    try:
+        if command == "merge":
+            result = operations.merge(inputs)
+            measurement["output_bytes"] = result["size"]
+        else:
+            result = pdf_cli.run_operation(command, inputs[0], params)
+            measurement["output_bytes"] = sum((result[key] if key else result)["size"]
+                                              for _, key in pdf_cli.OUTPUTS[command])
+        measurement["status"] = "done"
+    except Exception as e:
+        measurement.update(status="failed", error=str(e))
+    measurement["wall_seconds"] = time.perf_counter() - start
+    # RUSAGE_CHILDREN only counts reaped children, and the pool's workers live
+    # until the pool is shut down; take their peaks first, while they still run
+    worker_peak_mb = sum(_peak_rss_mb(process.pid) for process in multiprocessing.active_children())
+    pdf_ops.shutdown_process_pool()
+    measurement["cpu_seconds"] = _usage_totals() - cpu_start
+    measurement["peak_rss_mb"] = _peak_rss_mb() + worker_peak_mb
+    return measurement
+
+
+def run_benchmarks(corpus, repeat=1, only=None):
+    """Runs every case `repeat` times, each in a new process; returns {case id: summary}."""
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for case_id, command, inputs, params in benchmark_cases(corpus):
+        if only and not any(pattern in case_id for pattern in only):
+            continue
+        samples = []
+        for _ in range(repeat):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                samples.append(pool.submit(run_case, command, inputs, params).result())
+        failed = [sample for sample in samples if sample["status"] == "failed"]
+        summary = {"command": command, "inputs": [os.path.basename(path) for path in inputs], "params": params,
+                   "status": "failed" if failed else "done"}
+        if failed:
+            summary["error"] = failed[0]["error"]
+        else:
+            # Medians damp one-off scheduler noise when repeating
+            for metric in METRIC_FLOORS:
+                summary[metric] = round(median(sample[metric] for sample in samples), 4)
+        results[case_id] = summary
+        print(f"{case_id:45} {_format_case(summary)}", file=sys.stderr)
+    return results
+
+
+def _format_case(summary):
+    if summary["status"] != "done":
+        return f"failed: {summary['error'][:80]}"
+    return (f"{summary['wall_seconds']:8.3f}s wall {summary['cpu_seconds']:8.3f}s cpu "
+            f"{summary['peak_rss_mb']:8.1f} MB {summary['output_bytes']:>12,} bytes")
+
+
+# --- Comparison ---
+
+def compare_runs(baseline, current, threshold):
+    """Compares two benchmark files; returns (rows, regressions).
+
+    A metric regresses when it grows by more than `threshold` (a fraction) and
+    by more than its floor in METRIC_FLOORS. A case that stopped succeeding
+    is always a regression.
+    """
+    rows, regressions = [], []
+    for case_id, new in current["cases"].items():
+        old = baseline["cases"].get(case_id)
+        if old is None:
+            continue
+        if old["status"] == "done" and new["status"] != "done":
+            regressions.append((case_id, "status", old["status"], new["status"]))
+            continue
+        if old["status"] != "done" or new["status"] != "done":
+            continue
+        for metric, floor in METRIC_FLOORS.items():
+            before, after = old[metric], new[metric]
+            change = (after - before) / before if before else 0.0
+            regressed = after - before > floor and change > threshold
+            rows.append((case_id, metric, before, after, change, regressed))
+            if regressed:
+                regressions.append((case_id, metric, before, after))
+    return rows, regressions
+
+
+def print_comparison(rows, regressions):
+    for case_id, metric, before, after, change, regressed in rows:
+        marker = "REGRESSION" if regressed else ""
+        print(f"{case_id:45} {metric:14} {before:>14.3f} -> {after:>14.3f} {change:+8.1%} {marker}")
+    print()
+    if regressions:
+        print(f"{len(regressions)} regression(s):")
+        for case_id, metric, before, after in regressions:
+            print(f"  {case_id}: {metric} {before} -> {after}")
+    else:
+        print("No regressions.")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="benchmark", description="Benchmark the PDF Tool operations.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    sub = subparsers.add_parser("run", help="generate the corpus and time every operation on it")
+    sub.add_argument("-o", "--output", required=True, help="results JSON file")
+    sub.add_argument("--corpus", default=DEFAULT_CORPUS_DIR, help=f"corpus directory (default: {DEFAULT_CORPUS_DIR})")
+    sub.add_argument("--scale", type=float, default=1.0, help="multiplies the corpus document sizes (default: 1)")
+    sub.add_argument("--repeat", type=int, default=3, help="runs per case; medians are recorded (default: 3)")
+    sub.add_argument("--only", nargs="+", help="run only cases whose id contains one of these strings")
+
+    sub = subparsers.add_parser("compare", help="compare two runs and flag regressions")
+    sub.add_argument("baseline", help="results JSON of the reference run")
+    sub.add_argument("current", help="results JSON of the run to check")
+    sub.add_argument("--threshold", type=float, default=0.10,
+                     help="relative increase that counts as a regression (default: 0.10)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.command == "run":
+        corpus = build_corpus(args.corpus, args.scale)
+        results = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "scale": args.scale,
+            "repeat": args.repeat,
+            "corpus": {os.path.basename(path): os.path.getsize(path) for path in corpus.values()},
+            "cases": run_benchmarks(corpus, max(1, args.repeat), args.only),
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        return 0
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.current, "r", encoding="utf-8") as f:
+        current = json.load(f)
+    rows, regressions = compare_runs(baseline, current, args.threshold)
+    print_comparison(rows, regressions)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
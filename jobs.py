@@ -0,0 +1,391 @@
+import os
+import resource
+import subprocess
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import metrics
+
+
+JOB_WORKERS = int(os.environ.get("PDF_TOOL_JOB_WORKERS", str(2 * (os.cpu_count() or 1))))
+# Finished jobs are kept this long so their results can still be downloaded
+JOB_RETENTION_SECONDS = 3600
+
+# Global limit on concurrent child processes per external tool
+TOOL_LIMITS = {
+    "gs": int(os.environ.get("PDF_TOOL_GS_LIMIT", str(os.cpu_count() or 1))),
+    "xelatex": int(os.environ.get("PDF_TOOL_LATEX_WORKERS", str(os.cpu_count() or 1))),
+    "tesseract": int(os.environ.get("PDF_TOOL_OCR_WORKERS", str(os.cpu_count() or 1))),
+}
+_tool_semaphores = {tool: threading.BoundedSemaphore(limit) for tool, limit in TOOL_LIMITS.items()}
+
+MB = 1024 * 1024
+
+
+def _default_memory_budget_mb():
+    """Three quarters of the container's memory limit, or of physical memory without one."""
+    total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    try:
+        with open("/sys/fs/cgroup/memory.max", "r") as f:
+            limit = f.read().strip()
+        if limit != "max":
+            total = min(total, int(limit))
+    except (OSError, ValueError):
+        pass
+    return int(total * 0.75) // MB
+
+
+# Admission control: jobs declare an estimated memory cost and only start
+# once it fits in the budget next to the jobs already running, in
+# submission order. Jobs that could never fit, or arrive while the queue
+# is full, are rejected instead of taking the server down
+MEMORY_BUDGET = int(os.environ.get("PDF_TOOL_MEMORY_BUDGET_MB", str(_default_memory_budget_mb()))) * MB
+MAX_QUEUED_JOBS = int(os.environ.get("PDF_TOOL_MAX_QUEUE", "32"))
+# Hard caps applied to every external tool process
+CHILD_MEMORY_LIMIT = int(os.environ.get("PDF_TOOL_CHILD_MEMORY_MB", str(min(2048, MEMORY_BUDGET // MB)))) * MB
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="pdf-job")
+_jobs = {}
+_jobs_lock = threading.Lock()
+_local = threading.local()
+_admission = threading.Condition()
+_admission_queue = deque()
+_reserved_memory = 0
+
+
+class JobCancelled(Exception):
+    """Raised inside a job once it has been cancelled."""
+
+
+class Job:
+    """A unit of background work with progress, result and cancellation state."""
+
+    def __init__(self, kind, memory_cost=0, cpu_cost=0.0):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.memory_cost = memory_cost
+        self.cpu_cost = cpu_cost
+        self.status = "queued"
+        self.progress = 0.0
+        self.message = ""
+        self.preview = None
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self._cancel_event = threading.Event()
+        self._processes = set()
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        """Flags the job as cancelled and kills any child process it is running."""
+        self._cancel_event.set()
+        with self._lock:
+            for process in self._processes:
+                process.kill()
+
+
+def current_job():
+    """Returns the job running on this thread, or None outside a job."""
+    return getattr(_local, "job", None)
+
+
+@contextmanager
+def job_context(job):
+    """Runs the block as part of `job`, e.g. on a helper thread the job started."""
+    previous = current_job()
+    _local.job = job
+    try:
+        with metrics.operation_context(job.kind if job is not None else None):
+            yield job
+    finally:
+        _local.job = previous
+
+
+def check_cancelled():
+    """Raises JobCancelled if the current job has been cancelled."""
+    job = current_job()
+    if job is not None and job.cancelled:
+        raise JobCancelled()
+
+
+def report_progress(progress, message=None, preview=None):
+    """Updates the current job's progress (0-1), message and partial output preview.
+
+    A no-op outside a job. Raises JobCancelled if the job has been cancelled,
+    so long loops stop at their next progress report.
+    """
+    job = current_job()
+    if job is not None:
+        job.progress = progress
+        if message is not None:
+            job.message = message
+        if preview is not None:
+            job.preview = preview
+        check_cancelled()
+
+
+@contextmanager
+def tool_slot(tool):
+    """Holds one of the global slots for `tool` while its child process runs."""
+    semaphore = _tool_semaphores.get(tool)
+    if semaphore is None:
+        yield
+        return
+    job = current_job()
+    with metrics.span("tool_wait"):
+        while not semaphore.acquire(timeout=0.5):
+            if job is not None and job.cancelled:
+                raise JobCancelled()
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+
+def _peak_rss(pid):
+    """Returns the peak resident memory of a running child in bytes, or None once it has exited."""
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _wait(process, timeout):
+    """Collects the child's output and exit status; returns (stdout, stderr, rusage, peak_rss).
+
+    The child is reaped with os.wait4 so its own CPU time is known even while
+    other jobs run children concurrently. Its ru_maxrss also covers the
+    memory it inherited from this process before exec, so peak memory is
+    sampled from /proc while it runs instead.
+    """
+    timed_out = threading.Event()
+    exited = threading.Event()
+    peak_rss = [None]
+
+    def kill_on_timeout():
+        timed_out.set()
+        process.kill()
+
+    def sample_peak_rss():
+        while not exited.wait(metrics.RSS_SAMPLE_INTERVAL):
+            peak = _peak_rss(process.pid)
+            if peak is None:
+                break
+            peak_rss[0] = peak
+
+    timer = threading.Timer(timeout, kill_on_timeout)
+    timer.start()
+    sampler = threading.Thread(target=sample_peak_rss)
+    sampler.start()
+    try:
+        stderr = []
+        stderr_reader = threading.Thread(target=lambda: stderr.append(process.stderr.read()))
+        stderr_reader.start()
+        stdout = process.stdout.read()
+        stderr_reader.join()
+        # Stop sampling before the pid is reaped and can be reused
+        exited.set()
+        sampler.join()
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    finally:
+        exited.set()
+        timer.cancel()
+        process.stdout.close()
+        process.stderr.close()
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(process.args, timeout)
+    return stdout, stderr[0], rusage, peak_rss[0]
+
+
+def _limit_child(pid, cpu_seconds):
+    """Caps a child's address space at CHILD_MEMORY_LIMIT and its CPU time at `cpu_seconds`.
+
+    Applied from outside with prlimit right after the child starts, which
+    is safe with threads, unlike a preexec_fn.
+    """
+    try:
+        resource.prlimit(pid, resource.RLIMIT_AS, (CHILD_MEMORY_LIMIT, CHILD_MEMORY_LIMIT))
+        resource.prlimit(pid, resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 5))
+    except (OSError, AttributeError):
+        pass  # Already exited, or prlimit is not available on this platform
+
+
+def run_process(cmd, timeout, **popen_kwargs):
+    """Runs `cmd` like subprocess.run(capture_output=True, text=True).
+
+    The child is registered with the current job so cancelling the job kills
+    it, and it waits for a free slot of its tool first. Its memory and CPU
+    time are capped (see _limit_child); a child over its memory cap fails
+    to allocate and exits with an error. The returned
+    CompletedProcess also carries the child's resource usage as `rusage`
+    and its peak memory in bytes (or None) as `peak_rss`.
+    Raises subprocess.TimeoutExpired, FileNotFoundError or JobCancelled.
+    """
+    job = current_job()
+    tool = os.path.basename(cmd[0])
+    with tool_slot(tool), metrics.span("subprocess"):
+        check_cancelled()
+        start = time.perf_counter()
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, **popen_kwargs)
+        _limit_child(process.pid, int(timeout))
+        if job is not None:
+            with job._lock:
+                job._processes.add(process)
+                # Cancelled between the check above and registration: nobody else will kill it
+                if job.cancelled:
+                    process.kill()
+        try:
+            stdout, stderr, rusage, peak_rss = _wait(process, timeout)
+        except subprocess.TimeoutExpired:
+            metrics.record_subprocess(tool, time.perf_counter() - start, "timeout", 0.0, None)
+            raise
+        finally:
+            if job is not None:
+                with job._lock:
+                    job._processes.discard(process)
+        metrics.record_subprocess(tool, time.perf_counter() - start, process.returncode,
+                                  rusage.ru_utime + rusage.ru_stime, peak_rss)
+        check_cancelled()
+        result = subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+        result.rusage = rusage
+        result.peak_rss = peak_rss
+        return result
+
+
+def _update_queue_metrics():
+    counts = job_counts()
+    for status in ("queued", "running"):
+        metrics.set_gauge("pdf_tool_jobs", {"status": status}, counts[status])
+    metrics.set_gauge("pdf_tool_admission_reserved_bytes", {}, counts["reserved_memory"])
+    metrics.set_gauge("pdf_tool_admission_budget_bytes", {}, MEMORY_BUDGET)
+
+
+def _admit(job):
+    """Waits until the job is first in line and its memory cost fits; returns False if cancelled meanwhile.
+
+    A job is always admitted when nothing else holds memory, so one whose
+    estimate is too high still runs eventually rather than blocking the queue.
+    """
+    global _reserved_memory
+    with _admission:
+        _admission_queue.append(job)
+        try:
+            while _admission_queue[0] is not job or (_reserved_memory and _reserved_memory + job.memory_cost > MEMORY_BUDGET):
+                if job.cancelled:
+                    return False
+                ahead = _admission_queue.index(job)
+                job.message = (f"Waiting for memory: {job.memory_cost // MB} MB needed, "
+                               f"{max(MEMORY_BUDGET - _reserved_memory, 0) // MB} MB free"
+                               + (f" · {ahead} job(s) ahead" if ahead else ""))
+                _admission.wait(0.5)
+            _reserved_memory += job.memory_cost
+            job.message = ""
+            return True
+        finally:
+            _admission_queue.remove(job)
+            _admission.notify_all()
+
+
+def _release(job):
+    global _reserved_memory
+    with _admission:
+        _reserved_memory -= job.memory_cost
+        _admission.notify_all()
+
+
+def _run(job, fn, args, kwargs):
+    with job_context(job):
+        if job.cancelled or not _admit(job):
+            job.status = "cancelled"
+        else:
+            job.status = "running"
+            _update_queue_metrics()
+            try:
+                with metrics.track_operation(job.kind) as operation:
+                    try:
+                        job.result = fn(*args, **kwargs)
+                        job.progress = 1.0
+                        job.status = "done"
+                    except JobCancelled:
+                        job.status = "cancelled"
+                    except Exception as e:
+                        job.error = str(e)
+                        job.status = "failed"
+                    operation["status"] = job.status
+            finally:
+                _release(job)
+    job.finished = time.time()
+    _update_queue_metrics()
+
+
+def _prune():
+    cutoff = time.time() - JOB_RETENTION_SECONDS
+    with _jobs_lock:
+        for job_id in [job_id for job_id, job in _jobs.items() if job.finished and job.finished < cutoff]:
+            del _jobs[job_id]
+
+
+def submit_job(kind, fn, *args, cost=None, **kwargs):
+    """Queues `fn(*args, **kwargs)` on the shared job pool and returns its Job.
+
+    `cost` is the job's estimated (memory bytes, CPU seconds); the job starts
+    once that memory is available. If it can never fit in MEMORY_BUDGET or
+    MAX_QUEUED_JOBS are already waiting, the job is returned "rejected",
+    with the reason as its error, and never runs.
+    """
+    _prune()
+    memory_cost, cpu_cost = cost or (0, 0.0)
+    job = Job(kind, memory_cost, cpu_cost)
+    with _jobs_lock:
+        _jobs[job.id] = job
+    queued = job_counts()["queued"] - 1
+    if memory_cost > MEMORY_BUDGET:
+        job.error = (f"This file needs about {memory_cost // MB} MB to process, more than this server's "
+                     f"{MEMORY_BUDGET // MB} MB limit. Try a smaller file or split it first.")
+    elif queued >= MAX_QUEUED_JOBS:
+        job.error = f"The server is busy ({queued} jobs waiting). Please try again in a few minutes."
+    if job.error:
+        job.status = "rejected"
+        job.finished = time.time()
+        metrics.inc("pdf_tool_jobs_rejected_total", {"reason": "too_large" if memory_cost > MEMORY_BUDGET else "queue_full"})
+        return job
+    _executor.submit(_run, job, fn, args, kwargs)
+    _update_queue_metrics()
+    return job
+
+
+def get_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def cancel_job(job_id):
+    job = get_job(job_id)
+    if job is not None:
+        job.cancel()
+
+
+def job_counts():
+    """Returns the number of queued and running jobs and the memory reserved by running ones."""
+    with _jobs_lock:
+        statuses = [job.status for job in _jobs.values()]
+    return {"queued": statuses.count("queued"), "running": statuses.count("running"),
+            "reserved_memory": _reserved_memory, "memory_budget": MEMORY_BUDGET}
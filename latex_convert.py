@@ -0,0 +1,368 @@
+import base64
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+import metrics
+from jobs import run_process
+from metrics import span
+from result_cache import make_cache_key
+
+
+FORMAT_DIR = os.environ.get(
+    "PDF_TOOL_LATEX_FORMAT_DIR", os.path.join(tempfile.gettempdir(), "pdf_tool_latex_formats"))
+XELATEX_TIMEOUT = 120
+
+# Log messages after which LaTeX needs another pass to settle references
+RERUN_PATTERN = re.compile(r"Rerun to get|Label\(s\) may have changed|Please rerun LaTeX|rerunfilecheck Warning")
+
+# XeTeX cannot dump a format with OpenType fonts loaded, so the dumped part of
+# the nbconvert preamble ends before its engine-specific font setup
+_DUMP_END_PATTERN = re.compile(r"^[ \t]*\\usepackage\{iftex\}", re.MULTILINE)
+# Ends the dumped preamble when compiling with the format, and does nothing without it
+_END_OF_DUMP = "\\csname endofdump\\endcsname\n"
+
+_format_lock = threading.Lock()
+_format_state = {}
+_latency_lock = threading.Lock()
+_latencies = {"cold": [], "warm": []}
+
+
+def _record_latency(kind, seconds):
+    with _latency_lock:
+        _latencies[kind].append(seconds)
+    metrics.observe("pdf_tool_latex_compile_seconds", {"kind": kind}, seconds)
+
+
+def latex_latency_stats():
+    """Returns count and mean seconds of cold (no format) and warm (precompiled format) compiles."""
+    with _latency_lock:
+        return {
+            kind: {"count": len(values), "mean_seconds": sum(values) / len(values) if values else 0.0}
+            for kind, values in _latencies.items()
+        }
+
+
+def _run_xelatex(args, cwd, env=None):
+    """Runs one xelatex pass and returns (success, error).
+
+    Concurrent xelatex processes are capped globally by the "xelatex" tool
+    limit in jobs.TOOL_LIMITS (PDF_TOOL_LATEX_WORKERS).
+    """
+    try:
+        result = run_process(["xelatex", "-interaction=batchmode", *args], timeout=XELATEX_TIMEOUT, cwd=cwd, env=env)
+    except FileNotFoundError:
+        return False, "Required external tool not found: xelatex. Check if dependencies are installed in `packages.txt`."
+    except subprocess.TimeoutExpired:
+        return False, f"xelatex timed out after {XELATEX_TIMEOUT} seconds."
+    return result.returncode == 0, result.stderr or result.stdout
+
+
+def _needs_rerun(log_path):
+    try:
+        with open(log_path, "r", encoding="utf-8", errors="replace") as f:
+            return RERUN_PATTERN.search(f.read()) is not None
+    except FileNotFoundError:
+        return True
+
+
+def _format_name(preamble):
+    return "preamble_" + hashlib.sha256(preamble.encode("utf-8")).hexdigest()[:12]
+
+
+def _build_format(preamble):
+    """Dumps `preamble` into a format file with mylatexformat; returns its name or None.
+
+    The format is built in a private directory and moved into FORMAT_DIR, so
+    processes building the same format at once do not read a partial file.
+    """
+    format_name = _format_name(preamble)
+    with _format_lock:
+        if format_name in _format_state:
+            return _format_state[format_name]
+        os.makedirs(FORMAT_DIR, exist_ok=True)
+        format_path = os.path.join(FORMAT_DIR, f"{format_name}.fmt")
+        if not os.path.exists(format_path):
+            build_dir = tempfile.mkdtemp(dir=FORMAT_DIR)
+            try:
+                with open(os.path.join(build_dir, f"{format_name}.tex"), "w", encoding="utf-8") as f:
+                    f.write(preamble + "\\begin{document}\n\\end{document}\n")
+                _run_xelatex(["-ini", f"-jobname={format_name}", "&xelatex", "mylatexformat.ltx", f"{format_name}.tex"],
+                             build_dir)
+                if os.path.exists(os.path.join(build_dir, f"{format_name}.fmt")):
+                    os.replace(os.path.join(build_dir, f"{format_name}.fmt"), format_path)
+            finally:
+                shutil.rmtree(build_dir, ignore_errors=True)
+        _format_state[format_name] = format_name if os.path.exists(format_path) else None
+        return _format_state[format_name]
+
+
+def compile_latex(tex_path, preamble=None, max_passes=1):
+    """Compiles `tex_path` in its own directory and returns (success, error, kind).
+
+    When `preamble` is given, the document is compiled against a precompiled
+    format of it (a "warm" compile), falling back to a full cold compile if
+    the format cannot be built or used. Extra passes only run while the log
+    asks for a rerun.
+    """
+    start = time.perf_counter()
+    cwd = os.path.dirname(tex_path)
+    tex_name = os.path.basename(tex_path)
+    pdf_path = os.path.splitext(tex_path)[0] + ".pdf"
+    log_path = os.path.splitext(tex_path)[0] + ".log"
+
+    format_ready = preamble is not None and _format_state.get(_format_name(preamble)) is not None
+    format_name = _build_format(preamble) if preamble else None
+    attempts = []
+    if format_name:
+        # The compile that had to build the format still counts as cold
+        env = dict(os.environ, TEXFORMATS=FORMAT_DIR + os.pathsep)
+        attempts.append(("warm" if format_ready else "cold", [f"-fmt={format_name}"], env))
+    attempts.append(("cold", [], None))
+
+    error = "LaTeX compilation failed."
+    for kind, args, env in attempts:
+        for _ in range(max_passes):
+            success, error = _run_xelatex(args + [tex_name], cwd, env)
+            if not os.path.exists(pdf_path) or not _needs_rerun(log_path):
+                break
+        if os.path.exists(pdf_path):
+            _record_latency(kind, time.perf_counter() - start)
+            return True, None, kind
+        if env is not None:
+            # A format xelatex cannot load (e.g. after a TeX update) is not tried again
+            with _format_lock:
+                _format_state[format_name] = None
+    return False, error or "LaTeX compilation failed.", None
+
+
+def split_preamble(tex):
+    """Returns (preamble, tex): the part of the preamble to precompile, or None, and
+    the document with that part marked for mylatexformat."""
+    match = _DUMP_END_PATTERN.search(tex)
+    if match is None or "\\begin{document}" not in tex[match.start():]:
+        return None, tex
+    return tex[:match.start()], tex[:match.start()] + _END_OF_DUMP + tex[match.start():]
+
+
+# --- Notebook conversion ---
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_latex_exporter():
+    """Returns the process-wide nbconvert LatexExporter, creating it on first use.
+
+    Creating the exporter loads nbconvert, its Jinja templates and Pygments,
+    which is most of the cost of a jupyter-nbconvert run.
+    """
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None:
+            from nbconvert import LatexExporter
+            _exporter = LatexExporter()
+        return _exporter
+
+
+def prepare_notebook(notebook_source, title):
+    """Parses the notebook and applies the markdown fixes needed before export."""
+    import nbformat
+
+    with span("parse"):
+        notebook = nbformat.reads(notebook_source, as_version=4)
+    # Set title metadata
+    notebook.metadata["title"] = title
+
+    # Fix markdown cells to prevent YAML parsing issues
+    for cell in notebook.cells:
+        if cell.cell_type == "markdown":
+            # A line that is exactly "---" would be read as YAML front matter by
+            # pandoc; an HTML <hr> renders as the intended horizontal line
+            cell.source = "".join(
+                "<hr>\n" if line.strip() == "---" else line
+                for line in cell.source.splitlines(keepends=True)
+            )
+    return notebook
+
+
+def _export_latex(notebook, work_dir, output_name):
+    """Runs nbconvert on the notebook; returns the LaTeX and the extracted {file name: bytes}."""
+    resources = {
+        "unique_key": output_name,
+        "output_files_dir": f"{output_name}_files",
+        "metadata": {"name": notebook.metadata.get("title", output_name), "path": work_dir},
+    }
+    exporter = get_latex_exporter()
+    # Exporters keep per-call state on their preprocessors, so share one at a time
+    with _exporter_lock:
+        body, resources = exporter.from_notebook_node(notebook, resources=resources)
+    return body, resources.get("outputs", {})
+
+
+def _write_outputs(outputs, work_dir):
+    for filename, data in outputs.items():
+        path = os.path.join(work_dir, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+
+# --- Per-cell render cache ---
+# With a result cache, every cell's LaTeX and figures are cached under a hash
+# of the cell (after prepare_notebook), and only cells not in the cache are
+# exported: they go through nbconvert together, separated by raw LaTeX
+# comment cells, and the output is cut back into per-cell fragments. Cell
+# hashes include the notebook's language and kernel, which decide how code
+# is highlighted. The document head and tail are cached under the notebook
+# metadata.
+
+_CELL_MARKER = "%% pdf-tool cell {}"
+_CELL_MARKER_PATTERN = re.compile(r"^[ \t]*%% pdf-tool cell (\w+)[ \t]*$", re.MULTILINE)
+
+
+def _cache_key(kind, data):
+    import nbconvert
+    return make_cache_key(kind, [json.dumps(data, sort_keys=True).encode("utf-8")], nbconvert=nbconvert.__version__)
+
+
+def _export_fragments(notebook, cells, work_dir, output_name):
+    """Exports `cells` (cell hash -> cell) of the notebook; returns (head, tail, {cell hash: fragment}).
+
+    A fragment is {"tex", "files"}, with figure files renamed after the cell
+    hash so they keep their names whatever position the cell is exported at.
+    Returns None if the markers did not survive the export.
+    """
+    import nbformat
+
+    partial = nbformat.from_dict(dict(notebook, cells=[]))
+    for cell_hash, cell in list(cells.items()) + [("end", None)]:
+        partial.cells.append(nbformat.v4.new_raw_cell(_CELL_MARKER.format(cell_hash), metadata={"raw_mimetype": "text/latex"}))
+        if cell is not None:
+            partial.cells.append(cell)
+    body, outputs = _export_latex(partial, work_dir, output_name)
+
+    parts = _CELL_MARKER_PATTERN.split(body)
+    if parts[1::2] != list(cells) + ["end"]:
+        return None
+    head, tail = parts[0], parts[-1]
+    fragments = {}
+    for cell_hash, tex in zip(parts[1:-2:2], parts[2:-1:2]):
+        files = {}
+        for filename, data in outputs.items():
+            if filename in tex:
+                renamed = f"{output_name}_files/{cell_hash[:16]}_{os.path.basename(filename)}"
+                tex = tex.replace(filename, renamed)
+                files[renamed] = base64.b64encode(data).decode("ascii")
+        fragments[cell_hash] = {"tex": tex, "files": files}
+    return head, tail, fragments
+
+
+def _cell_hashes(notebook):
+    """Returns the cache key of every cell, which covers the notebook's language and kernel."""
+    # Cell ids do not affect the output, so they are left out of the hash
+    language = {key: notebook.metadata.get(key) for key in ("language_info", "kernelspec")}
+    return [_cache_key("notebook_cell", dict(language, cell={k: v for k, v in cell.items() if k != "id"}))
+            for cell in notebook.cells]
+
+
+def _cached_latex(notebook, work_dir, output_name, cache, stats):
+    """Builds the notebook's LaTeX from cached cell fragments, exporting only the missing cells."""
+    cell_hashes = _cell_hashes(notebook)
+    frame_key = _cache_key("notebook_frame", notebook.metadata)
+    fragments = {}
+    for cell_hash in set(cell_hashes):
+        cached = cache.get(cell_hash)
+        if cached is not None:
+            fragments[cell_hash] = json.loads(cached)
+    cached_frame = cache.get(frame_key)
+    missing = {cell_hash: cell for cell_hash, cell in zip(cell_hashes, notebook.cells) if cell_hash not in fragments}
+
+    if missing or cached_frame is None:
+        export = _export_fragments(notebook, missing, work_dir, output_name)
+        if export is None:
+            body, outputs = _export_latex(notebook, work_dir, output_name)
+            _write_outputs(outputs, work_dir)
+            return body
+        head, tail, exported = export
+        cache.put(frame_key, json.dumps({"head": head, "tail": tail}).encode("utf-8"))
+        for cell_hash, fragment in exported.items():
+            cache.put(cell_hash, json.dumps(fragment).encode("utf-8"))
+        fragments.update(exported)
+    else:
+        frame = json.loads(cached_frame)
+        head, tail = frame["head"], frame["tail"]
+    if stats is not None:
+        stats.update(cells=len(cell_hashes), cells_rendered=len(missing))
+
+    for cell_hash in set(cell_hashes):
+        _write_outputs({filename: base64.b64decode(data) for filename, data in fragments[cell_hash]["files"].items()},
+                       work_dir)
+    return head + "".join(fragments[cell_hash]["tex"] for cell_hash in cell_hashes) + tail
+
+
+def notebook_to_latex(notebook, work_dir, output_name="notebook_output", cache=None, stats=None):
+    """Exports a parsed notebook to `<output_name>.tex` in `work_dir` and returns its path.
+
+    Extracted figures are written next to it in `<output_name>_files/`, as
+    jupyter-nbconvert would. With a ResultCache, cells rendered before are
+    taken from it (see _cached_latex), and the number of cells and of cells
+    rendered now are put in `stats` if given.
+    """
+    if cache is not None:
+        body = _cached_latex(notebook, work_dir, output_name, cache, stats)
+    else:
+        body, outputs = _export_latex(notebook, work_dir, output_name)
+        _write_outputs(outputs, work_dir)
+
+    tex_path = os.path.join(work_dir, f"{output_name}.tex")
+    with open(tex_path, "w", encoding="utf-8") as f:
+        f.write(body)
+    return tex_path
+
+
+def convert_notebook_to_pdf(notebook_source, title, work_dir, output_path, cache=None, stats=None):
+    """Converts notebook JSON text into `output_path`; returns (success, error, kind).
+
+    `kind` is "cold" or "warm" (see compile_latex); the package-loading part
+    of the nbconvert preamble is precompiled into a format. With a
+    ResultCache, unchanged cells are not exported again, and when the
+    resulting LaTeX (which names every figure after its cell) matches an
+    earlier conversion, that PDF is reused without running xelatex ("cached").
+    """
+    try:
+        notebook = prepare_notebook(notebook_source, title)
+        tex_path = notebook_to_latex(notebook, work_dir, cache=cache, stats=stats)
+    except Exception as e:
+        return False, f"Notebook → LaTeX failed: {e}", None
+
+    pdf_key = None
+    if cache is not None:
+        with open(tex_path, "rb") as f:
+            pdf_key = make_cache_key("notebook_pdf", [f.read()])
+        cached_pdf = cache.get(pdf_key)
+        if cached_pdf is not None:
+            with open(output_path, "wb") as f:
+                f.write(cached_pdf)
+            return True, None, "cached"
+
+    with open(tex_path, "r", encoding="utf-8") as f:
+        preamble, tex = split_preamble(f.read())
+    with open(tex_path, "w", encoding="utf-8") as f:
+        f.write(tex)
+
+    # Compile LaTeX to PDF; the second pass only runs if the log asks for a rerun
+    success, _, kind = compile_latex(tex_path, preamble=preamble, max_passes=2)
+    if not success:
+        return False, "LaTeX compilation failed for notebook.", None
+    os.rename(os.path.splitext(tex_path)[0] + ".pdf", output_path)
+    if pdf_key is not None:
+        with open(output_path, "rb") as f:
+            cache.put(pdf_key, f.read())
+    return True, None, kind
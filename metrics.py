@@ -0,0 +1,252 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Metrics are exported in the Prometheus text format to PDF_TOOL_METRICS_FILE
+# (rewritten after every operation) and/or served on 127.0.0.1 at
+# PDF_TOOL_METRICS_PORT; both are off unless set
+METRICS_FILE = os.environ.get("PDF_TOOL_METRICS_FILE")
+METRICS_PORT = int(os.environ.get("PDF_TOOL_METRICS_PORT", "0"))
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+RSS_SAMPLE_INTERVAL = 0.05
+
+# Metric name -> (type, help)
+METRICS = {
+    "pdf_tool_operation_seconds": ("histogram", "Wall time of background operations."),
+    "pdf_tool_operation_peak_rss_bytes": ("gauge", "Peak resident memory of the server process during the last run of the operation."),
+    "pdf_tool_stage_seconds": ("histogram", "Time spent in each stage of an operation, excluding nested stages."),
+    "pdf_tool_subprocess_seconds": ("histogram", "Wall time of external tool runs."),
+    "pdf_tool_latex_compile_seconds": ("histogram", "Wall time of LaTeX compiles, cold (no format) or warm (precompiled format)."),
+    "pdf_tool_subprocess_cpu_seconds_total": ("counter", "CPU time used by external tool runs."),
+    "pdf_tool_subprocess_exits_total": ("counter", "External tool runs by exit code."),
+    "pdf_tool_subprocess_peak_rss_bytes": ("gauge", "Peak resident memory of the last run of the external tool."),
+    "pdf_tool_process_resident_bytes": ("gauge", "Current resident memory of the server process."),
+    "pdf_tool_jobs": ("gauge", "Background jobs by status."),
+    "pdf_tool_jobs_rejected_total": ("counter", "Jobs rejected by admission control, by reason."),
+    "pdf_tool_admission_reserved_bytes": ("gauge", "Estimated memory reserved by running jobs."),
+    "pdf_tool_admission_budget_bytes": ("gauge", "Memory budget for running jobs."),
+}
+
+_lock = threading.Lock()
+# (name, sorted label items) -> value; histograms hold [bucket counts, sum, count]
+_values = {}
+_local = threading.local()
+_active_peaks = {}
+_sampler_wakeup = threading.Event()
+_sampler = None
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def observe(name, labels, value):
+    """Adds a value to a histogram."""
+    with _lock:
+        histogram = _values.setdefault(_key(name, labels), [[0] * len(DURATION_BUCKETS), 0.0, 0])
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if value <= bound:
+                histogram[0][i] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+
+def inc(name, labels, amount=1):
+    with _lock:
+        key = _key(name, labels)
+        _values[key] = _values.get(key, 0) + amount
+
+
+def set_gauge(name, labels, value):
+    with _lock:
+        _values[_key(name, labels)] = value
+
+
+def rss_bytes():
+    """Returns the current resident memory of this process, or None where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+# --- Spans ---
+
+def current_operation():
+    return getattr(_local, "operation", None) or "other"
+
+
+@contextmanager
+def operation_context(operation):
+    """Labels the spans recorded on this thread with `operation`."""
+    previous = getattr(_local, "operation", None)
+    _local.operation = operation
+    try:
+        yield
+    finally:
+        _local.operation = previous
+
+
+@contextmanager
+def span(stage, operation=None):
+    """Times the block as `stage` of the current operation.
+
+    Spans nest; each records only the time not spent in spans opened inside
+    it on the same thread, so the stages of an operation add up to its total.
+    """
+    stack = _local.__dict__.setdefault("spans", [])
+    nested = [0.0]
+    stack.append(nested)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stack.pop()
+        if stack:
+            stack[-1][0] += elapsed
+        observe("pdf_tool_stage_seconds", {"operation": operation or current_operation(), "stage": stage},
+                max(elapsed - nested[0], 0.0))
+
+
+def _sample_rss():
+    while True:
+        _sampler_wakeup.wait()
+        rss = rss_bytes() or 0
+        with _lock:
+            if not _active_peaks:
+                _sampler_wakeup.clear()
+                continue
+            for token, peak in _active_peaks.items():
+                _active_peaks[token] = max(peak, rss)
+        time.sleep(RSS_SAMPLE_INTERVAL)
+
+
+@contextmanager
+def track_operation(operation):
+    """Records an operation's wall time, status and the process's peak memory while it ran.
+
+    Yields a dict in which the caller sets "status"; anything left in the
+    block's own code is counted as its "transform" stage.
+    """
+    global _sampler
+    outcome = {"status": "failed"}
+    token = object()
+    with _lock:
+        _active_peaks[token] = rss_bytes() or 0
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample_rss, name="metrics-rss", daemon=True)
+            _sampler.start()
+    _sampler_wakeup.set()
+    start = time.perf_counter()
+    try:
+        with operation_context(operation), span("transform"):
+            yield outcome
+    finally:
+        with _lock:
+            peak = max(_active_peaks.pop(token), rss_bytes() or 0)
+        observe("pdf_tool_operation_seconds", {"operation": operation, "status": outcome["status"]},
+                time.perf_counter() - start)
+        set_gauge("pdf_tool_operation_peak_rss_bytes", {"operation": operation}, peak)
+        if METRICS_FILE:
+            write_metrics_file(METRICS_FILE)
+
+
+def record_subprocess(tool, seconds, exit_code, cpu_seconds, peak_rss):
+    labels = {"tool": tool}
+    observe("pdf_tool_subprocess_seconds", labels, seconds)
+    inc("pdf_tool_subprocess_cpu_seconds_total", labels, cpu_seconds)
+    inc("pdf_tool_subprocess_exits_total", {"tool": tool, "exit_code": str(exit_code)})
+    if peak_rss:
+        set_gauge("pdf_tool_subprocess_peak_rss_bytes", labels, peak_rss)
+
+
+# --- Export ---
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+def render_prometheus():
+    """Returns every metric in the Prometheus text exposition format."""
+    set_gauge("pdf_tool_process_resident_bytes", {}, rss_bytes() or 0)
+    with _lock:
+        values = sorted(_values.items())
+    lines = []
+    for name, (metric_type, help_text) in METRICS.items():
+        series = [(labels, value) for (metric, labels), value in values if metric == name]
+        if not series:
+            continue
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+        for labels, value in series:
+            if metric_type == "histogram":
+                bucket_counts, total, count = value
+                for bound, bucket_count in zip(DURATION_BUCKETS, bucket_counts):
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', f'{bound:g}'),))} {bucket_count}")
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {total:.6f}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+            else:
+                formatted = str(value) if isinstance(value, int) else f"{value:.6f}"
+                lines.append(f"{name}{_format_labels(labels)} {formatted}")
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics_file(path):
+    """Atomically replaces `path` with the current metrics, e.g. for a node exporter textfile collector."""
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(render_prometheus())
+    os.replace(temp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port=METRICS_PORT, host="127.0.0.1"):
+    """Serves /metrics on a daemon thread; returns the server, or None if disabled or the port is taken."""
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError:
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def stage_summary():
+    """Returns per-operation stage and external tool totals for the debug panel."""
+    with _lock:
+        values = list(_values.items())
+    rows = []
+    for (name, labels), value in values:
+        labels = dict(labels)
+        if name == "pdf_tool_stage_seconds":
+            rows.append({"operation": labels["operation"], "stage": labels["stage"],
+                         "count": value[2], "total_s": round(value[1], 3), "mean_s": round(value[1] / value[2], 4)})
+        elif name == "pdf_tool_subprocess_seconds":
+            rows.append({"operation": "(tool)", "stage": labels["tool"],
+                         "count": value[2], "total_s": round(value[1], 3), "mean_s": round(value[1] / value[2], 4)})
+    return sorted(rows, key=lambda row: -row["total_s"])
@@ -0,0 +1,364 @@
+import io
+import os
+import time
+import zipfile
+
+import pdf_ops
+from jobs import report_progress
+from latex_convert import convert_notebook_to_pdf
+from metrics import span
+from result_cache import make_cache_key
+from search_index import document_hash
+from text_render import render_code_pdf, render_text_pdf
+
+
+# Operations shared by the Streamlit app and the command line tool. Each one
+# takes the input file's bytes, raises on failure and returns a dict with the
+# output as {"path", "data", "size"} plus operation details. Inputs are handed
+# to the PDF engines as in-memory buffers; only the external tools get files,
+# in RAM-backed scratch space. With a ResultCache, outputs are looked up in
+# and written into the cache and "path" points at the cached file; without
+# one, the output bytes are returned in "data".
+
+# Compression level -> (DPI, description), from 1 = smallest file to 5 = best quality
+COMPRESSION_LEVELS = {
+    1: (72, "Maximum (smallest file)"),
+    2: (100, "High"),
+    3: (150, "Medium"),
+    4: (250, "Low"),
+    5: (300, "Minimum (best quality)")
+}
+
+CONVERTIBLE_EXTENSIONS = (".txt", ".py", ".ipynb")
+
+
+# Rough resource model for admission control (see jobs.submit_job):
+# operation -> (base MB, MB per input MB, MB per page, CPU seconds per input MB, CPU seconds per page).
+# Memory covers the operation's working set on top of the upload itself,
+# external tools included; the figures are deliberately on the high side.
+OPERATION_COSTS = {
+    "compress": (200, 3.0, 0.1, 0.5, 0.05),
+    "extract_text": (60, 1.5, 0.05, 0.02, 0.005),
+    "ocr": (400, 1.5, 0.0, 0.02, 1.5),
+    "extract_pages": (40, 2.0, 0.02, 0.01, 0.001),
+    "merge": (80, 1.0, 0.02, 0.01, 0.001),
+    "split": (40, 2.0, 0.05, 0.01, 0.002),
+    "rotate": (30, 1.0, 0.01, 0.01, 0.0005),
+    "convert": (300, 20.0, 0.0, 2.0, 0.0),
+}
+
+
+def estimate_cost(kind, inputs):
+    """Estimates the (memory bytes, CPU seconds) of running operation `kind` on `inputs`.
+
+    `inputs` is one file's bytes or path, or a list of them (merge); page
+    counts are read from PDF inputs, and unreadable files count as having none.
+    """
+    base_mb, mb_per_mb, mb_per_page, cpu_per_mb, cpu_per_page = OPERATION_COSTS[kind]
+    if pdf_ops.is_buffer(inputs) or isinstance(inputs, (str, os.PathLike)):
+        inputs = [inputs]
+    total_mb = sum(len(data) if pdf_ops.is_buffer(data) else os.path.getsize(data) for data in inputs) / (1024 * 1024)
+    pages = 0
+    if kind != "convert":
+        for data in inputs:
+            try:
+                pages += pdf_ops.page_count(data)
+            except Exception:
+                pass
+    if kind == "merge":
+        # Merges hold one batch of inputs at a time, then the output stage loads the result
+        memory_mb = (base_mb + mb_per_mb * min(total_mb, pdf_ops.MERGE_BATCH_BYTES / (1024 * 1024)) + mb_per_page * pages
+                     + min(total_mb, pdf_ops.OPTIMIZE_MAX_BYTES / (1024 * 1024)))
+    else:
+        memory_mb = base_mb + mb_per_mb * total_mb + mb_per_page * pages
+    return int(memory_mb * 1024 * 1024), cpu_per_mb * total_mb + cpu_per_page * pages
+
+
+def compression_settings(level):
+    """Returns the Ghostscript (dpi, PDFSETTINGS) pair for a compression level."""
+    dpi_value = COMPRESSION_LEVELS[level][0]
+    pdf_setting = "/ebook" if level >= 4 else "/screen"
+    return dpi_value, pdf_setting
+
+
+def cache_output(cache, cache_key, output_path):
+    """Moves an output file into the result cache; returns {"path", "data", "size"}."""
+    with span("download_prep"):
+        size = os.path.getsize(output_path)
+        cached_path = cache.put_file(cache_key, output_path) if cache is not None else None
+        if cached_path is None:
+            with open(output_path, "rb") as f:
+                return {"path": None, "data": f.read(), "size": size}
+        return {"path": cached_path, "data": None, "size": size}
+
+
+def cached_output(cache, cache_key):
+    """Returns the cached output for `cache_key` like cache_output, or None on a miss."""
+    cached_path = cache.get_path(cache_key) if cache is not None else None
+    if cached_path is None:
+        return None
+    return {"path": cached_path, "data": None, "size": os.path.getsize(cached_path)}
+
+
+def compress(pdf_bytes, dpi_value, pdf_setting, sharded=False, adaptive=False, cache=None):
+    """Compresses with Ghostscript at a fixed level, or with settings picked for the document when `adaptive`."""
+    if adaptive:
+        cache_key = make_cache_key("compress", [pdf_bytes], adaptive=True, min_psnr=pdf_ops.ADAPTIVE_MIN_PSNR)
+    else:
+        cache_key = make_cache_key("compress", [pdf_bytes], dpi=dpi_value, setting=pdf_setting, sharded=sharded)
+    result = cached_output(cache, cache_key)
+    if result is None:
+        with pdf_ops.scratch_dir() as temp_dir, pdf_ops.source_path(pdf_bytes) as input_path:
+            output_path = os.path.join(temp_dir, "compressed.pdf")
+
+            shard_timings, wall_time, adaptive_report = [], 0.0, None
+            if adaptive:
+                success, error, adaptive_report = pdf_ops.compress_pdf_adaptive(input_path, output_path)
+            elif sharded:
+                start_time = time.perf_counter()
+                success, error, shard_timings = pdf_ops.compress_pdf_sharded(input_path, output_path, dpi_value, pdf_setting)
+                wall_time = time.perf_counter() - start_time
+            else:
+                success, error = pdf_ops.compress_pdf(input_path, output_path, dpi_value, pdf_setting)
+            if not success:
+                raise RuntimeError(f"Compression failed: {error}")
+
+            result = cache_output(cache, cache_key, output_path)
+            result.update(shard_timings=shard_timings, wall_time=wall_time, adaptive_report=adaptive_report)
+    result.setdefault("shard_timings", [])
+    result.setdefault("adaptive_report", None)
+    result["original_size"] = len(pdf_bytes)
+    return result
+
+
+def _extracted_text_with_ocr(pdf_bytes, workers, dpi, language, cache, page_words):
+    """Like pdf_ops.iter_extracted_text, but pages without a text layer are OCRed.
+
+    The text layer is read first so every page that needs OCR is known and
+    all of them can be spread over the Tesseract runs at once; the words
+    found are collected in `page_words`.
+    """
+    total_pages = pdf_ops.page_count(pdf_bytes)
+    texts = {}
+    for first, last, page_texts in pdf_ops.iter_extracted_text(pdf_bytes, workers):
+        texts.update(enumerate(page_texts, first))
+        report_progress(0.1 * last / total_pages, f"Reading text layer: {last}/{total_pages} pages")
+    missing = [page_num for page_num, text in sorted(texts.items()) if not text.strip()]
+
+    start_time = time.perf_counter()
+    for done, (page_num, words) in enumerate(pdf_ops.ocr_pages(pdf_bytes, missing, dpi, language, cache), 1):
+        page_words[page_num] = words
+        texts[page_num] = pdf_ops.ocr_text(words)
+        pages_per_second = done / max(time.perf_counter() - start_time, 1e-6)
+        report_progress(0.1 + 0.9 * done / len(missing), f"OCR: {done}/{len(missing)} pages · {pages_per_second:.1f} pages/s",
+                        texts[page_num][:500] or None)
+    yield 1, total_pages, [texts[page_num] for page_num in range(1, total_pages + 1)]
+
+
+def extract_text(pdf_bytes, workers=None, ocr=False, ocr_dpi=None, ocr_language=None, index=None,
+                 document_name=None, cache=None):
+    """Extracts the text as a .txt file and as a text-only PDF; returns {"text", "pdf", "searchable", "stats", "indexed"}.
+
+    With `ocr`, pages without a text layer are read by Tesseract, and
+    "searchable" is the original PDF with the recognized words laid over
+    those pages as invisible text (None otherwise). With a SearchIndex,
+    the page texts are also added to it under `document_name`, unless the
+    document is already indexed; "indexed" tells whether it was added now.
+    """
+    doc_hash = document_hash(pdf_bytes) if index is not None else None
+    needs_index = index is not None and not index.has_document(doc_hash)
+    ocr_params = {}
+    if ocr:
+        ocr_params = {"ocr_dpi": ocr_dpi or pdf_ops.OCR_DPI, "ocr_language": ocr_language or pdf_ops.OCR_LANGUAGE}
+    text_key = make_cache_key("extract_text", [pdf_bytes], output="txt", **ocr_params)
+    pdf_key = make_cache_key("extract_text", [pdf_bytes], output="pdf", **ocr_params)
+    searchable_key = make_cache_key("extract_text", [pdf_bytes], output="searchable", **ocr_params)
+    text_result, pdf_result = cached_output(cache, text_key), cached_output(cache, pdf_key)
+    searchable_result = cached_output(cache, searchable_key) if ocr else None
+    if (text_result is not None and pdf_result is not None and (searchable_result is not None or not ocr)
+            and not needs_index):
+        return {"text": text_result, "pdf": pdf_result, "searchable": searchable_result, "stats": None, "indexed": False}
+
+    with pdf_ops.scratch_dir() as temp_dir:
+        # Pages arrive in order from the worker pool; each range is reported
+        # and appended to the .txt output as soon as it is ready
+        total_pages = pdf_ops.page_count(pdf_bytes)
+        txt_path = os.path.join(temp_dir, "extracted_text.txt")
+        page_words = {}
+        if ocr:
+            text_ranges = _extracted_text_with_ocr(pdf_bytes, workers, ocr_params["ocr_dpi"], ocr_params["ocr_language"],
+                                                   cache, page_words)
+        else:
+            text_ranges = pdf_ops.iter_extracted_text(pdf_bytes, workers)
+        start_time = time.perf_counter()
+        indexed_pages = []
+        with open(txt_path, "w", encoding="utf-8") as txt_file:
+            for first, last, page_texts in text_ranges:
+                part = None
+                for page_num, extracted in enumerate(page_texts, first):
+                    if needs_index:
+                        indexed_pages.append((page_num, extracted))
+                    if extracted:
+                        part = f"--- Page {page_num} ---\n{extracted}\n\n"
+                        txt_file.write(part)
+                pages_per_second = last / max(time.perf_counter() - start_time, 1e-6)
+                report_progress(last / total_pages, f"{last}/{total_pages} pages · {pages_per_second:.0f} pages/s",
+                                part[:500] if part else None)
+        elapsed = time.perf_counter() - start_time
+        if needs_index:
+            report_progress(1.0, "Adding pages to the search index")
+            with span("index"):
+                needs_index = index.add_document(doc_hash, document_name or doc_hash[:12], indexed_pages)
+
+        # Lay the extracted text out as a PDF for cleaner download, reading it back as a stream
+        pdf_path = os.path.join(temp_dir, "extracted_text.pdf")
+        with open(txt_path, "r", encoding="utf-8") as txt_file:
+            render_text_pdf(txt_file, pdf_path)
+
+        stats = f"Extracted {total_pages} pages in {elapsed:.2f}s ({total_pages / max(elapsed, 1e-6):.0f} pages/s)"
+        if ocr:
+            searchable_path = os.path.join(temp_dir, "searchable.pdf")
+            pdf_ops.add_text_layer(pdf_bytes, page_words, ocr_params["ocr_dpi"], searchable_path)
+            searchable_result = cache_output(cache, searchable_key, searchable_path)
+            stats += f", {len(page_words)} of them by OCR"
+        if needs_index:
+            stats += ", added to the search index"
+
+        return {
+            "pdf": cache_output(cache, pdf_key, pdf_path),
+            "text": cache_output(cache, text_key, txt_path),
+            "searchable": searchable_result,
+            "stats": stats,
+            "indexed": needs_index,
+        }
+
+
+def extract_pages(pdf_bytes, pages, cache=None):
+    """Copies the given 1-based pages, in order, into a new PDF."""
+    cache_key = make_cache_key("extract_pages", [pdf_bytes], pages=list(pages), linearize=pdf_ops.LINEARIZE)
+    result = cached_output(cache, cache_key)
+    if result is None:
+        with pdf_ops.scratch_dir() as temp_dir:
+            output_path = pdf_ops.extract_pages(pdf_bytes, pages, os.path.join(temp_dir, "extracted.pdf"))
+            output_report = pdf_ops.optimize_pdf(output_path)
+            result = cache_output(cache, cache_key, output_path)
+        result["output_report"] = output_report
+    result.setdefault("output_report", None)
+    result["pages"] = pdf_ops.format_page_list(pages)
+    result["pages_label"] = pdf_ops.page_selection_label(pages)
+    return result
+
+
+def merge(sources, titles=None, cache=None):
+    """Merges PDF buffers or paths in order, with one top-level bookmark per input if `titles` are given.
+
+    The output is built a few inputs at a time, so memory does not grow with
+    the number of inputs; without a cache, paths are never read into memory.
+    """
+    cache_key = make_cache_key("merge", sources, titles=titles, linearize=pdf_ops.LINEARIZE) if cache is not None else None
+    result = cached_output(cache, cache_key)
+    if result is None:
+        stats = {}
+        with pdf_ops.scratch_dir() as temp_dir:
+            output_path = pdf_ops.merge_pdfs(sources, os.path.join(temp_dir, "merged.pdf"), titles, stats)
+            output_report = pdf_ops.optimize_pdf(output_path)
+            result = cache_output(cache, cache_key, output_path)
+        result["deduplicated_objects"] = stats.get("deduplicated_objects")
+        result["output_report"] = output_report
+    result.setdefault("deduplicated_objects", None)
+    result.setdefault("output_report", None)
+    result["total_files"] = len(sources)
+    return result
+
+
+def split(pdf_bytes, split_mode, pages_per_chunk=1, cache=None):
+    """Splits into a ZIP of single pages, chunks of `pages_per_chunk` pages or bookmark sections."""
+    cache_key = make_cache_key("split", [pdf_bytes], mode=split_mode, pages_per_chunk=pages_per_chunk)
+    result = cached_output(cache, cache_key)
+    if result is None:
+        with pdf_ops.scratch_dir() as temp_dir:
+            if split_mode == "Bookmark sections":
+                ranges = pdf_ops.bookmark_ranges(pdf_bytes)
+            else:
+                ranges = pdf_ops.chunk_ranges(pdf_ops.page_count(pdf_bytes), pages_per_chunk)
+
+            # Pages are written straight into the ZIP one at a time, then the
+            # archive is moved into the result cache instead of being read back
+            output_zip = os.path.join(temp_dir, "split.zip")
+            pdf_ops.split_pdf_to_zip(pdf_bytes, output_zip, ranges)
+            result = cache_output(cache, cache_key, output_zip)
+
+    with zipfile.ZipFile(result["path"] or io.BytesIO(result["data"])) as zf:
+        result["total_files"] = len(zf.namelist())
+    result["split_mode"] = split_mode
+    return result
+
+
+def rotate(pdf_bytes, rotation_degrees, pages=None, auto=False, optimize=False, cache=None):
+    """Rotates `pages` (default: all) clockwise, or turns each page upright from its text direction when `auto`.
+
+    Only the page rotations are written, as an update appended to the
+    original file; with `optimize`, the result is also rewritten by the
+    shared output stage (pdf_ops.optimize_pdf), which costs a full rewrite.
+    """
+    if auto:
+        plan = pdf_ops.detect_rotations(pdf_bytes)
+    else:
+        plan = pdf_ops.rotation_plan(pdf_ops.page_count(pdf_bytes), rotation_degrees, pages)
+    cache_key = make_cache_key("rotate", [pdf_bytes], plan=sorted(plan.items()), optimize=optimize,
+                               linearize=optimize and pdf_ops.LINEARIZE)
+    result = cached_output(cache, cache_key)
+    if result is None:
+        with pdf_ops.scratch_dir() as temp_dir:
+            output_path = pdf_ops.rotate_pdf(pdf_bytes, plan, os.path.join(temp_dir, "rotated.pdf"))
+            output_report = pdf_ops.optimize_pdf(output_path) if optimize else None
+            result = cache_output(cache, cache_key, output_path)
+        result["output_report"] = output_report
+    result.setdefault("output_report", None)
+    result["rotated_pages"] = len(plan)
+    return result
+
+
+def convert(file_bytes, file_extension, original_name, line_numbers=False, cache=None):
+    """Converts a .txt, .py or .ipynb file to PDF; `line_numbers` applies to .py files."""
+    cache_key = make_cache_key("convert", [file_bytes], extension=file_extension, title=original_name,
+                               line_numbers=line_numbers and file_extension == ".py")
+    result = cached_output(cache, cache_key)
+    if result is not None:
+        result.update(compile_kind=None, file_extension=file_extension, notebook_stats=None)
+        return result
+
+    # xelatex and its helpers need a real working directory; keep it in RAM-backed scratch space
+    with pdf_ops.scratch_dir() as temp_dir:
+        output_path = os.path.join(temp_dir, "output.pdf")
+
+        conversion_success = False
+        error_message = ""
+        compile_kind = None
+        notebook_stats = {}
+
+        # --- TXT Conversion ---
+        if file_extension == ".txt":
+            with io.TextIOWrapper(io.BytesIO(file_bytes), encoding="utf-8") as f:
+                render_text_pdf(f, output_path)
+            conversion_success = True
+
+        # --- PY Conversion ---
+        elif file_extension == ".py":
+            render_code_pdf(file_bytes.decode("utf-8"), output_path, line_numbers=line_numbers)
+            conversion_success = True
+
+        # --- IPYNB Conversion - Escape YAML markers instead of removing them ---
+        elif file_extension == ".ipynb":
+            notebook_source = file_bytes.decode("utf-8")
+            conversion_success, error_message, compile_kind = convert_notebook_to_pdf(
+                notebook_source, original_name, temp_dir, output_path, cache, notebook_stats)
+
+        else:
+            error_message = f"Unsupported file type: {file_extension}"
+
+        if not (conversion_success and os.path.exists(output_path)):
+            raise RuntimeError(f"Conversion failed: {error_message}")
+        result = cache_output(cache, cache_key, output_path)
+    result.update(compile_kind=compile_kind, file_extension=file_extension, notebook_stats=notebook_stats or None)
+    return result
@@ -0,0 +1,320 @@
+"""HTTP API to the PDF Tool operations, for other services to call without the browser.
+
+    python pdf_api.py --port 8000 --workers 4
+    curl --data-binary @in.pdf "http://127.0.0.1:8000/compress?level=2" -o out.pdf
+    curl -F files=@a.pdf -F files=@b.pdf "http://127.0.0.1:8000/merge" -o merged.pdf
+
+Single-file commands take the file as the raw request body; merge takes a
+multipart form with one "files" field per input, in order. Options are
+query parameters named like the pdf_cli.py options. Uploads are streamed to
+scratch files, operations run on a pool of worker processes, and the output
+is streamed back from disk.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.formparsers import MultiPartException, MultiPartParser
+from starlette.requests import ClientDisconnect
+from starlette.responses import FileResponse, JSONResponse
+from starlette.routing import Route
+
+import jobs
+import operations
+import pdf_cli
+import pdf_ops
+
+
+API_WORKERS = int(os.environ.get("PDF_TOOL_API_WORKERS", str(os.cpu_count() or 1)))
+MAX_UPLOAD_BYTES = int(os.environ.get("PDF_TOOL_API_MAX_UPLOAD_MB", "512")) * 1024 * 1024
+OCR_DPI_RANGE = (72, 600)
+
+MEDIA_TYPES = {".pdf": "application/pdf", ".txt": "text/plain; charset=utf-8", ".zip": "application/zip"}
+
+_pool = None
+_in_flight = 0
+
+
+class BadRequest(Exception):
+    """Invalid request; the message is returned to the client with the given status."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _flag(query, name):
+    return query.get(name, "").lower() in ("1", "true", "yes", "on")
+
+
+def _int(query, name, default, choices=None):
+    try:
+        value = int(query.get(name, default))
+    except ValueError:
+        raise BadRequest(f"{name} must be an integer")
+    if choices is not None and value not in choices:
+        raise BadRequest(f"{name} must be one of {', '.join(map(str, choices))}")
+    return value
+
+
+def command_params(command, query):
+    """Builds the pdf_cli parameters of `command` from the request's query string."""
+    if command == "compress":
+        return {"level": _int(query, "level", 3, sorted(operations.COMPRESSION_LEVELS)),
+                "sharded": _flag(query, "sharded"), "adaptive": _flag(query, "adaptive")}
+    if command == "extract-text":
+        # Each request extracts serially; requests are parallel across the worker pool
+        return {"workers": 1}
+    if command == "ocr":
+        # Page images grow with the square of the resolution; out of range values are clamped
+        dpi = min(max(_int(query, "dpi", pdf_ops.OCR_DPI), OCR_DPI_RANGE[0]), OCR_DPI_RANGE[1])
+        return {"workers": None, "dpi": dpi, "language": query.get("lang", pdf_ops.OCR_LANGUAGE)}
+    if command == "extract-pages":
+        if not query.get("pages"):
+            raise BadRequest('pages is required, e.g. pages=1-3,7')
+        return {"pages": query["pages"], "page_label": "pages"}
+    if command == "split":
+        return {"split_mode": "Bookmark sections" if _flag(query, "bookmarks") else "Chunks of N pages",
+                "pages_per_chunk": max(1, _int(query, "chunk", 1))}
+    if command == "rotate":
+        return {"degrees": _int(query, "degrees", 90, (90, 180, 270)), "pages": query.get("pages"),
+                "auto": _flag(query, "auto"), "optimize": _flag(query, "optimize")}
+    if command == "convert":
+        return {"line_numbers": _flag(query, "line_numbers")}
+    raise BadRequest(f"Unknown command: {command}", 404)
+
+
+# --- Request handling ---
+
+@asynccontextmanager
+async def admitted():
+    """Counts the request as in flight; rejects it with 503 while too many are waiting for a worker."""
+    global _in_flight
+    if _in_flight >= API_WORKERS + jobs.MAX_QUEUED_JOBS:
+        raise BadRequest(f"Server busy ({_in_flight} requests in progress), try again later", 503)
+    _in_flight += 1
+    try:
+        yield
+    finally:
+        _in_flight -= 1
+
+
+@asynccontextmanager
+async def memory_reserved(kind, inputs):
+    """Holds the operation's estimated memory in the jobs admission budget while the block runs.
+
+    Requests wait in the same FIFO as the app's jobs in this process, so
+    large uploads queue instead of overcommitting memory; one that could
+    never fit is rejected with 413.
+    """
+    job = jobs.Job(f"api_{kind}", *operations.estimate_cost(kind, inputs))
+    if job.memory_cost > jobs.MEMORY_BUDGET:
+        raise BadRequest(f"This file needs about {job.memory_cost // jobs.MB} MB to process, more than this "
+                         f"server's {jobs.MEMORY_BUDGET // jobs.MB} MB limit", 413)
+    admission = asyncio.ensure_future(asyncio.to_thread(jobs._admit, job))
+    try:
+        await asyncio.shield(admission)
+    except BaseException:
+        # The client went away while waiting: leave the queue, or give back what was reserved meanwhile
+        job.cancel()
+        if await admission:
+            jobs._release(job)
+        raise
+    try:
+        yield
+    finally:
+        jobs._release(job)
+
+
+def _upload_too_large():
+    return BadRequest(f"Upload larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB", 413)
+
+
+async def limited_stream(request):
+    """Yields the request body, raising 413 once it exceeds MAX_UPLOAD_BYTES (chunked uploads included)."""
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > MAX_UPLOAD_BYTES:
+            raise _upload_too_large()
+        yield chunk
+
+
+async def receive_body(request, path):
+    """Streams the raw request body into `path`, enforcing MAX_UPLOAD_BYTES."""
+    size = 0
+    with open(path, "wb") as f:
+        async for chunk in limited_stream(request):
+            size += len(chunk)
+            f.write(chunk)
+    if not size:
+        raise BadRequest("Empty request body; send the file as the body")
+
+
+async def receive_files(request, work_dir):
+    """Streams the multipart "files" fields into `work_dir`; returns their paths in order."""
+    if not request.headers.get("content-type", "").startswith("multipart/form-data"):
+        raise BadRequest('Send the PDFs as multipart "files" fields')
+    # Parts are spooled to temporary files (in memory up to 1 MB) while the body streams in
+    try:
+        form = await MultiPartParser(request.headers, limited_stream(request), max_files=10000).parse()
+    except MultiPartException as e:
+        raise BadRequest(e.message)
+    try:
+        uploads = form.getlist("files")
+        if not uploads or any(isinstance(upload, str) for upload in uploads):
+            raise BadRequest('Send the PDFs as multipart "files" fields')
+        inputs = []
+        for i, upload in enumerate(uploads):
+            # One directory per input keeps its file name for the bookmark titles
+            path = os.path.join(work_dir, str(i), Path(upload.filename or "input").stem + ".pdf")
+            os.mkdir(os.path.dirname(path))
+            with open(path, "wb") as f:
+                await asyncio.to_thread(shutil.copyfileobj, upload.file, f, 1024 * 1024)
+            inputs.append(path)
+        return inputs
+    finally:
+        await form.close()
+
+
+def _new_pool():
+    # Spawned workers do not inherit the event loop's threads and sockets
+    return ProcessPoolExecutor(max_workers=API_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+
+async def run_in_pool(fn, *args):
+    """Runs `fn` on the worker pool; a pool broken by a crashed worker is replaced and the request fails with 503."""
+    global _pool
+    pool = _pool
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+    except BrokenProcessPool:
+        # Every request that was running on the old pool fails; only the first one replaces it
+        if _pool is pool:
+            _pool = _new_pool()
+            pool.shutdown(wait=False, cancel_futures=True)
+        raise BadRequest("A worker process crashed (possibly out of memory), try again later", 503)
+
+
+def error_response(e):
+    headers = {"Retry-After": "5"} if e.status_code == 503 else None
+    return JSONResponse({"error": str(e)}, status_code=e.status_code, headers=headers)
+
+
+def output_response(record, output_path, work_dir):
+    """Streams the output file and removes the work directory once it is sent."""
+    cleanup = BackgroundTask(shutil.rmtree, work_dir, ignore_errors=True)
+    if record["status"] != "done":
+        return JSONResponse({"error": record["error"]}, status_code=422, background=cleanup)
+    return FileResponse(output_path, media_type=MEDIA_TYPES[Path(output_path).suffix], filename=Path(output_path).name,
+                        headers={"X-Processing-Seconds": str(record["seconds"])}, background=cleanup)
+
+
+def request_error(e):
+    """Maps an error raised while handling a request to its JSON response."""
+    if isinstance(e, BadRequest):
+        return error_response(e)
+    if isinstance(e, ClientDisconnect):
+        return error_response(BadRequest("Client disconnected during upload"))
+    return error_response(BadRequest(f"Server error: {e.strerror or e}", 500))
+
+
+async def run_command(request):
+    command = request.path_params["command"]
+    query = request.query_params
+    try:
+        params = command_params(command, query)
+        filename = query.get("filename", "input.pdf")
+        extension = Path(filename).suffix.lower()
+        if command == "convert" and extension not in operations.CONVERTIBLE_EXTENSIONS:
+            raise BadRequest("filename must end in " + ", ".join(operations.CONVERTIBLE_EXTENSIONS))
+        async with admitted():
+            work_dir = tempfile.mkdtemp(dir=pdf_ops.SCRATCH_DIR)
+            try:
+                input_path = os.path.join(work_dir, Path(filename).stem + (extension if command == "convert" else ".pdf"))
+                await receive_body(request, input_path)
+                stem = pdf_cli.output_stem(input_path, work_dir, Path(work_dir, "out"))
+                async with memory_reserved(command.replace("-", "_"), input_path):
+                    record = await run_in_pool(pdf_cli.process_file, command, input_path, stem, params)
+                # extract-text and ocr write a text and a PDF output; ?output=pdf returns the PDF
+                targets = record["outputs"]
+                output_path = targets[1] if query.get("output") == "pdf" and len(targets) > 1 else (targets or [None])[0]
+                return output_response(record, output_path, work_dir)
+            except BaseException:
+                # Partial uploads would otherwise stay in RAM-backed scratch space
+                shutil.rmtree(work_dir, ignore_errors=True)
+                raise
+    except (BadRequest, ClientDisconnect, OSError) as e:
+        return request_error(e)
+
+
+async def merge(request):
+    try:
+        bookmarks = _flag(request.query_params, "bookmarks")
+        if int(request.headers.get("content-length") or 0) > MAX_UPLOAD_BYTES:
+            raise _upload_too_large()
+        async with admitted():
+            work_dir = tempfile.mkdtemp(dir=pdf_ops.SCRATCH_DIR)
+            try:
+                inputs = await receive_files(request, work_dir)
+                output_path = os.path.join(work_dir, "merged.pdf")
+                async with memory_reserved("merge", inputs):
+                    record = await run_in_pool(pdf_cli.run_merge, inputs, output_path, bookmarks)
+                return output_response(record, output_path, work_dir)
+            except BaseException:
+                shutil.rmtree(work_dir, ignore_errors=True)
+                raise
+    except (BadRequest, ClientDisconnect, OSError) as e:
+        return request_error(e)
+
+
+async def health(request):
+    counts = jobs.job_counts()
+    return JSONResponse({"workers": API_WORKERS, "in_flight": _in_flight,
+                         "queued": max(_in_flight - API_WORKERS, 0), "max_queued": jobs.MAX_QUEUED_JOBS,
+                         "reserved_memory": counts["reserved_memory"], "memory_budget": counts["memory_budget"]})
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global _pool
+    _pool = _new_pool()
+    try:
+        yield
+    finally:
+        _pool.shutdown(cancel_futures=True)
+
+
+app = Starlette(routes=[
+    Route("/health", health, methods=["GET"]),
+    Route("/merge", merge, methods=["POST"]),
+    Route("/{command}", run_command, methods=["POST"]),
+], lifespan=lifespan)
+
+
+def main(argv=None):
+    global API_WORKERS
+    parser = argparse.ArgumentParser(description="Serve the PDF Tool operations over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=API_WORKERS, help=f"worker processes (default: {API_WORKERS})")
+    parser.add_argument("--keep-alive", type=int, default=30, help="seconds an idle connection is kept open (default: 30)")
+    args = parser.parse_args(argv)
+
+    import uvicorn
+
+    API_WORKERS = max(1, args.workers)
+    uvicorn.run(app, host=args.host, port=args.port, timeout_keep_alive=args.keep_alive, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
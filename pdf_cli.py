@@ -0,0 +1,349 @@
+"""Command line interface to the PDF Tool operations, for batch runs without the browser.
+
+    python pdf_cli.py compress "archive/**/*.pdf" -o compressed/ --level 2 --jobs 8
+    python pdf_cli.py merge a.pdf b.pdf -o merged.pdf
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import operations
+import pdf_ops
+import search_index
+
+
+MANIFEST_NAME = ".pdf-tool-manifest.jsonl"
+# Parameters that change how a command runs but not what it writes; resuming ignores them
+RUNTIME_PARAMS = ("workers",)
+
+# Command -> ((output suffix, key of the output in the operation's result), ...).
+# Suffixes are formatted with the command's parameters and the result's
+# labels (see output_paths); a key of None means the result itself is the output
+OUTPUTS = {
+    "compress": (("_compressed.pdf", None),),
+    "extract-text": (("_text.txt", "text"), ("_text.pdf", "pdf")),
+    "ocr": (("_text.txt", "text"), ("_searchable.pdf", "searchable")),
+    "extract-pages": (("_pages_{pages_label}.pdf", None),),
+    "split": ((".zip", None),),
+    "rotate": (("_rotated.pdf", None),),
+    "convert": ((".pdf", None),),
+}
+
+
+def expand_inputs(patterns, extensions):
+    """Expands files, directories (searched recursively) and glob patterns into sorted paths."""
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = glob.glob(os.path.join(pattern, "**", "*"), recursive=True)
+        else:
+            matches = glob.glob(pattern, recursive=True)
+        paths.update(
+            os.path.abspath(path) for path in matches
+            if os.path.isfile(path) and path.lower().endswith(extensions)
+        )
+    return sorted(paths)
+
+
+def output_stem(input_path, input_root, output_dir):
+    """Returns the output path of one input without suffix, mirroring its place under `input_root`."""
+    relative = Path(os.path.relpath(input_path, input_root))
+    return output_dir / relative.parent / relative.stem
+
+
+def output_paths(command, stem, params, result):
+    """Returns the output file paths for one input's result.
+
+    Extracted pages are named after the selection the way the web interface
+    names them (pdf_ops.page_selection_label), so "10-" becomes e.g. "10-25".
+    """
+    labels = {"pages_label": result.get("pages_label")}
+    return [f"{stem}{suffix.format(**params, **labels)}" for suffix, _ in OUTPUTS[command]]
+
+
+def write_output(output, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if output["path"] is not None:
+        shutil.copyfile(output["path"], path)
+    else:
+        with open(path, "wb") as f:
+            f.write(output["data"])
+
+
+def run_operation(command, input_path, params):
+    """Runs one command on one input file and returns its result dict."""
+    with open(input_path, "rb") as f:
+        data = f.read()
+    if command == "compress":
+        return operations.compress(data, *operations.compression_settings(params["level"]), params["sharded"],
+                                   params["adaptive"])
+    # Each worker process opens the index once; SQLite serializes their writes
+    index = search_index.get_index(params["index"]) if params.get("index") else None
+    if command == "extract-text":
+        return operations.extract_text(data, workers=params["workers"], index=index, document_name=input_path)
+    if command == "ocr":
+        return operations.extract_text(data, workers=params["workers"], ocr=True, ocr_dpi=params["dpi"],
+                                       ocr_language=params["language"], index=index, document_name=input_path)
+    if command == "extract-pages":
+        pages = pdf_ops.parse_page_list(params["pages"], pdf_ops.page_count(data))
+        return operations.extract_pages(data, pages)
+    if command == "split":
+        return operations.split(data, params["split_mode"], params["pages_per_chunk"])
+    if command == "rotate":
+        pages = pdf_ops.parse_page_list(params["pages"], pdf_ops.page_count(data)) if params["pages"] else None
+        return operations.rotate(data, params["degrees"], pages, params["auto"], params.get("optimize", False))
+    if command == "convert":
+        return operations.convert(data, Path(input_path).suffix.lower(), Path(input_path).stem, params["line_numbers"])
+    raise ValueError(f"Unknown command: {command}")
+
+
+def process_file(command, input_path, stem, params):
+    """Worker entry point: runs the command and writes its outputs; never raises."""
+    start = time.perf_counter()
+    record = {"input": input_path, "outputs": [], "input_bytes": os.path.getsize(input_path)}
+    try:
+        result = run_operation(command, input_path, params)
+        targets = record["outputs"] = output_paths(command, stem, params, result)
+        output_bytes = 0
+        for target, (_, key) in zip(targets, OUTPUTS[command]):
+            output = result[key] if key else result
+            write_output(output, target)
+            output_bytes += output["size"]
+        record.update(status="done", output_bytes=output_bytes)
+        if result.get("output_report"):
+            record["output_report"] = result["output_report"]
+    except Exception as e:
+        record.update(status="failed", error=str(e))
+    record["seconds"] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def manifest_settings(command, params):
+    """The command and the parameters that decide its outputs, as recorded in the manifest."""
+    return {"command": command, "params": {key: value for key, value in params.items() if key not in RUNTIME_PARAMS}}
+
+
+def load_manifest(manifest_path, settings):
+    """Returns the inputs a previous run with the same `settings` already finished, from its manifest."""
+    done = set()
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # A run killed mid-write leaves a partial last line
+                if (record.get("status") == "done" and record.get("settings") == settings
+                        and all(os.path.exists(p) for p in record["outputs"])):
+                    done.add(record["input"])
+    return done
+
+
+def run_batch(command, inputs, output_dir, params, jobs, manifest_path, resume):
+    """Processes every input on a pool of `jobs` processes, appending each result to the manifest.
+
+    Inputs are only skipped when the manifest shows them finished by the same
+    command with the same parameters.
+    """
+    input_root = os.path.commonpath([os.path.dirname(path) for path in inputs])
+    settings = manifest_settings(command, params)
+    done = load_manifest(manifest_path, settings) if resume else set()
+    if not resume and os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    pending = [path for path in inputs if path not in done]
+    records = []
+
+    os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+    with open(manifest_path, "a", encoding="utf-8") as manifest:
+        def finish(record):
+            manifest.write(json.dumps(dict(record, settings=settings)) + "\n")
+            manifest.flush()
+            records.append(record)
+            if record["status"] == "failed":
+                print(f"failed: {record['input']}: {record['error']}", file=sys.stderr)
+
+        tasks = [(command, path, output_stem(path, input_root, output_dir), params) for path in pending]
+        if jobs == 1:
+            for task in tasks:
+                finish(process_file(*task))
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                for future in as_completed([pool.submit(process_file, *task) for task in tasks]):
+                    finish(future.result())
+    return records, len(done)
+
+
+def run_merge(inputs, output_path, bookmarks=False):
+    """Merges the inputs straight from disk, a few at a time, into `output_path`."""
+    start = time.perf_counter()
+    record = {"input": inputs, "outputs": [output_path], "input_bytes": sum(os.path.getsize(p) for p in inputs)}
+    try:
+        titles = [Path(path).stem for path in inputs] if bookmarks else None
+        result = operations.merge(inputs, titles)
+        write_output(result, output_path)
+        record.update(status="done", output_bytes=result["size"], deduplicated_objects=result["deduplicated_objects"],
+                      output_report=result["output_report"])
+    except Exception as e:
+        record.update(status="failed", error=str(e))
+        print(f"failed: {e}", file=sys.stderr)
+    record["seconds"] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def add_index_argument(sub):
+    sub.add_argument("--index", nargs="?", const=search_index.DEFAULT_INDEX_PATH, metavar="PATH",
+                     help="also add page texts to a full-text search index, skipping documents already in it "
+                          f"(default path: {search_index.DEFAULT_INDEX_PATH})")
+
+
+def run_search(args):
+    """Prints the pages matching the query, best first; returns the exit code."""
+    if not os.path.exists(args.index):
+        print(f"No search index at {args.index}; build one with extract-text --index.", file=sys.stderr)
+        return 2
+    start = time.perf_counter()
+    matches = search_index.SearchIndex(args.index).search(args.query, args.limit)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if args.json:
+        json.dump(matches, sys.stdout, indent=2, ensure_ascii=False)
+        print()
+    else:
+        for match in matches:
+            print(f"{match['name']}:{match['page']}: {' '.join(match['snippet'].split())}")
+    print(f"{len(matches)} matching pages in {elapsed_ms:.1f} ms", file=sys.stderr)
+    return 0 if matches else 1
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="pdf-tool", description="Batch PDF operations without the web interface.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_command(name, help_text):
+        sub = subparsers.add_parser(name, help=help_text)
+        sub.add_argument("inputs", nargs="+", help="files, directories or glob patterns (quote them, ** is recursive)")
+        sub.add_argument("-o", "--output", required=True, help="output directory")
+        sub.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="files processed in parallel (default: CPU count)")
+        sub.add_argument("--manifest", help=f"progress manifest (default: OUTPUT/{MANIFEST_NAME})")
+        sub.add_argument("--no-resume", action="store_true", help="reprocess files a previous run already finished")
+        sub.add_argument("--summary", help="write the JSON summary to this file instead of stdout")
+        return sub
+
+    sub = add_command("compress", "compress PDFs with Ghostscript")
+    sub.add_argument("--level", type=int, choices=sorted(operations.COMPRESSION_LEVELS), default=3,
+                     help="1 = maximum compression, 5 = best quality (default: 3)")
+    sub.add_argument("--sharded", action="store_true", help="compress page shards of each file in parallel")
+    sub.add_argument("--adaptive", action="store_true",
+                     help="pick settings per document from trial runs on sample pages (ignores --level)")
+
+    sub = add_command("extract-text", "extract text as .txt and text-only PDF")
+    add_index_argument(sub)
+
+    sub = add_command("ocr", "OCR pages without text; writes .txt and a searchable PDF")
+    add_index_argument(sub)
+    sub.add_argument("--dpi", type=int, default=pdf_ops.OCR_DPI, help=f"rendering resolution for OCR (default: {pdf_ops.OCR_DPI})")
+    sub.add_argument("--lang", default=pdf_ops.OCR_LANGUAGE,
+                     help=f'Tesseract language(s), e.g. "eng+deu" (default: {pdf_ops.OCR_LANGUAGE})')
+
+    sub = add_command("extract-pages", "extract a page range")
+    sub.add_argument("--pages", required=True, help='page selection, e.g. "1-3,7,10-" ("10-" runs to the last page)')
+
+    sub = add_command("split", "split into a ZIP of single pages, chunks or bookmark sections")
+    sub.add_argument("--chunk", type=int, default=1, help="pages per file (default: 1)")
+    sub.add_argument("--bookmarks", action="store_true", help="split at top-level bookmarks instead")
+
+    sub = add_command("rotate", "rotate pages clockwise (only their /Rotate entries change)")
+    sub.add_argument("--degrees", type=int, choices=[90, 180, 270], default=90)
+    sub.add_argument("--pages", help='pages to rotate, e.g. "odd", "even" or "1-3,7" (default: all)')
+    sub.add_argument("--auto", action="store_true",
+                     help="turn each page upright from the direction of its text (ignores --degrees and --pages)")
+    sub.add_argument("--optimize", action="store_true",
+                     help="also rewrite the output without unused or duplicate objects, with object streams (slower)")
+
+    sub = add_command("convert", "convert .txt, .py and .ipynb files to PDF")
+    sub.add_argument("--line-numbers", action="store_true", help="number the lines of .py files")
+
+    sub = subparsers.add_parser("search", help="search the text index built by extract-text --index")
+    sub.add_argument("query", help='words that must all appear on a page; FTS5 syntax ("phrase", OR, NOT, prefix*) also works')
+    sub.add_argument("--index", default=search_index.DEFAULT_INDEX_PATH, help="index file (default: %(default)s)")
+    sub.add_argument("-n", "--limit", type=int, default=20, help="maximum matching pages (default: 20)")
+    sub.add_argument("--json", action="store_true", help="print the matches as JSON")
+
+    sub = subparsers.add_parser("merge", help="merge PDFs into one, in the given order")
+    sub.add_argument("inputs", nargs="+", help="files or glob patterns (matches are merged in sorted order)")
+    sub.add_argument("-o", "--output", required=True, help="output PDF")
+    sub.add_argument("--bookmarks", action="store_true", help="add a top-level bookmark named after each input file")
+    sub.add_argument("--summary", help="write the JSON summary to this file instead of stdout")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    start = time.perf_counter()
+
+    if args.command == "search":
+        return run_search(args)
+    if args.command == "merge":
+        inputs = []
+        for pattern in args.inputs:
+            inputs += sorted(glob.glob(pattern, recursive=True)) or [pattern]
+        records, skipped = [run_merge(inputs, args.output, args.bookmarks)], 0
+    else:
+        extensions = operations.CONVERTIBLE_EXTENSIONS if args.command == "convert" else (".pdf",)
+        inputs = expand_inputs(args.inputs, extensions)
+        if not inputs:
+            print("No matching input files.", file=sys.stderr)
+            return 2
+        params = {}
+        if args.command == "compress":
+            params = {"level": args.level, "sharded": args.sharded, "adaptive": args.adaptive}
+        elif args.command == "extract-text":
+            # With several files in flight, each extracts serially instead of starting its own pool
+            params = {"workers": 1 if args.jobs > 1 else None, "index": args.index}
+        elif args.command == "ocr":
+            params = {"workers": 1 if args.jobs > 1 else None, "dpi": args.dpi, "language": args.lang,
+                      "index": args.index}
+        elif args.command == "extract-pages":
+            params = {"pages": args.pages}
+        elif args.command == "split":
+            params = {"split_mode": "Bookmark sections" if args.bookmarks else "Chunks of N pages",
+                      "pages_per_chunk": args.chunk}
+        elif args.command == "rotate":
+            params = {"degrees": args.degrees, "pages": args.pages, "auto": args.auto, "optimize": args.optimize}
+        elif args.command == "convert":
+            params = {"line_numbers": args.line_numbers}
+        manifest_path = args.manifest or os.path.join(args.output, MANIFEST_NAME)
+        records, skipped = run_batch(args.command, inputs, Path(args.output), params, max(1, args.jobs),
+                                     manifest_path, resume=not args.no_resume)
+
+    failed = [record for record in records if record["status"] == "failed"]
+    input_bytes = sum(record["input_bytes"] for record in records)
+    output_bytes = sum(record.get("output_bytes", 0) for record in records)
+    summary = {
+        "command": args.command,
+        "processed": len(records),
+        "succeeded": len(records) - len(failed),
+        "failed": len(failed),
+        "skipped": skipped,
+        "input_bytes": input_bytes,
+        "output_bytes": output_bytes,
+        "wall_seconds": round(time.perf_counter() - start, 3),
+        "task_seconds": round(sum(record["seconds"] for record in records), 3),
+        "results": records,
+    }
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    else:
+        json.dump(summary, sys.stdout, indent=2)
+        print()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
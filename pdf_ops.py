@@ -0,0 +1,1296 @@
+import hashlib
+import io
+import multiprocessing
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import zipfile
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+
+from PyPDF2 import PdfReader, PdfWriter
+
+from jobs import TOOL_LIMITS, JobCancelled, current_job, job_context, report_progress, run_process
+from metrics import span
+from result_cache import make_cache_key
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None
+
+
+# Function to run subprocess command and handle errors
+def run_subprocess(cmd, input_path, output_path, stats=None):
+    """Encapsulates subprocess call and error checking.
+
+    If a `stats` dict is given, the child's CPU seconds are stored in it.
+    """
+    # Timeout set to 5 minutes to prevent long-running processes on large files
+    try:
+        result = run_process(cmd, timeout=300)
+        if stats is not None:
+            stats["cpu_seconds"] = result.rusage.ru_utime + result.rusage.ru_stime
+
+        # Check if output file was created (essential for Ghostscript and pandoc)
+        if result.returncode == 0 and os.path.exists(output_path):
+            return True, None
+        else:
+            # Check for common dependency errors
+            if "wkhtmltopdf" in cmd[0] and "cannot execute binary file" in result.stderr:
+                return False, "❌ wkhtmltopdf is installed but may require the correct architecture or dependencies (like `libcairo2-dev`)."
+            if "pandoc" in cmd[0] and result.returncode != 0:
+                 return False, f"Pandoc failed with error: {result.stderr or result.stdout}"
+            return False, result.stderr
+    except FileNotFoundError:
+        return False, f"Required external tool not found: {cmd[0]}. Check if dependencies are installed in `packages.txt`."
+    except subprocess.TimeoutExpired:
+        return False, "Process timed out after 5 minutes."
+    except JobCancelled:
+        raise
+    except Exception as e:
+        return False, str(e)
+
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool():
+    """Returns the process pool shared by CPU-bound operations, sized to the CPU count.
+
+    Workers are spawned rather than forked because the Streamlit server is
+    multi-threaded, and the pool is kept for the lifetime of the process so
+    the interpreter start-up is only paid once.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 1,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _process_pool
+
+
+def shutdown_process_pool():
+    """Stops the shared pool and waits for its workers to exit; the next get_process_pool() starts a new one."""
+    global _process_pool
+    with _process_pool_lock:
+        pool, _process_pool = _process_pool, None
+    if pool is not None:
+        pool.shutdown(wait=True)
+
+
+# --- Compression ---
+
+# Shards smaller than this cost more in Ghostscript start-up than they save
+MIN_PAGES_PER_SHARD = 8
+# Each shard embeds its own subset of every font it uses, which the stitch
+# cannot merge. A single pass would store each font once, so its size is
+# estimated as the stitched size without the extra copies; only when the
+# stitched output is larger than that by more than this share is the
+# document also compressed in a single pass, keeping the smaller result
+SHARD_MAX_OVERHEAD = float(os.environ.get("PDF_TOOL_SHARD_MAX_OVERHEAD", "10")) / 100
+_SUBSET_PREFIX = re.compile(r"^[A-Z]{6}\+")
+
+
+def ghostscript_cmd(input_path, output_path, dpi_value, pdf_setting, first_page=None, last_page=None,
+                    image_dpi=None):
+    """Builds the Ghostscript pdfwrite command, optionally limited to a page range.
+
+    `image_dpi` overrides the preset's image downsampling target: images above
+    it are downsampled to it, images already below it are left alone.
+    """
+    cmd = [
+        "gs", "-sDEVICE=pdfwrite", "-dCompatibilityLevel=1.4",
+        f"-dPDFSETTINGS={pdf_setting}", "-dNOPAUSE", "-dQUIET", "-dBATCH",
+        "-dDetectDuplicateImages", "-dCompressFonts=true",
+        f"-r{dpi_value}x{dpi_value}",
+    ]
+    if image_dpi is not None:
+        cmd += [
+            "-dDownsampleColorImages=true", "-dDownsampleGrayImages=true", "-dDownsampleMonoImages=true",
+            f"-dColorImageResolution={image_dpi}", f"-dGrayImageResolution={image_dpi}",
+            # Bilevel scans lose legibility fast; keep them at twice the target
+            f"-dMonoImageResolution={2 * image_dpi}",
+            "-dColorImageDownsampleThreshold=1.0", "-dGrayImageDownsampleThreshold=1.0",
+            "-dMonoImageDownsampleThreshold=1.0",
+        ]
+    if first_page is not None:
+        cmd += [f"-dFirstPage={first_page}", f"-dLastPage={last_page}"]
+    cmd += [f"-sOutputFile={output_path}", input_path]
+    return cmd
+
+
+def compress_pdf(input_path, output_path, dpi_value, pdf_setting):
+    """Compresses the whole document with a single Ghostscript run."""
+    cmd = ghostscript_cmd(input_path, output_path, dpi_value, pdf_setting)
+    return run_subprocess(cmd, input_path, output_path)
+
+
+def plan_shards(total_pages, workers, min_pages=MIN_PAGES_PER_SHARD):
+    """Splits 1-based pages into at most `workers` contiguous (first, last) ranges."""
+    shard_count = max(1, min(workers, total_pages // min_pages))
+    base, extra = divmod(total_pages, shard_count)
+    shards = []
+    first = 1
+    for i in range(shard_count):
+        last = first + base + (1 if i < extra else 0) - 1
+        shards.append((first, last))
+        first = last + 1
+    return shards
+
+
+def _compress_shard(input_path, shard_path, dpi_value, pdf_setting, first_page, last_page, job=None):
+    """Runs Ghostscript over one page range and times it."""
+    start = time.perf_counter()
+    cmd = ghostscript_cmd(input_path, shard_path, dpi_value, pdf_setting, first_page, last_page)
+    # Shards run on helper threads; keep them attached to the caller's job so cancelling kills them
+    stats = {"cpu_seconds": 0.0}
+    with job_context(job):
+        success, error = run_subprocess(cmd, input_path, shard_path, stats)
+    return {
+        "stage": "shard",
+        "pages": f"{first_page}-{last_page}",
+        "seconds": round(time.perf_counter() - start, 2),
+        "cpu_seconds": round(stats["cpu_seconds"], 2),
+        "success": success,
+        "error": error,
+    }
+
+
+def compress_pdf_sharded(input_path, output_path, dpi_value, pdf_setting, workers=None):
+    """Compresses page shards in parallel Ghostscript processes and stitches them.
+
+    Returns (success, error, shard_timings). Each Ghostscript run is its own
+    child process, so the pool only needs threads to supervise them. Every
+    timing has a "stage": "shard" for the page ranges, or "single pass" for
+    the fallback described at SHARD_MAX_OVERHEAD, which also says whether
+    its output was "kept".
+    """
+    workers = workers or os.cpu_count() or 1
+    total_pages = page_count(input_path)
+
+    shards = plan_shards(total_pages, workers)
+    if len(shards) == 1:
+        start = time.perf_counter()
+        success, error = compress_pdf(input_path, output_path, dpi_value, pdf_setting)
+        timing = {"stage": "shard", "pages": f"1-{total_pages}", "seconds": round(time.perf_counter() - start, 2),
+                  "success": success, "error": error}
+        return success, error, [timing]
+
+    out_dir = os.path.dirname(output_path)
+    shard_paths = [os.path.join(out_dir, f"shard_{i}.pdf") for i in range(len(shards))]
+    job = current_job()
+    with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+        futures = [
+            pool.submit(_compress_shard, input_path, shard_path, dpi_value, pdf_setting, first, last, job)
+            for shard_path, (first, last) in zip(shard_paths, shards)
+        ]
+        timings = []
+        for future in futures:
+            timings.append(future.result())
+            report_progress(len(timings) / len(shards), f"Compressed {len(timings)}/{len(shards)} shards")
+
+    failed = [t for t in timings if not t["success"]]
+    if failed:
+        return False, f"Shard {failed[0]['pages']} failed: {failed[0]['error']}", timings
+
+    try:
+        stitch_pdfs(shard_paths, output_path, input_path)
+    except Exception as e:
+        return False, f"Stitching shards failed: {e}", timings
+    finally:
+        for shard_path in shard_paths:
+            if os.path.exists(shard_path):
+                os.remove(shard_path)
+
+    stitched_size = os.path.getsize(output_path)
+    single_pass_estimate = stitched_size - duplicate_font_bytes(output_path)
+    if stitched_size > single_pass_estimate * (1 + SHARD_MAX_OVERHEAD):
+        report_progress(1.0, "Fonts were embedded once per shard; comparing with a single pass")
+        single_path = os.path.join(out_dir, "single_pass.pdf")
+        start = time.perf_counter()
+        success, error = compress_pdf(input_path, single_path, dpi_value, pdf_setting)
+        kept = success and os.path.getsize(single_path) <= stitched_size
+        timings.append({"stage": "single pass", "pages": f"1-{total_pages}",
+                        "seconds": round(time.perf_counter() - start, 2), "success": success, "error": error,
+                        "kept": kept})
+        if kept:
+            os.replace(single_path, output_path)
+        elif os.path.exists(single_path):
+            os.remove(single_path)
+    return True, None, timings
+
+
+def stitch_pdfs(input_paths, output_path, source_path=None):
+    """Concatenates PDFs and deduplicates identical objects across them.
+
+    garbage=4 merges byte-identical streams, so images and fonts that every
+    shard embedded again are stored only once in the stitched output. The
+    bookmarks, metadata, page labels and attached files are taken from
+    `source_path`, the document the parts were cut from, if given.
+    """
+    with fitz.open() as stitched:
+        for path in input_paths:
+            with fitz.open(path) as part:
+                stitched.insert_pdf(part)
+        if source_path is not None:
+            with fitz.open(source_path) as source:
+                stitched.set_metadata(source.metadata)
+                stitched.set_toc(source.get_toc(simple=False))
+                page_labels = source.get_page_labels()
+                if page_labels:
+                    stitched.set_page_labels(page_labels)
+                for name in source.embfile_names():
+                    info = source.embfile_info(name)
+                    stitched.embfile_add(name, source.embfile_get(name), filename=info["filename"],
+                                         ufilename=info["ufilename"], desc=info["description"])
+        with span("serialize"):
+            stitched.save(output_path, garbage=4, deflate=True)
+
+
+def duplicate_font_bytes(path):
+    """Returns the size of the extra copies of fonts embedded more than once, e.g. one subset per shard."""
+    sizes = {}
+    with fitz.open(path) as doc:
+        fonts = {(xref, basefont) for page in doc for xref, _, _, basefont, *_ in page.get_fonts()}
+        for xref, basefont in fonts:
+            embedded = doc.extract_font(xref)[3]
+            if embedded:
+                sizes.setdefault(_SUBSET_PREFIX.sub("", basefont), []).append(len(embedded))
+    return sum(sum(copies) - max(copies) for copies in sizes.values())
+
+
+# --- Adaptive compression ---
+# Instead of one fixed preset, the document is analyzed, a handful of
+# candidate settings are tried in parallel on a few sample pages, and the
+# smallest candidate whose rendering stays close enough to the original is
+# applied to the whole file.
+
+# Image downsampling targets tried, in DPI; only those below the document's
+# sharpest image can make a difference
+ADAPTIVE_DPI_STEPS = (300, 200, 150, 110, 72)
+ADAPTIVE_SAMPLE_PAGES = 4
+# Minimum similarity (PSNR in dB of a 72 DPI grayscale rendering) of every
+# sample page for a candidate to be accepted
+ADAPTIVE_MIN_PSNR = float(os.environ.get("PDF_TOOL_MIN_PSNR", "32"))
+
+
+def analyze_pdf(source):
+    """Counts images, their effective resolution and the embedded font payload.
+
+    Returns a dict with the page count, image count and bytes, the highest
+    and median effective image DPI, font bytes, and the pages ordered from
+    the most to the least image data.
+    """
+    with _fitz_open(source) as doc:
+        image_sizes, image_dpis, font_sizes = {}, [], {}
+        page_image_bytes = []
+        for page in doc:
+            page_bytes = 0
+            for xref, _, width, *_ in page.get_images(full=True):
+                if xref not in image_sizes:
+                    image_sizes[xref] = len(doc.xref_stream_raw(xref) or b"")
+                page_bytes += image_sizes[xref]
+                for rect in page.get_image_rects(xref):
+                    if rect.width > 0:
+                        image_dpis.append(width / (rect.width / 72))
+            for xref, *_ in page.get_fonts(full=True):
+                if xref and xref not in font_sizes:
+                    font_sizes[xref] = len(doc.extract_font(xref)[3] or b"")
+            page_image_bytes.append(page_bytes)
+        image_dpis.sort()
+        return {
+            "pages": doc.page_count,
+            "images": len(image_sizes),
+            "image_bytes": sum(image_sizes.values()),
+            "font_bytes": sum(font_sizes.values()),
+            "max_image_dpi": round(image_dpis[-1]) if image_dpis else 0,
+            "median_image_dpi": round(image_dpis[len(image_dpis) // 2]) if image_dpis else 0,
+            "pages_by_image_bytes": sorted(range(doc.page_count), key=lambda i: -page_image_bytes[i]),
+        }
+
+
+def compression_candidates(analysis):
+    """Returns the (label, image_dpi, pdf_setting) settings worth trying for a document."""
+    # Print quality: mostly font subsetting and stream recompression
+    candidates = [("printer preset", None, "/printer")]
+    for image_dpi in ADAPTIVE_DPI_STEPS:
+        if image_dpi < analysis["max_image_dpi"]:
+            candidates.append((f"{image_dpi} dpi", image_dpi, "/ebook" if image_dpi >= 150 else "/screen"))
+    return candidates
+
+
+def _render_gray(doc, page_index, dpi=72):
+    import numpy as np
+
+    pix = doc[page_index].get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+    return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, -1)[:, :, 0]
+
+
+def _psnr(original, candidate):
+    import numpy as np
+
+    if original.shape != candidate.shape:
+        return 0.0
+    mse = np.mean((original.astype(np.float32) - candidate.astype(np.float32)) ** 2)
+    # Identical renderings are reported as 100 dB rather than infinity
+    return 100.0 if mse == 0 else min(100.0, round(float(10 * np.log10(255 ** 2 / mse)), 1))
+
+
+def _try_candidate(sample_path, out_path, label, image_dpi, pdf_setting, job=None):
+    """Compresses the sample with one candidate and scores the result."""
+    start = time.perf_counter()
+    dpi_value = image_dpi or 300
+    cmd = ghostscript_cmd(sample_path, out_path, dpi_value, pdf_setting, image_dpi=image_dpi)
+    stats = {"cpu_seconds": 0.0}
+    with job_context(job):
+        success, error = run_subprocess(cmd, sample_path, out_path, stats)
+    trial = {"candidate": label, "image_dpi": image_dpi, "pdf_setting": pdf_setting, "success": success,
+             "error": error, "sample_bytes": None, "psnr": None, "cpu_seconds": stats["cpu_seconds"]}
+    if success:
+        cpu_start = time.thread_time()
+        trial["sample_bytes"] = os.path.getsize(out_path)
+        with fitz.open(sample_path) as original, fitz.open(out_path) as compressed:
+            if original.page_count == compressed.page_count:
+                trial["psnr"] = min(
+                    _psnr(_render_gray(original, i), _render_gray(compressed, i)) for i in range(original.page_count)
+                )
+            else:
+                trial["psnr"] = 0.0
+        trial["cpu_seconds"] += time.thread_time() - cpu_start
+    trial["cpu_seconds"] = round(trial["cpu_seconds"], 2)
+    trial["seconds"] = round(time.perf_counter() - start, 2)
+    return trial
+
+
+def compress_pdf_adaptive(input_path, output_path, min_psnr=ADAPTIVE_MIN_PSNR):
+    """Picks compression settings for this document and applies them.
+
+    Returns (success, error, report). The output is never larger than the
+    input: if no candidate beats it, the input is copied unchanged. The
+    report holds the analysis, every trial on the sample pages, the chosen
+    settings, and bytes saved per CPU second (Ghostscript children plus the
+    analysis and scoring done here).
+    """
+    if fitz is None:
+        return False, "Adaptive compression needs PyMuPDF.", None
+    cpu_start = time.thread_time()
+    input_bytes = os.path.getsize(input_path)
+    analysis = analyze_pdf(input_path)
+    candidates = compression_candidates(analysis)
+
+    # Sample the pages carrying the most image data, where the settings differ most
+    work_dir = os.path.dirname(output_path)
+    sample_pages = sorted(analysis["pages_by_image_bytes"][:ADAPTIVE_SAMPLE_PAGES])
+    sample_path = os.path.join(work_dir, "adaptive_sample.pdf")
+    with fitz.open(input_path) as doc, fitz.open() as sample:
+        for page_index in sample_pages:
+            sample.insert_pdf(doc, from_page=page_index, to_page=page_index)
+        sample.save(sample_path, garbage=3, deflate=True)
+    sample_bytes = os.path.getsize(sample_path)
+
+    job = current_job()
+    report_progress(0.0, f"Trying {len(candidates)} settings on {len(sample_pages)} sample pages")
+    candidate_paths = [os.path.join(work_dir, f"adaptive_candidate_{i}.pdf") for i in range(len(candidates))]
+    try:
+        with ThreadPoolExecutor(max_workers=len(candidates)) as pool:
+            futures = [
+                pool.submit(_try_candidate, sample_path, candidate_path, label, image_dpi, pdf_setting, job)
+                for candidate_path, (label, image_dpi, pdf_setting) in zip(candidate_paths, candidates)
+            ]
+            trials = [future.result() for future in futures]
+    finally:
+        for path in [sample_path] + candidate_paths:
+            if os.path.exists(path):
+                os.remove(path)
+    cpu_seconds = time.thread_time() - cpu_start + sum(trial["cpu_seconds"] for trial in trials)
+
+    accepted = [
+        trial for trial in trials
+        if trial["success"] and trial["psnr"] >= min_psnr and trial["sample_bytes"] < sample_bytes
+    ]
+    chosen = min(accepted, key=lambda trial: trial["sample_bytes"]) if accepted else None
+    report = {"analysis": analysis, "trials": trials, "min_psnr": min_psnr, "chosen": None,
+              "input_bytes": input_bytes, "output_bytes": input_bytes}
+
+    if chosen is not None:
+        report_progress(0.5, f"Compressing with {chosen['candidate']}")
+        cmd = ghostscript_cmd(input_path, output_path, chosen["image_dpi"] or 300, chosen["pdf_setting"],
+                              image_dpi=chosen["image_dpi"])
+        stats = {"cpu_seconds": 0.0}
+        success, error = run_subprocess(cmd, input_path, output_path, stats)
+        cpu_seconds += stats["cpu_seconds"]
+        if not success:
+            return False, error, report
+        if os.path.getsize(output_path) < input_bytes:
+            report["chosen"] = chosen["candidate"]
+            report["output_bytes"] = os.path.getsize(output_path)
+
+    if report["chosen"] is None:
+        shutil.copyfile(input_path, output_path)
+    report["cpu_seconds"] = round(cpu_seconds, 2)
+    report["bytes_saved_per_cpu_second"] = round((input_bytes - report["output_bytes"]) / max(cpu_seconds, 1e-6))
+    return True, None, report
+
+
+# --- Sources and scratch space ---
+# Page operations take a `source` that is either a file path or an in-memory
+# bytes-like buffer (e.g. an upload's getbuffer()), so uploads reach the PDF
+# engines without a round trip through disk. Only the external tools (gs,
+# xelatex, pandoc) and the worker processes need real files; those are
+# written to SCRATCH_DIR, which is RAM-backed tmpfs where available.
+
+def _default_scratch_dir():
+    shm = "/dev/shm"
+    if os.path.isdir(shm) and os.access(shm, os.W_OK):
+        return shm
+    return tempfile.gettempdir()
+
+
+SCRATCH_DIR = os.environ.get("PDF_TOOL_SCRATCH_DIR") or _default_scratch_dir()
+
+
+def scratch_dir():
+    """Returns a TemporaryDirectory in SCRATCH_DIR for work files of external tools."""
+    return tempfile.TemporaryDirectory(dir=SCRATCH_DIR)
+
+
+def is_buffer(source):
+    return isinstance(source, (bytes, bytearray, memoryview))
+
+
+@contextmanager
+def source_path(source, suffix=".pdf"):
+    """Yields a file path for `source`, spilling an in-memory buffer to SCRATCH_DIR if needed."""
+    if not is_buffer(source):
+        yield os.fspath(source)
+        return
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=SCRATCH_DIR)
+    try:
+        with span("upload_write"), os.fdopen(fd, "wb") as f:
+            f.write(source)
+        yield path
+    finally:
+        os.remove(path)
+
+
+def _fitz_open(source):
+    with span("parse"):
+        if is_buffer(source):
+            return fitz.open(stream=source, filetype="pdf")
+        return fitz.open(source)
+
+
+def _pdf_reader(source):
+    with span("parse"):
+        return PdfReader(io.BytesIO(source) if is_buffer(source) else source)
+
+
+# --- Output stage ---
+# PDFs produced by the page operations go through optimize_pdf before they
+# are returned: PyMuPDF rewrites them without unreferenced objects, with
+# identical objects (streams included) stored once, compressed streams and
+# objects packed into compressed object streams. Linearization ("fast web
+# view") is no longer supported by MuPDF, so it is done by qpdf when asked.
+
+OPTIMIZED_SAVE_OPTIONS = {"garbage": 4, "deflate": True, "use_objstms": 1}
+# Larger outputs are left as written: the rewrite loads the whole document
+OPTIMIZE_MAX_BYTES = int(os.environ.get("PDF_TOOL_OPTIMIZE_MB", "256")) * 1024 * 1024
+LINEARIZE = os.environ.get("PDF_TOOL_LINEARIZE", "").lower() in ("1", "true", "yes")
+QPDF_TIMEOUT = 300
+
+
+def first_page_seconds(path):
+    """Returns the time to open the PDF and render its first page, or None without PyMuPDF."""
+    if fitz is None:
+        return None
+    start = time.perf_counter()
+    with fitz.open(path) as doc:
+        if doc.page_count:
+            doc[0].get_pixmap(dpi=36)
+    return time.perf_counter() - start
+
+
+def _linearize(path):
+    """Linearizes the PDF at `path` in place with qpdf; returns None or the error."""
+    temp_path = path + ".linear.tmp"
+    try:
+        # Exit code 3 means qpdf succeeded with warnings
+        result = run_process(["qpdf", "--linearize", "--object-streams=generate", path, temp_path], timeout=QPDF_TIMEOUT)
+    except FileNotFoundError:
+        return "qpdf is not installed"
+    except subprocess.TimeoutExpired:
+        return f"qpdf timed out after {QPDF_TIMEOUT} seconds"
+    if result.returncode not in (0, 3) or not os.path.exists(temp_path):
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return result.stderr.strip() or f"qpdf exited with code {result.returncode}"
+    os.replace(temp_path, path)
+    return None
+
+
+def optimize_pdf(path, linearize=None):
+    """Rewrites the PDF at `path` in place through the output stage; returns a report dict.
+
+    The report has the sizes before and after ("bytes_saved"), whether the
+    file was rewritten and linearized, and the time to open it and render
+    its first page before and after ("first_page_ms_before"/"_after").
+    `linearize` defaults to PDF_TOOL_LINEARIZE.
+    """
+    linearize = LINEARIZE if linearize is None else linearize
+    start = time.perf_counter()
+    size_before = os.path.getsize(path)
+    first_page_before = first_page_seconds(path)
+    report = {"bytes_before": size_before, "optimized": False, "linearized": False}
+    with span("optimize"):
+        if fitz is not None and size_before <= OPTIMIZE_MAX_BYTES:
+            temp_path = path + ".opt.tmp"
+            with fitz.open(path) as doc:
+                doc.save(temp_path, **OPTIMIZED_SAVE_OPTIONS)
+            if os.path.getsize(temp_path) < size_before:
+                os.replace(temp_path, path)
+                report["optimized"] = True
+            else:
+                os.remove(temp_path)
+        if linearize:
+            error = _linearize(path)
+            report["linearized"] = error is None
+            if error:
+                report["linearize_error"] = error
+    first_page_after = first_page_seconds(path)
+    report["bytes_after"] = os.path.getsize(path)
+    report["bytes_saved"] = size_before - report["bytes_after"]
+    report["first_page_ms_before"] = round(first_page_before * 1000, 1) if first_page_before is not None else None
+    report["first_page_ms_after"] = round(first_page_after * 1000, 1) if first_page_after is not None else None
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    return report
+
+
+# --- Page operation backends ---
+# Every page operation has a PyMuPDF implementation and a pure-Python PyPDF2
+# fallback. PyMuPDF is used whenever it is installed. Operations that produce
+# a PDF write it to `output_path` when one is given and return its bytes
+# otherwise.
+
+def _pymupdf_write(doc, output_path=None):
+    with span("serialize"):
+        if output_path is None:
+            return doc.tobytes()
+        doc.save(output_path)
+        return output_path
+
+
+def _pymupdf_page_count(source):
+    with _fitz_open(source) as doc:
+        return doc.page_count
+
+
+def _pymupdf_extract_text(source, first=1, last=None):
+    with _fitz_open(source) as doc:
+        last = last or doc.page_count
+        return [doc[page_index].get_text() for page_index in range(first - 1, last)]
+
+
+def _pymupdf_extract_pages(source, pages, output_path=None):
+    with _fitz_open(source) as src, fitz.open() as out:
+        # One insert per contiguous run, so shared resources are copied once per run, not per page
+        for first, last in page_runs(pages):
+            out.insert_pdf(src, from_page=first - 1, to_page=last - 1)
+        return _pymupdf_write(out, output_path)
+
+
+# Inputs are merged in batches; each batch is appended to the output file
+# with an incremental save and released before the next one is opened
+MERGE_BATCH_BYTES = 64 * 1024 * 1024
+MERGE_BATCH_INPUTS = 32
+_OBJECT_REF = re.compile(r"\b(\d+) 0 R\b")
+# Only shared resources are deduplicated: fonts and images, and everything
+# they refer to (font files, widths, encodings, color spaces, ICC profiles,
+# soft masks). Page content and per-page objects such as annotations stay
+# separate even when identical
+_SHARED_RESOURCE = re.compile(r"/Type\s*/(?:Font|FontDescriptor)\b|/Subtype\s*/Image\b")
+_PAGE_TREE_NODE = re.compile(r"/Type\s*/Pages?\b")
+# Resource hashes remembered across the inputs of one merge; the least
+# recently matched are forgotten first, so memory stays bounded
+MERGE_DEDUP_MAX_OBJECTS = 65536
+
+
+def _source_size(source):
+    return len(source) if is_buffer(source) else os.path.getsize(source)
+
+
+def _shared_resources(doc, first_xref):
+    """Returns {xref: definition} for the fonts and images added since `first_xref` and the objects they refer to."""
+    objects = {}
+    pending = [xref for xref in range(first_xref, doc.xref_length())
+               if _SHARED_RESOURCE.search(doc.xref_object(xref, compressed=True))]
+    while pending:
+        xref = pending.pop()
+        if xref in objects:
+            continue
+        obj = doc.xref_object(xref, compressed=True)
+        if obj == "null" or _PAGE_TREE_NODE.search(obj):
+            continue
+        objects[xref] = obj
+        pending += [ref for ref in map(int, _OBJECT_REF.findall(obj))
+                    if first_xref <= ref < doc.xref_length() and ref not in objects]
+    return objects
+
+
+def _dedup_new_objects(doc, first_xref, seen):
+    """Points references to resources added since `first_xref` at identical earlier ones.
+
+    insert_pdf only shares objects within one source document; fonts, images,
+    color spaces and ICC profiles repeated across inputs are matched here by
+    the hash of their definition and raw stream data (see _SHARED_RESOURCE).
+    An object referring to another duplicate (e.g. an image and its color
+    space) only matches once that reference is remapped, so matching repeats
+    until nothing changes. `seen` (an OrderedDict of hash -> xref) carries
+    the hashes over to the next input. Returns the number of objects dropped.
+    """
+    def remapped(obj):
+        return _OBJECT_REF.sub(lambda m: f"{remap.get(int(m[1]), m[1])} 0 R", obj)
+
+    objects = {}
+    for xref, obj in _shared_resources(doc, first_xref).items():
+        data_hash = hashlib.sha256(doc.xref_stream_raw(xref)).digest() if doc.xref_is_stream(xref) else b""
+        objects[xref] = (obj, data_hash)
+    remap = {}
+    while True:
+        keys = {}
+        found = False
+        for xref, (obj, data_hash) in objects.items():
+            if xref in remap:
+                continue
+            key = hashlib.sha256(remapped(obj).encode() + data_hash).digest()
+            target = keys.get(key)
+            if target is None and key in seen:
+                target = seen[key]
+                seen.move_to_end(key)
+            if target is not None:
+                remap[xref] = target
+                found = True
+            else:
+                keys[key] = xref
+        if not found:
+            break
+    seen.update(keys)
+    while len(seen) > MERGE_DEDUP_MAX_OBJECTS:
+        seen.popitem(last=False)
+    if not remap:
+        return 0
+    # A match found early may itself have been matched later on
+    for xref, target in remap.items():
+        while target in remap:
+            target = remap[target]
+        remap[xref] = target
+
+    for xref in range(first_xref, doc.xref_length()):
+        if xref not in remap:
+            obj = doc.xref_object(xref, compressed=True)
+            updated = remapped(obj)
+            if updated != obj:
+                doc.update_object(xref, updated)
+    for xref in remap:
+        if doc.xref_is_stream(xref):
+            doc.update_stream(xref, b"")
+        doc.update_object(xref, "null")
+    return len(remap)
+
+
+def _merge_batches(sources):
+    """Groups (index, source) pairs into batches bounded by total size and count."""
+    batch, batch_bytes = [], 0
+    for index, source in enumerate(sources):
+        batch.append((index, source))
+        batch_bytes += _source_size(source)
+        if batch_bytes >= MERGE_BATCH_BYTES or len(batch) >= MERGE_BATCH_INPUTS:
+            yield batch
+            batch, batch_bytes = [], 0
+    if batch:
+        yield batch
+
+
+def _pymupdf_merge(sources, output_path=None, titles=None, stats=None):
+    if output_path is None:
+        with scratch_dir() as temp_dir:
+            merged_path = _pymupdf_merge(sources, os.path.join(temp_dir, "merged.pdf"), titles, stats)
+            with open(merged_path, "rb") as f:
+                return f.read()
+
+    toc, seen, deduplicated, page_offset = [], OrderedDict(), 0, 0
+    for batch_index, batch in enumerate(_merge_batches(sources)):
+        out = fitz.open(output_path) if batch_index else fitz.open()
+        try:
+            for input_index, source in batch:
+                with _fitz_open(source) as src:
+                    first_xref = out.xref_length()
+                    out.insert_pdf(src)
+                    deduplicated += _dedup_new_objects(out, first_xref, seen)
+                    # Keep each input's outline, nested under its title when one is given
+                    level_shift = 0
+                    if titles is not None:
+                        toc.append([1, titles[input_index], page_offset + 1])
+                        level_shift = 1
+                    # Entries without a target page point at the input's first page
+                    toc += [[level + level_shift, title, page_offset + max(page_num, 1)]
+                            for level, title, page_num in src.get_toc()]
+                    page_offset += src.page_count
+                report_progress((input_index + 1) / len(sources), f"Merged {input_index + 1}/{len(sources)} files")
+            with span("serialize"):
+                if batch_index:
+                    out.saveIncr()
+                else:
+                    out.save(output_path)
+        finally:
+            out.close()
+
+    if toc:
+        with fitz.open(output_path) as out:
+            out.set_toc(toc)
+            with span("serialize"):
+                out.saveIncr()
+    if stats is not None:
+        stats["deduplicated_objects"] = deduplicated
+    return output_path
+
+
+def _pymupdf_split(source, ranges):
+    with _fitz_open(source) as src:
+        for first, last in ranges:
+            with fitz.open() as out:
+                out.insert_pdf(src, from_page=first - 1, to_page=last - 1)
+                with span("serialize"):
+                    yield first, last, out.tobytes(**OPTIMIZED_SAVE_OPTIONS)
+
+
+def _pymupdf_bookmarks(source):
+    with _fitz_open(source) as doc:
+        return [(title, page_num) for level, title, page_num, *_ in doc.get_toc() if level == 1 and page_num > 0]
+
+
+# Dominant text direction in unrotated page space -> /Rotate that makes it read left to right
+TEXT_DIRECTION_ROTATIONS = {(1, 0): 0, (0, -1): 90, (-1, 0): 180, (0, 1): 270}
+
+
+def _pymupdf_detect_rotations(source):
+    plan = {}
+    with _fitz_open(source) as doc:
+        for page in doc:
+            weights = Counter()
+            for block in page.get_text("dict", flags=0)["blocks"]:
+                for line in block.get("lines", ()):
+                    direction = (round(line["dir"][0]), round(line["dir"][1]))
+                    weights[direction] += sum(len(text_span["text"]) for text_span in line["spans"])
+            if weights:
+                upright = TEXT_DIRECTION_ROTATIONS.get(weights.most_common(1)[0][0])
+                if upright is not None and upright != page.rotation:
+                    plan[page.number + 1] = (upright - page.rotation) % 360
+    return plan
+
+
+def _copy_for_update(source, output_path):
+    """Puts the unchanged source bytes at `output_path`, ready for an incremental update."""
+    if is_buffer(source):
+        with span("upload_write"), open(output_path, "wb") as f:
+            f.write(source)
+    elif os.path.abspath(source) != os.path.abspath(output_path):
+        with span("upload_write"):
+            shutil.copyfile(source, output_path)
+
+
+def _save_update(doc, output_path):
+    """Appends the changes to `doc`, opened from `output_path`, as an incremental update."""
+    with span("serialize"):
+        if doc.can_save_incrementally():
+            doc.saveIncr()
+            return
+        # Damaged files are repaired on open and have to be rewritten in full
+        doc.save(output_path + ".tmp")
+    os.replace(output_path + ".tmp", output_path)
+
+
+def _pymupdf_rotate(source, plan, output_path=None):
+    if output_path is None:
+        with scratch_dir() as temp_dir:
+            rotated_path = _pymupdf_rotate(source, plan, os.path.join(temp_dir, "rotated.pdf"))
+            with open(rotated_path, "rb") as f:
+                return f.read()
+
+    # The original bytes are kept as they are and only the changed page
+    # objects are appended as an incremental update
+    _copy_for_update(source, output_path)
+    with _fitz_open(output_path) as doc:
+        for page_num, degrees in plan.items():
+            page = doc[page_num - 1]
+            page.set_rotation((page.rotation + degrees) % 360)
+        _save_update(doc, output_path)
+    return output_path
+
+
+def _pypdf2_page_count(source):
+    return len(_pdf_reader(source).pages)
+
+
+def _pypdf2_extract_text(source, first=1, last=None):
+    pages = _pdf_reader(source).pages
+    last = last or len(pages)
+    return [pages[page_index].extract_text() or "" for page_index in range(first - 1, last)]
+
+
+def _pypdf2_write(writer, output_path=None):
+    with span("serialize"):
+        if output_path is not None:
+            writer.write(output_path)
+            return output_path
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        return buffer.getvalue()
+
+
+def _pypdf2_extract_pages(source, pages, output_path=None):
+    reader = _pdf_reader(source)
+    writer = PdfWriter()
+    for page_num in pages:
+        writer.add_page(reader.pages[page_num - 1])
+    return _pypdf2_write(writer, output_path)
+
+
+def _pypdf2_merge(sources, output_path=None, titles=None, stats=None):
+    # PyPDF2 keeps every page in memory until the output is written
+    writer = PdfWriter()
+    for index, source in enumerate(sources):
+        title = titles[index] if titles is not None else None
+        writer.append(_pdf_reader(source), outline_item=title, import_outline=True)
+    return _pypdf2_write(writer, output_path)
+
+
+def _pypdf2_split(source, ranges):
+    reader = _pdf_reader(source)
+    for first, last in ranges:
+        writer = PdfWriter()
+        for page_num in range(first - 1, last):
+            writer.add_page(reader.pages[page_num])
+        yield first, last, _pypdf2_write(writer)
+
+
+def _pypdf2_bookmarks(source):
+    reader = _pdf_reader(source)
+    bookmarks = []
+    # Nested lists in the outline are child bookmarks; only top-level entries split the document
+    for item in reader.outline:
+        if isinstance(item, list):
+            continue
+        # Destinations that do not resolve to a page come back as None or -1
+        page_index = reader.get_destination_page_number(item)
+        if page_index is not None and page_index >= 0:
+            bookmarks.append((item.title, page_index + 1))
+    return bookmarks
+
+
+def _pypdf2_rotate(source, plan, output_path=None):
+    reader = _pdf_reader(source)
+    writer = PdfWriter()
+    for page_num, page in enumerate(reader.pages, 1):
+        if page_num in plan:
+            page.rotate(plan[page_num])
+        writer.add_page(page)
+    return _pypdf2_write(writer, output_path)
+
+
+BACKENDS = {
+    "pymupdf": {
+        "page_count": _pymupdf_page_count,
+        "extract_text": _pymupdf_extract_text,
+        "extract_pages": _pymupdf_extract_pages,
+        "merge": _pymupdf_merge,
+        "split": _pymupdf_split,
+        "bookmarks": _pymupdf_bookmarks,
+        "rotate": _pymupdf_rotate,
+        "detect_rotations": _pymupdf_detect_rotations,
+    },
+    "pypdf2": {
+        "page_count": _pypdf2_page_count,
+        "extract_text": _pypdf2_extract_text,
+        "extract_pages": _pypdf2_extract_pages,
+        "merge": _pypdf2_merge,
+        "split": _pypdf2_split,
+        "bookmarks": _pypdf2_bookmarks,
+        "rotate": _pypdf2_rotate,
+    },
+}
+
+DEFAULT_BACKEND = os.environ.get("PDF_TOOL_BACKEND", "pymupdf" if fitz is not None else "pypdf2")
+
+
+def _backend_op(operation, backend=None):
+    name = backend or DEFAULT_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown PDF backend: {name}")
+    if name == "pymupdf" and fitz is None:
+        name = "pypdf2"
+    return BACKENDS[name][operation]
+
+
+def page_count(source, backend=None):
+    """Returns the number of pages in the PDF."""
+    return _backend_op("page_count", backend)(source)
+
+
+def extract_text(source, first=1, last=None, backend=None):
+    """Returns the text of pages first..last (default: all pages), in page order."""
+    return _backend_op("extract_text", backend)(source, first, last)
+
+
+# Pages handed to one worker at a time; small enough for steady progress updates
+TEXT_PAGES_PER_TASK = 16
+
+
+def iter_extracted_text(source, workers=None, backend=None):
+    """Extracts text on a process pool and yields (first, last, texts) in page order.
+
+    Ranges are yielded as soon as they and every range before them are done,
+    so callers can show and write results while later pages are still running.
+    """
+    total_pages = page_count(source, backend)
+    ranges = chunk_ranges(total_pages, TEXT_PAGES_PER_TASK)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(ranges) == 1:
+        for first, last in ranges:
+            yield first, last, extract_text(source, first, last, backend)
+        return
+
+    # Workers open the file by path instead of each being sent a copy of the buffer
+    with source_path(source) as input_path:
+        pool = get_process_pool()
+        futures = [pool.submit(extract_text, input_path, first, last, backend) for first, last in ranges]
+        try:
+            for (first, last), future in zip(ranges, futures):
+                yield first, last, future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def extract_pages(source, pages, output_path=None, backend=None):
+    """Returns a new PDF with the given 1-based pages, in the given order."""
+    return _backend_op("extract_pages", backend)(source, list(pages), output_path)
+
+
+def parse_page_list(spec, total_pages):
+    """Parses a page selection like "1-3,7,10-12" into 1-based page numbers, in order.
+
+    "10-" runs to the last page and "odd" / "even" select every other page.
+    Raises ValueError for malformed or out of range entries.
+    """
+    pages = []
+    for part in spec.replace(" ", "").lower().split(","):
+        if not part:
+            continue
+        if part in ("odd", "even"):
+            pages.extend(range(1 if part == "odd" else 2, total_pages + 1, 2))
+            continue
+        first, sep, last = part.partition("-")
+        try:
+            first = int(first)
+            last = (int(last) if last else total_pages) if sep else first
+        except ValueError:
+            raise ValueError(f"Invalid page range: {part}") from None
+        if first > last:
+            raise ValueError(f"Invalid page range: {part}")
+        if not 1 <= first <= last <= total_pages:
+            raise ValueError(f"Page range {part} is outside 1-{total_pages}")
+        pages.extend(range(first, last + 1))
+    if not pages:
+        raise ValueError("No pages selected")
+    return pages
+
+
+def page_runs(pages):
+    """Groups 1-based page numbers into (first, last) runs of consecutive pages."""
+    runs = []
+    for page_num in pages:
+        if runs and page_num == runs[-1][1] + 1:
+            runs[-1][1] = page_num
+        else:
+            runs.append([page_num, page_num])
+    return [tuple(run) for run in runs]
+
+
+def format_page_list(pages):
+    """Formats page numbers back into a compact selection like "1-3,7"."""
+    return ",".join(str(first) if first == last else f"{first}-{last}" for first, last in page_runs(pages))
+
+
+def page_selection_label(pages, max_length=40):
+    """Short form of a page selection for file names: "1-3_7", or "250_pages" when the list is long."""
+    label = format_page_list(pages).replace(",", "_")
+    return label if len(label) <= max_length else f"{len(pages)}_pages"
+
+
+# --- Document index ---
+
+class DocumentIndex:
+    """Page count and page sizes of one document, with thumbnails rendered on demand.
+
+    The document is parsed once when the index is built; thumbnails need
+    PyMuPDF and are rendered the first time each one is asked for, then kept.
+    """
+
+    def __init__(self, source, backend=None):
+        self.source = source
+        self._lock = threading.Lock()
+        self._thumbnails = {}
+        self._doc = None
+        if fitz is not None and (backend or DEFAULT_BACKEND) == "pymupdf":
+            self._doc = _fitz_open(source)
+            self.page_sizes = [(page.rect.width, page.rect.height) for page in self._doc]
+        else:
+            self.page_sizes = [
+                (float(page.mediabox.width), float(page.mediabox.height)) for page in _pdf_reader(source).pages
+            ]
+        self.page_count = len(self.page_sizes)
+
+    @property
+    def has_thumbnails(self):
+        return self._doc is not None
+
+    def thumbnail(self, page_num, width=120):
+        """Returns a PNG thumbnail of the 1-based page, `width` pixels wide."""
+        key = (page_num, width)
+        with self._lock:
+            if key not in self._thumbnails:
+                page = self._doc[page_num - 1]
+                zoom = width / page.rect.width
+                self._thumbnails[key] = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False).tobytes("png")
+            return self._thumbnails[key]
+
+    def close(self):
+        """Releases the parsed document and the thumbnails."""
+        with self._lock:
+            if self._doc is not None:
+                self._doc.close()
+                self._doc = None
+            self._thumbnails.clear()
+
+
+def merge_pdfs(sources, output_path=None, titles=None, stats=None, backend=None):
+    """Returns the inputs concatenated into one PDF, keeping their bookmarks.
+
+    With `titles` (one per input), each input also gets a top-level bookmark
+    with its own outline nested underneath. With the PyMuPDF backend the
+    output is written incrementally, a batch of inputs at a time, so memory
+    does not grow with the total input size; streams repeated across inputs
+    and other objects repeated across inputs are stored once, and their count
+    is put in `stats` if given.
+    """
+    return _backend_op("merge", backend)(sources, output_path, titles, stats)
+
+
+def split_pdf(source, ranges, backend=None):
+    """Yields (first_page, last_page, pdf_bytes) for every 1-based page range."""
+    return _backend_op("split", backend)(source, ranges)
+
+
+def chunk_ranges(total_pages, pages_per_chunk=1):
+    """Splits the document into consecutive ranges of `pages_per_chunk` pages."""
+    return [
+        (first, min(first + pages_per_chunk - 1, total_pages))
+        for first in range(1, total_pages + 1, pages_per_chunk)
+    ]
+
+
+def bookmark_ranges(source, backend=None):
+    """Splits the document at its top-level bookmarks.
+
+    Pages before the first bookmark form their own range. Falls back to a
+    single range when the PDF has no bookmarks.
+    """
+    total_pages = page_count(source, backend)
+    starts = sorted({page_num for _, page_num in _backend_op("bookmarks", backend)(source)} | {1})
+    ends = [start - 1 for start in starts[1:]] + [total_pages]
+    return list(zip(starts, ends))
+
+
+def split_pdf_to_zip(source, zip_target, ranges, backend=None):
+    """Writes each range of the split straight into a ZIP archive.
+
+    `zip_target` is a path or a writable file object. Only one range is held
+    in memory at a time, so peak memory does not grow with the page count.
+    Returns the number of files written.
+    """
+    count = 0
+    with zipfile.ZipFile(zip_target, "w") as zf:
+        for first, last, data in split_pdf(source, ranges, backend):
+            arcname = f"page_{first}.pdf" if first == last else f"pages_{first}-{last}.pdf"
+            zf.writestr(arcname, data)
+            count += 1
+    return count
+
+
+def rotation_plan(total_pages, degrees, pages=None):
+    """Returns a {page: degrees} plan turning `pages` (default: all) clockwise by `degrees`."""
+    if degrees % 90:
+        raise ValueError(f"Rotation must be a multiple of 90 degrees, not {degrees}")
+    return {page_num: degrees % 360 for page_num in (pages or range(1, total_pages + 1)) if degrees % 360}
+
+
+def detect_rotations(source, backend=None):
+    """Returns a {page: degrees} plan turning pages upright from the direction of their text.
+
+    Pages whose text mostly runs sideways or upside down get the clockwise
+    rotation that makes it read left to right; pages without text (e.g.
+    scans that have not been OCRed) are left out. Needs PyMuPDF.
+    """
+    name = backend or DEFAULT_BACKEND
+    if name == "pypdf2" or fitz is None:
+        raise RuntimeError("Detecting page orientation requires PyMuPDF")
+    return _backend_op("detect_rotations", backend)(source)
+
+
+def rotate_pdf(source, plan, output_path=None, backend=None):
+    """Returns the PDF with pages rotated clockwise per `plan`, a {page: degrees} dict.
+
+    With PyMuPDF only the /Rotate entries change: the original file is copied
+    and the edited page objects are appended as an incremental update, so the
+    cost does not depend on the size of the page content. Passing the source
+    path as `output_path` updates the file in place.
+    """
+    return _backend_op("rotate", backend)(source, plan, output_path)
+
+
+# --- OCR ---
+# Pages without a text layer (scans) are rendered and read by Tesseract, one
+# child process per page. Each Tesseract run is limited to one thread, so
+# throughput grows with the number of concurrent runs (the "tesseract" tool
+# limit in jobs.TOOL_LIMITS) instead of each run competing for every core.
+
+OCR_DPI = int(os.environ.get("PDF_TOOL_OCR_DPI", "300"))
+OCR_LANGUAGE = os.environ.get("PDF_TOOL_OCR_LANG", "eng")
+OCR_TIMEOUT = 300
+_OCR_LANGUAGE_PATTERN = re.compile(r"^[A-Za-z_]+(\+[A-Za-z_]+)*$")
+
+
+def tesseract_cmd(image_path, dpi, language):
+    return ["tesseract", image_path, "stdout", "-l", language, "--dpi", str(dpi), "tsv"]
+
+
+def parse_tesseract_tsv(tsv):
+    """Returns the recognized words as (block, paragraph, line, left, top, width, height, text) tuples."""
+    words = []
+    for row in tsv.splitlines()[1:]:
+        fields = row.split("\t")
+        # Level 5 rows are words; the others only describe the layout
+        if len(fields) == 12 and fields[0] == "5" and fields[11].strip():
+            block, paragraph, line, left, top, width, height = (int(value) for value in fields[2:5] + fields[6:10])
+            words.append((block, paragraph, line, left, top, width, height, fields[11].strip()))
+    return words
+
+
+def ocr_text(words):
+    """Joins OCR words into lines, with a blank line between blocks."""
+    lines, current, last_key = [], [], None
+    for block, paragraph, line, *_, text in words:
+        key = (block, paragraph, line)
+        if current and key != last_key:
+            lines.append(" ".join(current))
+            if block != last_key[0]:
+                lines.append("")
+            current = []
+        current.append(text)
+        last_key = key
+    if current:
+        lines.append(" ".join(current))
+    return "\n".join(lines)
+
+
+def _ocr_image(image_path, dpi, language, job=None):
+    # OCR runs on helper threads; keep them attached to the caller's job so cancelling kills them
+    env = dict(os.environ, OMP_THREAD_LIMIT="1")
+    with job_context(job):
+        try:
+            result = run_process(tesseract_cmd(image_path, dpi, language), timeout=OCR_TIMEOUT, env=env)
+        except FileNotFoundError:
+            raise RuntimeError("Required external tool not found: tesseract. Check if dependencies are installed in `packages.txt`.") from None
+        except subprocess.TimeoutExpired:
+            raise RuntimeError(f"tesseract timed out after {OCR_TIMEOUT} seconds.") from None
+    if result.returncode != 0:
+        raise RuntimeError(f"tesseract failed: {result.stderr.strip()}")
+    return result.stdout
+
+
+def ocr_pages(source, pages, dpi=OCR_DPI, language=OCR_LANGUAGE, cache=None, workers=None):
+    """OCRs the given 1-based pages and yields (page_num, words) in page order.
+
+    Pages are rendered in grayscale at `dpi` one at a time while up to
+    `workers` Tesseract runs read the ones already rendered. With a cache
+    (anything with get/put, like ResultCache), results are stored under the
+    hash of the rendered page, so a page seen before in any document is not
+    read again.
+    """
+    if not _OCR_LANGUAGE_PATTERN.match(language):
+        raise ValueError(f"Invalid OCR language: {language}")
+    workers = workers or TOOL_LIMITS["tesseract"]
+    job = current_job()
+    with scratch_dir() as temp_dir, _fitz_open(source) as doc, ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = []
+
+        def finish_oldest():
+            page_num, cache_key, result = pending.pop(0)
+            tsv = result if isinstance(result, str) else result.result()
+            if cache is not None and not isinstance(result, str):
+                cache.put(cache_key, tsv.encode("utf-8"))
+            return page_num, parse_tesseract_tsv(tsv)
+
+        for page_num in pages:
+            with span("rasterize"):
+                pixmap = doc[page_num - 1].get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+                cache_key = make_cache_key("ocr_page", [pixmap.samples_mv], dpi=dpi, language=language)
+            cached = cache.get(cache_key) if cache is not None else None
+            if cached is not None:
+                pending.append((page_num, cache_key, cached.decode("utf-8")))
+            else:
+                image_path = os.path.join(temp_dir, f"page_{page_num}.png")
+                with span("rasterize"):
+                    pixmap.save(image_path)
+                future = pool.submit(_ocr_image, image_path, dpi, language, job)
+                future.add_done_callback(lambda _, path=image_path: os.remove(path))
+                pending.append((page_num, cache_key, future))
+            # Keep a bounded number of rendered pages waiting, so scratch space stays small
+            while len(pending) > 2 * workers:
+                yield finish_oldest()
+        while pending:
+            yield finish_oldest()
+
+
+def add_text_layer(source, page_words, dpi, output_path):
+    """Writes the PDF with OCR words laid over their pages as invisible, searchable text.
+
+    `page_words` maps 1-based pages to words from ocr_pages at `dpi`. Like
+    rotation, the original file is kept and the text is appended as an
+    incremental update.
+    """
+    _copy_for_update(source, output_path)
+    scale = 72 / dpi
+    with _fitz_open(output_path) as doc:
+        for page_num, words in page_words.items():
+            if not words:
+                continue
+            page = doc[page_num - 1]
+            shape = page.new_shape()
+            for *_, left, top, width, height, text in words:
+                # Word boxes are in rendered (rotated) page pixels; text is placed on the unrotated page
+                origin = fitz.Point(left, top + height) * scale * page.derotation_matrix
+                fontsize = min(height * scale, width * scale / max(fitz.get_text_length(text, "helv", 1), 1e-3))
+                shape.insert_text(origin, text, fontsize=fontsize, fontname="helv", rotate=page.rotation, render_mode=3)
+            shape.commit()
+        _save_update(doc, output_path)
+    return output_path
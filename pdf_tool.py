@@ -1,16 +1,18 @@
+import functools
+import time
 import streamlit as st
-import subprocess
-import os
-import tempfile
 from pathlib import Path
-from PyPDF2 import PdfReader, PdfWriter
-import fitz  # PyMuPDF
-import json
-import io
+import operations
+from pdf_ops import DocumentIndex, parse_page_list
+from result_cache import ResultCache
+from search_index import SearchIndex
+from latex_convert import latex_latency_stats
+from jobs import submit_job, get_job, cancel_job, job_counts
+import metrics
 
 st.set_page_config(
     page_title="PDF Tool",
-    page_icon="assets/images/pdf-tool.png",  
+    page_icon="assets/images/pdf-tool.png",
     layout="centered"
 )
 st.markdown("""
@@ -23,289 +25,376 @@ st.markdown("""
 # Sidebar for action selection
 action = st.sidebar.radio(
     "Select Action",
-    ["Compress", "Extract Text", "Extract Pages", "Merge", "Split", "Rotate", "Convert to PDF"],
+    ["Compress", "Extract Text", "Extract Pages", "Merge", "Split", "Rotate", "Convert to PDF", "Search"],
     index=0
 )
 
-# Function to run subprocess command and handle errors
-def run_subprocess(cmd, input_path, output_path):
-    """Encapsulates subprocess call and error checking."""
-    # Timeout set to 5 minutes to prevent long-running processes on large files
-    try:
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=300) 
-        
-        # Check if output file was created (essential for Ghostscript and pandoc)
-        if result.returncode == 0 and os.path.exists(output_path):
-            return True, None
-        else:
-            # Check for common dependency errors
-            if "wkhtmltopdf" in cmd[0] and "cannot execute binary file" in result.stderr:
-                return False, "❌ wkhtmltopdf is installed but may require the correct architecture or dependencies (like `libcairo2-dev`)."
-            if "pandoc" in cmd[0] and result.returncode != 0:
-                 return False, f"Pandoc failed with error: {result.stderr or result.stdout}"
-            return False, result.stderr
-    except FileNotFoundError:
-        return False, f"Required external tool not found: {cmd[0]}. Check if dependencies are installed in `packages.txt`."
-    except subprocess.TimeoutExpired:
-        return False, "Process timed out after 5 minutes."
-    except Exception as e:
-        return False, str(e)
+# Shared result cache, created once per server process
+@st.cache_resource
+def get_result_cache():
+    return ResultCache()
+
+result_cache = get_result_cache()
+
+
+# Full-text index of extracted text (PDF_TOOL_INDEX_PATH), opened once per server process
+@st.cache_resource
+def get_search_index():
+    return SearchIndex()
+
+
+# Prometheus endpoint on 127.0.0.1:PDF_TOOL_METRICS_PORT, started once per server process
+@st.cache_resource
+def get_metrics_server():
+    return metrics.start_metrics_server()
+
+get_metrics_server()
+
+THUMBNAIL_COLUMNS = 6
+MAX_THUMBNAILS = 48
+
+
+def get_document_index(section, uploaded_file):
+    """Returns the section's DocumentIndex of the upload, parsing it only when a new file is uploaded.
+
+    Each session keeps the index of one upload per section, so editing the
+    page selection does not parse the document again; the previous file's
+    index is closed once another one is uploaded.
+    """
+    state_key = f"{section}_document_index"
+    file_id, index = st.session_state.get(state_key, (None, None))
+    if file_id != uploaded_file.file_id:
+        if index is not None:
+            index.close()
+        index = DocumentIndex(uploaded_file.getvalue())
+        st.session_state[state_key] = (uploaded_file.file_id, index)
+    return index
+
+
+def download_data(result, section, key=None):
+    """Download button data for an output of the section's job; cached files are only read when clicked.
+
+    The cache may evict the file before the click. The operation is then
+    run again from the same inputs and its output (`key` of the result,
+    if given) is sent instead.
+    """
+    if result["path"] is None:
+        return result["data"]
+    _, _, rerun = st.session_state[f"{section}_job"]
+
+    def read_output(path=result["path"]):
+        with metrics.span("download_prep", operation="download"):
+            try:
+                return Path(path).read_bytes()
+            except FileNotFoundError:
+                output = rerun()
+                output = output[key] if key else output
+                return output["data"] if output["path"] is None else Path(output["path"]).read_bytes()
+    return read_output
+
+
+def show_output_report(report):
+    """Caption with what the output stage (pdf_ops.optimize_pdf) did, when it ran."""
+    if not report:
+        return
+    saved = report["bytes_saved"]
+    text = f"Output optimized: {saved / 1024:.0f} KB saved ({saved / max(report['bytes_before'], 1):.0%})"
+    if report["first_page_ms_after"] is not None:
+        text += f" · first page opens in {report['first_page_ms_after']:.0f} ms (was {report['first_page_ms_before']:.0f} ms)"
+    if report["linearized"]:
+        text += " · linearized for fast web view"
+    st.caption(text)
+
+
+# --- Background jobs ---
+# Each operation runs on the shared job pool (see jobs.py) so a long gs or
+# xelatex run neither blocks the script nor gets lost on a rerun.
+
+def start_job(section, inputs, operation, *args, cost_kind=None):
+    """Submits an operation from operations.py as a background job and remembers it for `section`.
+
+    `inputs` identifies the uploads and settings the job runs on (see
+    finished_job). The job's cost is estimated from its input (the first
+    argument) as operation `cost_kind`, by default the section name.
+    """
+    cost = operations.estimate_cost(cost_kind or section, args[0])
+    job = submit_job(section, operation, *args, cost=cost, cache=result_cache)
+    # The upload buffers are shared with the uploaded files, not copied
+    st.session_state[f"{section}_job"] = (job.id, inputs, functools.partial(operation, *args, cache=result_cache))
+
+
+@st.fragment(run_every=1)
+def show_job_progress(job_id, loader_text):
+    """Polls a running job; reruns the whole app once it has finished."""
+    job = get_job(job_id)
+    if job is None or not job.active:
+        st.rerun()
+
+    # Loader
+    st.markdown(f"""
+        <div style="display: flex; align-items: center; gap: 15px;">
+            <img src="https://cdn.pixabay.com/animation/2023/08/11/21/18/21-18-05-265_256.gif" width="30">
+            <h3 style="margin: 0;">{loader_text}</h3>
+        </div>
+    """, unsafe_allow_html=True)
+    st.progress(job.progress, text=job.message if job.status == "running" else job.message or "Queued, waiting for a free worker...")
+    if job.preview:
+        st.text(job.preview)
+    if st.button("Cancel", key=f"cancel_{job_id}"):
+        cancel_job(job_id)
+
+
+def finished_job(section, inputs, loader_text):
+    """Shows progress or errors for the section's job; returns it once it is done.
+
+    A job started for other `inputs` (another upload, or settings changed
+    since) is forgotten, so its result is never shown for the current ones.
+    """
+    job_id, job_inputs, _ = st.session_state.get(f"{section}_job", (None, None, None))
+    if job_inputs != inputs:
+        st.session_state.pop(f"{section}_job", None)
+        return None
+    job = get_job(job_id)
+    if job is None:
+        return None
+    if job.active:
+        show_job_progress(job.id, loader_text)
+    elif job.status == "failed":
+        st.error(f"❌ Error: {job.error}")
+    elif job.status == "rejected":
+        st.error(f"❌ {job.error}")
+    elif job.status == "cancelled":
+        st.warning("⚠️ Operation cancelled.")
+    return job if job.status == "done" else None
 
 
 # --- Compress Section ---
 if action == "Compress":
     st.header("Compress PDF")
     st.write("Reduce your PDF file size using Ghostscript compression.")
-    
+
     uploaded_file = st.file_uploader("Upload PDF", type="pdf", key="compress_file")
-    
-    compression_map = {
-        1: (72, "Maximum (smallest file)"),
-        2: (100, "High"),
-        3: (150, "Medium"),
-        4: (250, "Low"),
-        5: (300, "Minimum (best quality)")
-    }
-    
+
     compression_level = st.slider(
         "Compression Level",
         min_value=1,
         max_value=5,
         value=3,
         help="1 = Maximum compression (smaller file), 5 = Minimum compression (best quality)")
-    
-    dpi_value = compression_map[compression_level][0]
-    description = compression_map[compression_level][1]
+
+    dpi_value, pdf_setting = operations.compression_settings(compression_level)
+    description = operations.COMPRESSION_LEVELS[compression_level][1]
     st.caption(f"Selected: {description}")
-    
-    if uploaded_file and st.button("Compress PDF"):
+
+    sharded = st.checkbox(
+        "Parallel compression (split into page shards)",
+        value=False,
+        help="Compresses page ranges in parallel Ghostscript processes, one per CPU core, then stitches them back together. Faster on large multi-page PDFs.")
+
+    adaptive = st.checkbox(
+        "Adaptive (pick the settings for this document)",
+        value=False,
+        help="Analyzes the images and fonts, tries several settings in parallel on sample pages and keeps the smallest one that still looks like the original. Ignores the compression level and never returns a larger file.")
+
+    if uploaded_file:
+        job_inputs = (uploaded_file.file_id, compression_level, sharded, adaptive)
+        if st.button("Compress PDF"):
+            start_job("compress", job_inputs, operations.compress, uploaded_file.getvalue(), dpi_value, pdf_setting, sharded, adaptive)
+
+        # --- Conditional Message Logic ---
         file_size_mb = uploaded_file.size / (1024 * 1024)
         if file_size_mb > 80:
-            st.warning(f"⚠️ Large file ({file_size_mb:.1f} MB) - this may take a while.")
-        
-        with tempfile.TemporaryDirectory() as temp_dir:
-            input_path = os.path.join(temp_dir, "input.pdf")
-            output_path = os.path.join(temp_dir, "compressed.pdf")
-            
-            with open(input_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
-            
-            try:
-                
-                # Loader
-                status_container = st.empty()
-                
-                # --- Conditional Message Logic ---
-                if file_size_mb > 80:
-                    loader_text = "Compressing PDF... Please wait."
-                else:
-                    loader_text = "Compressing PDF... Please wait. Image-heavy PDFs may take a while."
-                    
-                status_container.markdown(f"""
-                    <div style="display: flex; align-items: center; gap: 15px;">
-                        <img src="https://cdn.pixabay.com/animation/2023/08/11/21/18/21-18-05-265_256.gif" width="30">
-                        <h3 style="margin: 0;">{loader_text}</h3>
-                    </div>
-                """, unsafe_allow_html=True)
-                # --- End Conditional Message Logic ---
-                
-                pdf_setting = "/ebook" if compression_level >= 4 else "/screen"
-                
-                cmd = [
-                    "gs", "-sDEVICE=pdfwrite", "-dCompatibilityLevel=1.4",
-                    f"-dPDFSETTINGS={pdf_setting}", "-dNOPAUSE", "-dQUIET", "-dBATCH",
-                    "-dDetectDuplicateImages", "-dCompressFonts=true",
-                    f"-r{dpi_value}x{dpi_value}",
-                    f"-sOutputFile={output_path}", input_path
-                ]
-                
-                success, error = run_subprocess(cmd, input_path, output_path)
-                status_container.empty()
-                
-                if success:
-                    original_size = os.path.getsize(input_path) / (1024 * 1024)
-                    compressed_size = os.path.getsize(output_path) / (1024 * 1024)
-                    
-                    if compressed_size > original_size:
-                        st.warning("⚠️ Output file is larger than input. Please choose a lower compression level.")
-                    else:
-                        reduction = ((original_size - compressed_size) / original_size) * 100
-                        st.success("✅ Compression complete!")
-                        col1, col2, col3 = st.columns(3)
-                        with col1:
-                            st.metric("Original Size", f"{original_size:.2f} MB")
-                        with col2:
-                            st.metric("Compressed Size", f"{compressed_size:.2f} MB")
-                        with col3:
-                            st.metric("Reduction", f"{reduction:.1f}%")
-                        
-                        output_filename = uploaded_file.name.replace(".pdf", "_compressed.pdf")
-                        with open(output_path, "rb") as f:
-                            st.download_button(
-                                label="📥 Download Compressed PDF",
-                                data=f.read(),
-                                file_name=output_filename,
-                                mime="application/pdf"
-                            )
-                else:
-                    st.error(f"❌ Compression failed: {error}")
-            except Exception as e:
-                st.error(f"❌ Error: {e}")
+            _, cpu_estimate = operations.estimate_cost("compress", uploaded_file.getvalue())
+            loader_text = f"Compressing PDF... Please wait. Large file ({file_size_mb:.1f} MB) - this may take a few minutes (about {max(cpu_estimate / 60, 1):.0f} CPU min)."
+        else:
+            loader_text = "Compressing PDF... Please wait. Image-heavy PDFs may take a while."
+        # --- End Conditional Message Logic ---
+
+        job = finished_job("compress", job_inputs, loader_text)
+        if job:
+            result = job.result
+            shard_timings = result["shard_timings"]
+            if shard_timings:
+                shards = [t for t in shard_timings if t["stage"] == "shard"]
+                serial_time = sum(t["seconds"] for t in shards)
+                wall_time = result["wall_time"]
+                with st.expander(f"Shard timings ({len(shards)} shards, {wall_time:.1f}s wall, {serial_time / max(wall_time, 1e-6):.1f}x speedup)"):
+                    fallback = [t for t in shard_timings if t["stage"] == "single pass"]
+                    if fallback:
+                        st.caption(f"Fonts embedded once per shard made the result too large; a single pass also ran "
+                                   f"({fallback[0]['seconds']:.1f}s) and its output was "
+                                   f"{'kept' if fallback[0]['kept'] else 'discarded'}. The wall time includes it.")
+                    st.table(shard_timings)
+
+            adaptive_report = result["adaptive_report"]
+            if adaptive_report:
+                analysis = adaptive_report["analysis"]
+                chosen = adaptive_report["chosen"] or "original kept (no candidate was smaller)"
+                with st.expander(f"Adaptive compression: {chosen} · {adaptive_report['bytes_saved_per_cpu_second'] / 1024:.0f} KB saved per CPU second"):
+                    st.caption(
+                        f"{analysis['pages']} pages · {analysis['images']} images ({analysis['image_bytes'] / (1024 * 1024):.1f} MB, "
+                        f"up to {analysis['max_image_dpi']} dpi) · fonts {analysis['font_bytes'] / 1024:.0f} KB · "
+                        f"{adaptive_report['cpu_seconds']:.1f} CPU seconds · minimum PSNR {adaptive_report['min_psnr']:.0f} dB"
+                    )
+                    st.table([
+                        {key: trial[key] for key in ("candidate", "sample_bytes", "psnr", "seconds", "error")}
+                        for trial in adaptive_report["trials"]
+                    ])
+
+            original_size = result["original_size"] / (1024 * 1024)
+            compressed_size = result["size"] / (1024 * 1024)
+
+            if compressed_size > original_size:
+                st.warning("⚠️ Output file is larger than input. Please choose a lower compression level.")
+            else:
+                reduction = ((original_size - compressed_size) / original_size) * 100
+                st.success("✅ Compression complete!")
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.metric("Original Size", f"{original_size:.2f} MB")
+                with col2:
+                    st.metric("Compressed Size", f"{compressed_size:.2f} MB")
+                with col3:
+                    st.metric("Reduction", f"{reduction:.1f}%")
+
+                output_filename = uploaded_file.name.replace(".pdf", "_compressed.pdf")
+                st.download_button(
+                    label="📥 Download Compressed PDF",
+                    data=download_data(result, "compress"),
+                    file_name=output_filename,
+                    mime="application/pdf"
+                )
 
 
 # --- Extract Text Section ---
 elif action == "Extract Text":
     st.header("Extract Text from PDF")
     uploaded_file = st.file_uploader("Upload PDF", type="pdf", key="extract_text_file")
-    
-    if uploaded_file and st.button("Extract Text"):
-        with tempfile.TemporaryDirectory() as temp_dir:
-            input_path = os.path.join(temp_dir, "input.pdf")
-            with open(input_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
-            
-            try:
-                status_container = st.empty()
-                status_container.markdown("""
-                    <div style="display: flex; align-items: center; gap: 15px;">
-                        <img src="https://cdn.pixabay.com/animation/2023/08/11/21/18/21-18-05-265_256.gif" width="30">
-                        <h3 style="margin: 0;">Extracting text... Please wait</h3>
-                    </div>
-                """, unsafe_allow_html=True)
-                
-                reader = PdfReader(input_path)
-                text = ""
-                for page_num, page in enumerate(reader.pages, 1):
-                    extracted = page.extract_text()
-                    if extracted:
-                        text += f"--- Page {page_num} ---\n{extracted}\n\n"
-                
-                status_container.empty()
-                st.success("✅ Text extracted successfully!")
-                
-                # Use reportlab to create a PDF of the extracted text for cleaner download
-                from reportlab.pdfgen import canvas
-                from reportlab.lib.pagesizes import letter
-                
-                pdf_path = os.path.join(temp_dir, "extracted_text.pdf")
-                c = canvas.Canvas(pdf_path, pagesize=letter)
-                width, height = letter
-                y = height - 50
-                
-                for line in text.split("\n"):
-                    if y < 50:
-                        c.showPage()
-                        y = height - 50
-                    safe_line = line[:1000]
-                    if safe_line.strip():
-                        c.drawString(40, y, safe_line)
-                    y -= 12
-                c.save()
-                
-                original_name = Path(uploaded_file.name).stem
-                pdf_filename = f"{original_name}_text.pdf"
-                txt_filename = f"{original_name}_text.txt"
-                
-                col1, col2 = st.columns(2)
-                with col1:
-                    with open(pdf_path, "rb") as f:
-                        st.download_button("📥 Download as PDF", f.read(), pdf_filename, "application/pdf")
-                with col2:
-                    st.download_button("📥 Download as Text", text, txt_filename, "text/plain")
-                
-                with st.expander("Preview (first 500 characters)"):
-                    st.text(text[:500])
-            except Exception as e:
-                st.error(f"❌ Error: {e}")
+    ocr = st.checkbox(
+        "OCR scanned pages",
+        value=False,
+        help="Reads pages that have no text layer with Tesseract and also gives you the PDF with their text made searchable.")
+    if ocr:
+        ocr_dpi = st.select_slider("OCR resolution (DPI)", options=[150, 200, 300, 400, 600], value=300,
+                                   help="Higher reads small print better but takes longer.")
+        ocr_language = st.text_input("OCR language", "eng", help="Tesseract language code(s), e.g. eng, deu or eng+ell.")
+    add_to_index = st.checkbox(
+        "Add to search index",
+        value=False,
+        help="Stores the text of every page so the document can be found from the Search page. Documents already in the index are skipped.")
+
+    if uploaded_file:
+        job_inputs = (uploaded_file.file_id, add_to_index) + ((ocr_dpi, ocr_language) if ocr else ())
+        if st.button("Extract Text"):
+            index = get_search_index() if add_to_index else None
+            if ocr:
+                start_job("extract_text", job_inputs, operations.extract_text, uploaded_file.getvalue(), None, True, ocr_dpi, ocr_language,
+                          index, uploaded_file.name, cost_kind="ocr")
+            else:
+                start_job("extract_text", job_inputs, operations.extract_text, uploaded_file.getvalue(), None, False, None, None,
+                          index, uploaded_file.name)
+
+        job = finished_job("extract_text", job_inputs, "Extracting text... Please wait")
+        if job:
+            result = job.result
+            st.success("✅ Text extracted successfully!")
+            if result["stats"]:
+                st.caption(result["stats"])
+
+            original_name = Path(uploaded_file.name).stem
+            pdf_filename = f"{original_name}_text.pdf"
+            txt_filename = f"{original_name}_text.txt"
+
+            if result["text"]["path"] is not None:
+                try:
+                    with open(result["text"]["path"], "r", encoding="utf-8") as f:
+                        preview = f.read(500)
+                except FileNotFoundError:
+                    preview = "(Evicted from the result cache; the download extracts the text again.)"
+            else:
+                preview = result["text"]["data"][:500].decode("utf-8", "ignore")
+
+            col1, col2 = st.columns(2)
+            with col1:
+                st.download_button("📥 Download as PDF", download_data(result["pdf"], "extract_text", "pdf"), pdf_filename, "application/pdf")
+            with col2:
+                st.download_button("📥 Download as Text", download_data(result["text"], "extract_text", "text"), txt_filename, "text/plain")
+            if result["searchable"] is not None:
+                st.download_button("📥 Download searchable PDF", download_data(result["searchable"], "extract_text", "searchable"),
+                                   f"{original_name}_searchable.pdf", "application/pdf")
+
+            with st.expander("Preview (first 500 characters)"):
+                st.text(preview)
 
 
 # --- Extract Pages Section ---
 elif action == "Extract Pages":
     st.header("Extract Pages from PDF")
     uploaded_file = st.file_uploader("Upload PDF", type="pdf", key="extract_pages_file")
-    
+
     if uploaded_file:
-        with tempfile.TemporaryDirectory() as temp_dir:
-            input_path = os.path.join(temp_dir, "input.pdf")
-            with open(input_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
-            
+        pages = None
+        try:
+            index = get_document_index("extract_pages", uploaded_file)
+            total_pages = index.page_count
+            st.info(f"Total pages in PDF: {total_pages}")
+
+            page_spec = st.text_input("Pages", f"1-{total_pages}", help="Pages and ranges to copy, in order, e.g. 1-3,7,10-12. \"10-\" runs to the last page; \"odd\" and \"even\" select every other page.")
             try:
-                reader = PdfReader(input_path)
-                total_pages = len(reader.pages)
-                st.info(f"Total pages in PDF: {total_pages}")
-                
-                col1, col2 = st.columns(2)
-                with col1:
-                    from_page = st.number_input("From Page", 1, total_pages, 1)
-                with col2:
-                    to_page = st.number_input("To Page", 1, total_pages, total_pages)
-                
-                if st.button("Extract Pages"):
-                    if from_page <= to_page:
-                        status_container = st.empty()
-                        status_container.markdown("""
-                            <div style="display: flex; align-items: center; gap: 15px;">
-                                <img src="https://cdn.pixabay.com/animation/2023/08/11/21/18/21-18-05-265_256.gif" width="30">
-                                <h3 style="margin: 0;">Extracting pages... Please wait</h3>
-                            </div>
-                        """, unsafe_allow_html=True)
-                        
-                        writer = PdfWriter()
-                        for page_num in range(from_page - 1, to_page):
-                            writer.add_page(reader.pages[page_num])
-                        
-                        output_path = os.path.join(temp_dir, "extracted.pdf")
-                        with open(output_path, "wb") as f:
-                            writer.write(f)
-                        
-                        status_container.empty()
-                        st.success("✅ Pages extracted successfully!")
-                        output_filename = uploaded_file.name.replace(".pdf", f"_pages_{from_page}_to_{to_page}.pdf")
-                        with open(output_path, "rb") as f:
-                            st.download_button("Download Extracted PDF", f.read(), output_filename, "application/pdf")
-                    else:
-                        st.error("❌ 'From Page' must be less than or equal to 'To Page'")
-            except Exception as e:
-                st.error(f"❌ Error: {e}")
+                pages = parse_page_list(page_spec, total_pages)
+            except ValueError as e:
+                pages = None
+                st.error(f"❌ {e}")
+
+            if pages and index.has_thumbnails and st.toggle("Show page thumbnails"):
+                columns = st.columns(THUMBNAIL_COLUMNS)
+                for i, page_num in enumerate(pages[:MAX_THUMBNAILS]):
+                    with columns[i % THUMBNAIL_COLUMNS]:
+                        st.image(index.thumbnail(page_num), caption=f"Page {page_num}")
+                if len(pages) > MAX_THUMBNAILS:
+                    st.caption(f"... and {len(pages) - MAX_THUMBNAILS} more pages")
+
+            if st.button("Extract Pages", disabled=not pages):
+                start_job("extract_pages", (uploaded_file.file_id, pages), operations.extract_pages, uploaded_file.getvalue(), pages)
+        except Exception as e:
+            st.error(f"❌ Error: {e}")
+
+        job = finished_job("extract_pages", (uploaded_file.file_id, pages), "Extracting pages... Please wait")
+        if job:
+            result = job.result
+            st.success("✅ Pages extracted successfully!")
+            output_filename = uploaded_file.name.replace(".pdf", f"_pages_{result['pages_label']}.pdf")
+            show_output_report(result["output_report"])
+            st.download_button("Download Extracted PDF", download_data(result, "extract_pages"), output_filename, "application/pdf")
 
 # --- Merge PDFs Section ---
 elif action == "Merge":
     st.header("Merge PDFs")
     uploaded_files = st.file_uploader("Upload PDFs", type="pdf", accept_multiple_files=True, key="merge_files")
-    
+
     if uploaded_files and len(uploaded_files) > 1:
         st.info(f"Ready to merge {len(uploaded_files)} PDFs")
+        # Files are merged by their position; edit the numbers to reorder them
+        order = st.data_editor(
+            {"Position": list(range(1, len(uploaded_files) + 1)), "File": [f.name for f in uploaded_files]},
+            column_config={"Position": st.column_config.NumberColumn(min_value=1, step=1, required=True)},
+            disabled=["File"], hide_index=True, key="merge_order",
+        )
+        ordered_files = [f for _, _, f in sorted(zip(order["Position"], range(len(uploaded_files)), uploaded_files))]
+        bookmark_files = st.checkbox("Add a bookmark for each file", value=True)
+        job_inputs = ([f.file_id for f in ordered_files], bookmark_files)
         if st.button("Merge PDFs"):
-            with tempfile.TemporaryDirectory() as temp_dir:
-                writer = PdfWriter()
-                try:
-                    status_container = st.empty()
-                    status_container.markdown("""
-                        <div style="display: flex; align-items: center; gap: 15px;">
-                            <img src="https://cdn.pixabay.com/animation/2023/08/11/21/18/21-18-05-265_256.gif" width="30">
-                            <h3 style="margin: 0;">Merging PDFs... Please wait</h3>
-                        </div>
-                    """, unsafe_allow_html=True)
-                    
-                    for i, uploaded_file in enumerate(uploaded_files):
-                        input_path = os.path.join(temp_dir, f"input_{i}.pdf")
-                        with open(input_path, "wb") as f:
-                            f.write(uploaded_file.getbuffer())
-                        reader = PdfReader(input_path)
-                        for page in reader.pages:
-                            writer.add_page(page)
-                    
-                    output_path = os.path.join(temp_dir, "merged.pdf")
-                    with open(output_path, "wb") as f:
-                        writer.write(f)
-                    
-                    status_container.empty()
-                    st.success("✅ PDFs merged successfully!")
-                    with open(output_path, "rb") as f:
-                        st.download_button("Download Merged PDF", f.read(), "merged.pdf", "application/pdf")
-                except Exception as e:
-                    st.error(f"❌ Error: {e}")
+            titles = [Path(f.name).stem for f in ordered_files] if bookmark_files else None
+            start_job("merge", job_inputs, operations.merge, [f.getvalue() for f in ordered_files], titles)
+
+        job = finished_job("merge", job_inputs, "Merging PDFs... Please wait")
+        if job:
+            result = job.result
+            st.success("✅ PDFs merged successfully!")
+            if result["deduplicated_objects"]:
+                st.caption(f"{result['deduplicated_objects']} fonts, images and other objects shared between files were stored once")
+            show_output_report(result["output_report"])
+            st.download_button("Download Merged PDF", download_data(result, "merge"), "merged.pdf", "application/pdf")
     elif uploaded_files and len(uploaded_files) == 1:
         st.warning("⚠️ Please upload at least 2 PDFs.")
 
@@ -313,309 +402,165 @@ elif action == "Merge":
 elif action == "Split":
     st.header("Split PDF")
     uploaded_file = st.file_uploader("Upload PDF", type="pdf", key="split_file")
-    
-    if uploaded_file and st.button("Split PDF"):
-        with tempfile.TemporaryDirectory() as temp_dir:
-            input_path = os.path.join(temp_dir, "input.pdf")
-            with open(input_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
-            
-            try:
-                status_container = st.empty()
-                status_container.markdown("""
-                    <div style="display: flex; align-items: center; gap: 15px;">
-                        <img src="https://cdn.pixabay.com/animation/2023/08/11/21/18/21-18-05-265_256.gif" width="30">
-                        <h3 style="margin: 0;">Splitting PDF... Please wait</h3>
-                    </div>
-                """, unsafe_allow_html=True)
-                
-                reader = PdfReader(input_path)
-                total_pages = len(reader.pages)
-                st.success(f"✅ PDF split into {total_pages} pages!")
-                
-                import zipfile
-                zip_buffer = tempfile.NamedTemporaryFile(suffix=".zip", delete=False)
-                with zipfile.ZipFile(zip_buffer.name, 'w') as zf:
-                    for page_num, page in enumerate(reader.pages, 1):
-                        writer = PdfWriter()
-                        writer.add_page(page)
-                        page_path = os.path.join(temp_dir, f"page_{page_num}.pdf")
-                        with open(page_path, "wb") as f:
-                            writer.write(f)
-                        zf.write(page_path, arcname=f"page_{page_num}.pdf")
-                
-                status_container.empty()
-                original_name = Path(uploaded_file.name).stem
-                zip_filename = f"{original_name}.zip"
-                with open(zip_buffer.name, "rb") as f:
-                    st.download_button("Download All Pages (ZIP)", f.read(), zip_filename, "application/zip")
-            except Exception as e:
-                st.error(f"❌ Error: {e}")
+    split_mode = st.radio("Split into", ["Single pages", "Chunks of N pages", "Bookmark sections"], horizontal=True)
+    pages_per_chunk = 1
+    if split_mode == "Chunks of N pages":
+        pages_per_chunk = st.number_input("Pages per chunk", min_value=1, value=10)
+
+    if uploaded_file:
+        job_inputs = (uploaded_file.file_id, split_mode, pages_per_chunk)
+        if st.button("Split PDF"):
+            start_job("split", job_inputs, operations.split, uploaded_file.getvalue(), split_mode, pages_per_chunk)
+
+        job = finished_job("split", job_inputs, "Splitting PDF... Please wait")
+        if job:
+            result = job.result
+            unit = "pages" if result["split_mode"] == "Single pages" else "files"
+            st.success(f"✅ PDF split into {result['total_files']} {unit}!")
+            original_name = Path(uploaded_file.name).stem
+            zip_filename = f"{original_name}.zip"
+            st.download_button("Download All Pages (ZIP)", download_data(result, "split"), zip_filename, "application/zip")
 
 
 # --- Rotate Section ---
 elif action == "Rotate":
     st.header("Rotate PDF Pages")
     uploaded_file = st.file_uploader("Upload PDF", type="pdf", key="rotate_file")
-    rotation = st.selectbox("Rotation", ["90°", "180°", "270°"], index=0)
-    
-    if uploaded_file and st.button("Rotate PDF"):
-        with tempfile.TemporaryDirectory() as temp_dir:
-            input_path = os.path.join(temp_dir, "input.pdf")
-            with open(input_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
-            
-            try:
-                status_container = st.empty()
-                status_container.markdown("""
-                    <div style="display: flex; align-items: center; gap: 15px;">
-                        <img src="https://cdn.pixabay.com/animation/2023/08/11/21/18/21-18-05-265_256.gif" width="30">
-                        <h3 style="margin: 0;">Rotating PDF... Please wait</h3>
-                    </div>
-                """, unsafe_allow_html=True)
-                
+    auto_rotate = st.checkbox(
+        "Auto-detect orientation",
+        value=False,
+        help="Turns each page upright from the direction of its text. Pages without text, such as scans that have not been OCRed, are left as they are.")
+    if not auto_rotate:
+        rotation = st.selectbox("Rotation", ["90°", "180°", "270°"], index=0)
+        page_spec = st.text_input("Pages", "all", help="Pages to rotate, e.g. 1-3,7 or \"odd\" / \"even\"; \"all\" rotates every page.")
+    optimize_output = st.checkbox(
+        "Optimize output",
+        value=False,
+        help="Rewrites the rotated file without unused and duplicate objects, with compressed object streams. Usually smaller, but slower than only updating the page rotations.")
+
+    if uploaded_file:
+        job_inputs = (uploaded_file.file_id, auto_rotate, optimize_output) + (() if auto_rotate else (rotation, page_spec))
+        try:
+            pages = None
+            if not auto_rotate and page_spec.strip().lower() != "all":
+                index = get_document_index("rotate", uploaded_file)
+                pages = parse_page_list(page_spec, index.page_count)
+            if st.button("Rotate PDF"):
                 rotation_map = {"90°": 90, "180°": 180, "270°": 270}
-                rotation_degrees = rotation_map[rotation]
-                
-                reader = PdfReader(input_path)
-                writer = PdfWriter()
-                for page in reader.pages:
-                    page.rotate(rotation_degrees)
-                    writer.add_page(page)
-                
-                output_path = os.path.join(temp_dir, "rotated.pdf")
-                with open(output_path, "wb") as f:
-                    writer.write(f)
-                
-                status_container.empty()
-                st.success("✅ PDF rotated successfully!")
-                
-                original_name = Path(uploaded_file.name).stem
-                rotated_filename = f"{original_name}_rotated.pdf"
-                with open(output_path, "rb") as f:
-                    st.download_button("Download Rotated PDF", f.read(), rotated_filename, "application/pdf")
-            except Exception as e:
-                st.error(f"❌ Error: {e}")
+                rotation_degrees = 0 if auto_rotate else rotation_map[rotation]
+                start_job("rotate", job_inputs, operations.rotate, uploaded_file.getvalue(), rotation_degrees, pages, auto_rotate,
+                          optimize_output)
+        except ValueError as e:
+            st.error(f"❌ {e}")
+
+        job = finished_job("rotate", job_inputs, "Rotating PDF... Please wait")
+        if job:
+            st.success(f"✅ PDF rotated successfully! ({job.result['rotated_pages']} pages turned)")
+            show_output_report(job.result["output_report"])
+            original_name = Path(uploaded_file.name).stem
+            rotated_filename = f"{original_name}_rotated.pdf"
+            st.download_button("Download Rotated PDF", download_data(job.result, "rotate"), rotated_filename, "application/pdf")
 
 # --- Convert to PDF Section ---
 elif action == "Convert to PDF":
     st.header("Convert Files to PDF")
-    
+
     # Inline badges for supported types
     st.markdown("""
-    Convert only the following file types to PDF:  
+    Convert only the following file types to PDF:
     <span style="background-color:#ffd700; color:black; padding:2px 6px; border-radius:3px; font-weight:bold; margin-right:10px;">TXT</span>
     <span style="background-color:#0619A1; color:white; padding:2px 6px; border-radius:3px; font-weight:bold; margin-right:10px;">PY</span>
     <span style="background-color:#027D05; color:white; padding:2px 6px; border-radius:3px; font-weight:bold;">IPYNB</span>
     """, unsafe_allow_html=True)
-    
+
     uploaded_file = st.file_uploader(
-        "Upload File", 
+        "Upload File",
         type=["txt", "py", "ipynb"],
         key="convert_file"
     )
 
-    if uploaded_file and st.button("Convert to PDF"):
-        file_extension = Path(uploaded_file.name).suffix.lower()
+    if uploaded_file:
         original_name = Path(uploaded_file.name).stem
-        
-        with tempfile.TemporaryDirectory() as temp_dir:
-            input_path = os.path.join(temp_dir, f"input{file_extension}")
-            output_path = os.path.join(temp_dir, "output.pdf")
-            
-            # Save uploaded file
-            with open(input_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
-            
-            status_container = st.empty()
-            status_container.markdown("""
-                <div style="display: flex; align-items: center; gap: 15px;">
-                    <img src="https://cdn.pixabay.com/animation/2023/08/11/21/18/21-18-05-265_256.gif" width="30">
-                    <h3 style="margin: 0;">Converting file... Please wait</h3>
-                </div>
-            """, unsafe_allow_html=True)
-            
-            conversion_success = False
-            error_message = ""
+        file_extension = Path(uploaded_file.name).suffix.lower()
+        line_numbers = False
+        if file_extension == ".py":
+            line_numbers = st.checkbox("Line numbers", value=False)
+        job_inputs = (uploaded_file.file_id, line_numbers)
+        if st.button("Convert to PDF"):
+            start_job("convert", job_inputs, operations.convert, uploaded_file.getvalue(), file_extension, original_name, line_numbers)
 
-            try:
-                # --- TXT Conversion ---
-                if file_extension == ".txt":
-                    from reportlab.pdfgen import canvas
-                    from reportlab.lib.pagesizes import letter
-                    from reportlab.lib.units import inch
-                    import textwrap
-
-                    with open(input_path, "r", encoding="utf-8") as f:
-                        text = f.read()
-                    
-                    c = canvas.Canvas(output_path, pagesize=letter)
-                    width, height = letter
-                    margin = 0.75 * inch
-                    usable_width = width - 2 * margin
-                    y = height - margin
-                    c.setFont("Courier", 10)
-
-                    char_width = c.stringWidth("A", "Courier", 10)
-                    max_chars = int(usable_width / char_width)
-
-                    for line in text.split("\n"):
-                        if line.strip() == "":
-                            y -= 12
-                            if y < margin:
-                                c.showPage()
-                                y = height - margin
-                                c.setFont("Courier", 10)
-                            continue
-
-                        wrapped_lines = textwrap.wrap(line, width=max_chars)
-                        for wrapped_line in wrapped_lines:
-                            c.drawString(margin, y, wrapped_line)
-                            y -= 12
-                            if y < margin:
-                                c.showPage()
-                                y = height - margin
-                                c.setFont("Courier", 10)
-                    c.save()
-                    conversion_success = True
-
-                # --- PY Conversion ---
-                elif file_extension == ".py":
-                    import textwrap
-                    py_content = uploaded_file.getvalue().decode("utf-8")
-                    py_content = textwrap.dedent(py_content).strip()
-                    py_content = "\n" + py_content  # blank line at top
-
-                    latex_template = fr"""
-\documentclass[12pt,a4paper]{{article}}
-\usepackage[top=0.6in,bottom=0.5in,left=0.68in,right=0.68in]{{geometry}}
-\usepackage{{minted}}
-\usepackage{{xcolor}}
-\usepackage{{fvextra}}
-\pagestyle{{empty}}
-\setlength{{\parindent}}{{0pt}}
-\setlength{{\parskip}}{{0pt}}
-\setlength{{\footskip}}{{5pt}}
-\setlength{{\textheight}}{{730pt}}
-
-\begin{{document}}
-\vspace*{{-0.8cm}}
-\begin{{minted}}[
-breaklines,
-breakanywhere,
-fontsize=\small,
-framesep=0pt,
-xleftmargin=0pt,
-xrightmargin=0pt,
-resetmargins=true,
-gobble=0,
-rulecolor=,
-framerule=0pt,
-baselinestretch=1.05
-]{{python}}
-{py_content}
-\end{{minted}}
-\vspace*{{-0.2cm}}
-\end{{document}}
-"""
-                    tex_path = os.path.join(temp_dir, "py_file.tex")
-                    with open(tex_path, "w", encoding="utf-8") as f:
-                        f.write(latex_template)
-
-                    cmd_xelatex = ["xelatex", "-shell-escape", "-interaction=batchmode", tex_path]
-                    result = subprocess.run(cmd_xelatex, cwd=temp_dir, capture_output=True, text=True, timeout=120)
-                    pdf_file = os.path.join(temp_dir, "py_file.pdf")
-                    if os.path.exists(pdf_file):
-                        os.rename(pdf_file, output_path)
-                        conversion_success = True
-                    else:
-                        conversion_success = False
-                        error_message = result.stderr or "LaTeX compilation failed."
-
-                # --- IPYNB Conversion - Escape YAML markers instead of removing them ---
-                elif file_extension == ".ipynb":
-                    try:
-                        # Load the notebook
-                        with open(input_path, "r", encoding="utf-8") as f:
-                            notebook_json = json.load(f)
-                        
-                        # Set title metadata
-                        notebook_json.setdefault("metadata", {})["title"] = original_name
-                        
-                        # Fix markdown cells to prevent YAML parsing issues
-                        for cell in notebook_json.get("cells", []):
-                            if cell.get("cell_type") == "markdown":
-                                source = cell.get("source", [])
-                                if isinstance(source, list):
-                                    fixed_source = []
-                                    
-                                    for i, line in enumerate(source):
-                                        # If line is exactly "---\n" or "---", escape it by adding a space or converting to literal
-                                        # This prevents pandoc from treating it as YAML front matter
-                                        if line.strip() == "---":
-                                            # Add a zero-width space or use HTML horizontal rule instead
-                                            # Option 1: Use HTML <hr> which renders as horizontal line
-                                            fixed_source.append("<hr>\n")
-                                            # Option 2 (alternative): Add backslash escape: fixed_source.append("\\---\n")
-                                        else:
-                                            fixed_source.append(line)
-                                    
-                                    cell["source"] = fixed_source
-                        
-                        # Save the fixed notebook
-                        with open(input_path, "w", encoding="utf-8") as f:
-                            json.dump(notebook_json, f)
-                        
-                        # Convert to LaTeX
-                        cmd_nbconvert = [
-                            "jupyter-nbconvert", "--to", "latex",
-                            input_path,
-                            "--output", "notebook_output.tex",
-                            "--output-dir", temp_dir
-                        ]
-                        result_nbconvert = subprocess.run(cmd_nbconvert, capture_output=True, text=True, timeout=120)
-                        
-                        latex_output_path = os.path.join(temp_dir, "notebook_output.tex")
-                        if result_nbconvert.returncode == 0 and os.path.exists(latex_output_path):
-                            # Compile LaTeX to PDF (run twice for proper rendering)
-                            xelatex_cmd = ["xelatex", "--interaction=batchmode", "notebook_output.tex"]
-                            subprocess.run(xelatex_cmd, cwd=temp_dir, capture_output=True, text=True, timeout=120)
-                            subprocess.run(xelatex_cmd, cwd=temp_dir, capture_output=True, text=True, timeout=120)
-                            
-                            final_pdf_path = os.path.join(temp_dir, "notebook_output.pdf")
-                            if os.path.exists(final_pdf_path):
-                                os.rename(final_pdf_path, output_path)
-                                conversion_success = True
-                            else:
-                                conversion_success = False
-                                error_message = "LaTeX compilation failed for notebook."
-                        else:
-                            conversion_success = False
-                            error_message = f"Notebook → LaTeX failed: {result_nbconvert.stderr}"
-                    except Exception as e:
-                        conversion_success = False
-                        error_message = f"Notebook conversion error: {e}"
-
-                status_container.empty()
-                if conversion_success and os.path.exists(output_path):
-                    st.success(f"✅ {file_extension[1:].upper()} converted to PDF successfully!")
-                    converted_size = os.path.getsize(output_path) / (1024 * 1024)
-                    st.metric("Output Size", f"{converted_size:.2f} MB")
-                    with open(output_path, "rb") as f:
-                        st.download_button(
-                            label="📥 Download PDF",
-                            data=f.read(),
-                            file_name=f"{original_name}.pdf",
-                            mime="application/pdf"
-                        )
-                    # Smaller reminder message
-                    st.markdown(
-                        '<p style="font-size:0.85em; color:#555;">⚠️ Always check the output PDF</p>',
-                        unsafe_allow_html=True
-                    )
-                else:
-                    st.error(f"❌ Conversion failed: {error_message}")
+        job = finished_job("convert", job_inputs, "Converting file... Please wait")
+        if job:
+            result = job.result
+            st.success(f"✅ {result['file_extension'][1:].upper()} converted to PDF successfully!")
+            converted_size = result["size"] / (1024 * 1024)
+            st.metric("Output Size", f"{converted_size:.2f} MB")
+            if result["notebook_stats"]:
+                notebook_stats = result["notebook_stats"]
+                st.caption(f"Notebook cells: {notebook_stats['cells_rendered']} of {notebook_stats['cells']} rendered, "
+                           f"the rest reused from earlier conversions")
+            if result["compile_kind"] == "cached":
+                st.caption("LaTeX compile: skipped, the notebook renders the same as an earlier conversion")
+            elif result["compile_kind"]:
+                latency = latex_latency_stats()
+                st.caption(
+                    f"LaTeX compile: {result['compile_kind']} · average cold {latency['cold']['mean_seconds']:.1f}s "
+                    f"({latency['cold']['count']} runs) vs warm {latency['warm']['mean_seconds']:.1f}s ({latency['warm']['count']} runs)"
+                )
+            st.download_button(
+                label="📥 Download PDF",
+                data=download_data(result, "convert"),
+                file_name=f"{original_name}.pdf",
+                mime="application/pdf"
+            )
+            # Smaller reminder message
+            st.markdown(
+                '<p style="font-size:0.85em; color:#555;">⚠️ Always check the output PDF</p>',
+                unsafe_allow_html=True
+            )
+
+
+# --- Search Section ---
+elif action == "Search":
+    st.header("Search Extracted Text")
+    st.write("Find pages in every document added to the search index from **Extract Text**.")
+    search_index = get_search_index()
+    index_stats = search_index.stats()
+    st.caption(f"{index_stats['documents']} documents · {index_stats['pages']} pages · {index_stats['size_mb']:.1f} MB")
+
+    query = st.text_input("Search for", help='Words must all appear on the page. Also supports "exact phrases", OR, NOT and prefix*.')
+    if query.strip():
+        start_time = time.perf_counter()
+        matches = search_index.search(query, limit=50)
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        if matches:
+            st.caption(f"{len(matches)} matching pages in {elapsed_ms:.0f} ms")
+            st.dataframe(
+                [{"Document": match["name"], "Page": match["page"], "Snippet": match["snippet"]} for match in matches],
+                hide_index=True)
+        else:
+            st.info("No matching pages.")
+
+
+# --- Cache Statistics (sidebar) ---
+cache_stats = result_cache.stats()
+st.sidebar.markdown("---")
+st.sidebar.caption(
+    f"Result cache: {cache_stats['hits']} hits · {cache_stats['misses']} misses · "
+    f"{cache_stats['evictions']} evictions · {cache_stats['entries']} entries ({cache_stats['size_mb']:.1f} MB)"
+)
+job_stats = job_counts()
+st.sidebar.caption(
+    f"Background jobs: {job_stats['running']} running · {job_stats['queued']} queued · "
+    f"{job_stats['reserved_memory'] / (1024 * 1024):.0f} of {job_stats['memory_budget'] / (1024 * 1024):.0f} MB reserved"
+)
 
-            except Exception as e:
-                status_container.empty()
-                st.error(f"❌ Critical Error: {e}")
\ No newline at end of file
+# --- Performance metrics (sidebar, optional) ---
+if st.sidebar.toggle("Show performance metrics", value=False):
+    stage_rows = metrics.stage_summary()
+    if stage_rows:
+        st.sidebar.dataframe(stage_rows, hide_index=True)
+    else:
+        st.sidebar.caption("No operations have run yet.")
+    with st.sidebar.expander("Prometheus metrics"):
+        st.code(metrics.render_prometheus(), language=None)
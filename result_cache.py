@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "PDF_TOOL_CACHE_DIR", os.path.join(tempfile.gettempdir(), "pdf_tool_cache"))
+DEFAULT_MAX_BYTES = int(os.environ.get("PDF_TOOL_CACHE_MB", "512")) * 1024 * 1024
+DEFAULT_TTL_SECONDS = int(os.environ.get("PDF_TOOL_CACHE_TTL", str(24 * 3600)))
+
+
+def make_cache_key(operation, buffers, **params):
+    """Hashes the input bytes together with the operation and its parameters."""
+    digest = hashlib.sha256(operation.encode("utf-8"))
+    for buffer in buffers:
+        digest.update(hashlib.sha256(buffer).digest())
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Disk-backed operation results with LRU eviction by total size and a TTL."""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # key -> (size, created); ordered from least to most recently used
+        self._index = OrderedDict()
+        self._total_bytes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _load_index(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = self._path(name)
+            if name.endswith(".tmp") or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_atime, name, stat.st_size, stat.st_mtime))
+        for _, name, size, created in sorted(entries):
+            self._index[name] = (size, created)
+            self._total_bytes += size
+
+    def _remove(self, key):
+        size, _ = self._index.pop(key)
+        self._total_bytes -= size
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def get_path(self, key):
+        """Returns the path of the cached file for `key`, or None on a miss."""
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is not None and time.time() - entry[1] > self.ttl_seconds:
+                self._remove(key)
+                self.evictions += 1
+                entry = None
+            if entry is None or not os.path.exists(self._path(key)):
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+            self.hits += 1
+            return self._path(key)
+
+    def get(self, key):
+        """Returns the cached bytes for `key`, or None on a miss."""
+        path = self.get_path(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _tmp_path(self):
+        # Unique per writer, so concurrent puts of the same key do not clobber each other
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        os.close(fd)
+        return tmp_path
+
+    def put(self, key, data):
+        """Stores `data` under `key` and evicts least recently used entries over budget."""
+        if len(data) > self.max_bytes:
+            return
+        tmp_path = self._tmp_path()
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        if not self._commit(key, tmp_path, len(data)):
+            os.remove(tmp_path)
+
+    def put_file(self, key, src_path):
+        """Moves the file at `src_path` into the cache without reading it into memory.
+
+        Returns the cached path, or None if the file is over the byte budget
+        or could not be stored; the file is then left at `src_path`.
+        """
+        size = os.path.getsize(src_path)
+        if size > self.max_bytes:
+            return None
+        tmp_path = self._tmp_path()
+        shutil.move(src_path, tmp_path)
+        if not self._commit(key, tmp_path, size):
+            shutil.move(tmp_path, src_path)
+            return None
+        return self._path(key)
+
+    def _commit(self, key, tmp_path, size):
+        """Moves `tmp_path` into place as `key`; returns False, keeping `tmp_path`, if that fails."""
+        with self._lock:
+            if key in self._index:
+                self._remove(key)
+            try:
+                os.replace(tmp_path, self._path(key))
+            except OSError:
+                return False
+            self._index[key] = (size, time.time())
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes:
+                oldest = next(iter(self._index))
+                self._remove(oldest)
+                self.evictions += 1
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._index),
+                "size_mb": self._total_bytes / (1024 * 1024),
+            }
@@ -0,0 +1,166 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+
+DEFAULT_INDEX_PATH = os.environ.get(
+    "PDF_TOOL_INDEX_PATH", os.path.join(tempfile.gettempdir(), "pdf_tool_index.sqlite3"))
+
+# Pages written per transaction
+BATCH_PAGES = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    doc_hash TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    page_count INTEGER NOT NULL DEFAULT 0,
+    complete INTEGER NOT NULL DEFAULT 0,
+    indexed REAL NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS pages USING fts5(
+    text, doc_id UNINDEXED, page UNINDEXED, tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+
+def document_hash(pdf_bytes):
+    """Returns the key a document is indexed under: the SHA-256 of its bytes."""
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+
+def _quoted(query):
+    """Turns free text into an FTS5 query matching pages that contain every word."""
+    return " ".join('"' + term.replace('"', '""') + '"' for term in query.split())
+
+
+class SearchIndex:
+    """SQLite FTS5 index of extracted page text, keyed by document hash and page number.
+
+    Safe to share between threads; several processes can write to the same
+    file, each batch waiting for the others' transactions to finish.
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        # Hashes of the documents this process is indexing right now
+        self._indexing = set()
+        self._connection = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        with self._lock:
+            self._connection.executescript(SCHEMA)
+
+    def has_document(self, doc_hash):
+        with self._lock:
+            return self._has_document(doc_hash)
+
+    def _has_document(self, doc_hash):
+        row = self._connection.execute(
+            "SELECT 1 FROM documents WHERE doc_hash = ? AND complete", (doc_hash,)).fetchone()
+        return row is not None
+
+    def add_document(self, doc_hash, name, page_texts):
+        """Indexes (page number, text) pairs of a document; returns False if it was already indexed.
+
+        Pages are written BATCH_PAGES per transaction and the document only
+        counts as indexed after the last one, so an interrupted run is
+        redone from scratch next time. The connection is only held for one
+        batch at a time, so searches are not blocked while a large document
+        is indexed; a document another thread is already indexing is skipped.
+        """
+        with self._lock:
+            if doc_hash in self._indexing or self._has_document(doc_hash):
+                return False
+            self._indexing.add(doc_hash)
+        try:
+            with self._lock:
+                connection = self._connection
+                connection.execute("BEGIN IMMEDIATE")
+                try:
+                    row = connection.execute("SELECT id FROM documents WHERE doc_hash = ?", (doc_hash,)).fetchone()
+                    if row is None:
+                        doc_id = connection.execute(
+                            "INSERT INTO documents (doc_hash, name, indexed) VALUES (?, ?, ?)",
+                            (doc_hash, name, time.time())).lastrowid
+                    else:
+                        doc_id = row[0]
+                        connection.execute("DELETE FROM pages WHERE doc_id = ?", (doc_id,))
+                    connection.execute("COMMIT")
+                except BaseException:
+                    connection.execute("ROLLBACK")
+                    raise
+
+            batch = []
+            page_total = 0
+            for page_num, text in page_texts:
+                page_total += 1
+                if text.strip():
+                    batch.append((text, doc_id, page_num))
+                if len(batch) == BATCH_PAGES:
+                    self._write_batch(batch)
+                    batch = []
+            self._write_batch(batch, "UPDATE documents SET page_count = ?, complete = 1 WHERE id = ?", (page_total, doc_id))
+        finally:
+            with self._lock:
+                self._indexing.discard(doc_hash)
+        return True
+
+    def _write_batch(self, rows, statement=None, params=()):
+        with self._lock:
+            connection = self._connection
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.executemany("INSERT INTO pages (text, doc_id, page) VALUES (?, ?, ?)", rows)
+                if statement:
+                    connection.execute(statement, params)
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+    def search(self, query, limit=20):
+        """Returns the best matching pages as dicts with "doc_hash", "name", "page" and "snippet".
+
+        `query` uses the FTS5 syntax (AND, OR, NOT, "phrases", prefix*); if it
+        is not valid FTS5, it matches pages containing all of its words.
+        """
+        sql = """
+            SELECT documents.doc_hash, documents.name, pages.page,
+                   snippet(pages, 0, '[', ']', '…', 12)
+            FROM pages JOIN documents ON documents.id = pages.doc_id
+            WHERE pages MATCH ? AND documents.complete
+            ORDER BY rank LIMIT ?
+        """
+        with self._lock:
+            try:
+                rows = self._connection.execute(sql, (query, limit)).fetchall()
+            except sqlite3.OperationalError as e:
+                # Syntax errors, an unclosed quote, or a "word:" read as a column filter
+                if not str(e).startswith(("fts5:", "unterminated string", "no such column")):
+                    raise
+                rows = self._connection.execute(sql, (_quoted(query), limit)).fetchall() if query.split() else []
+        return [{"doc_hash": doc_hash, "name": name, "page": page, "snippet": snippet}
+                for doc_hash, name, page, snippet in rows]
+
+    def stats(self):
+        with self._lock:
+            documents, pages = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(page_count), 0) FROM documents WHERE complete").fetchone()
+        return {"documents": documents, "pages": pages, "size_mb": os.path.getsize(self.path) / (1024 * 1024)}
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(path=DEFAULT_INDEX_PATH):
+    """Returns this process's SearchIndex for `path`, opening it on first use."""
+    with _indexes_lock:
+        if path not in _indexes:
+            _indexes[path] = SearchIndex(path)
+        return _indexes[path]
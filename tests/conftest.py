@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+fitz = pytest.importorskip("fitz")
+
+
+def make_pdf(pages=5, toc=None):
+    """Returns the bytes of a small PDF with one line of text per page."""
+    with fitz.open() as doc:
+        for page_num in range(1, pages + 1):
+            page = doc.new_page()
+            page.insert_text((72, 72), f"Page {page_num} " * 20)
+        if toc:
+            doc.set_toc(toc)
+        return doc.tobytes()
+
+
+@pytest.fixture
+def sample_pdf():
+    return make_pdf(5, toc=[[1, "Intro", 1], [1, "Body", 3]])
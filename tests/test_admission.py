@@ -0,0 +1,92 @@
+import resource
+import sys
+import threading
+
+import pytest
+
+import jobs
+import operations
+from conftest import make_pdf
+from test_jobs import wait_for
+
+MB = jobs.MB
+
+
+def test_job_over_the_memory_budget_is_rejected(monkeypatch):
+    monkeypatch.setattr(jobs, "MEMORY_BUDGET", 100 * MB)
+    ran = []
+    job = jobs.submit_job("test", ran.append, True, cost=(101 * MB, 1.0))
+    assert job.status == "rejected" and not job.active
+    assert "needs about 101 MB" in job.error and "100 MB limit" in job.error
+    assert not ran
+
+
+def test_full_queue_rejects_new_jobs(monkeypatch):
+    monkeypatch.setattr(jobs, "MAX_QUEUED_JOBS", 0)
+    job = jobs.submit_job("test", lambda: None, cost=(MB, 0.1))
+    assert job.status == "rejected"
+    assert job.error.startswith("The server is busy")
+
+
+def test_job_waits_until_its_memory_fits(monkeypatch):
+    monkeypatch.setattr(jobs, "MEMORY_BUDGET", 100 * MB)
+    release = threading.Event()
+    first = jobs.submit_job("test", release.wait, 10, cost=(70 * MB, 1.0))
+    wait_for(lambda: first.status == "running")
+    assert jobs.job_counts()["reserved_memory"] == 70 * MB
+
+    second = jobs.submit_job("test", lambda: "ran", cost=(50 * MB, 1.0))
+    wait_for(lambda: second.message.startswith("Waiting for memory"))
+    assert second.status == "queued"
+    assert second.message == "Waiting for memory: 50 MB needed, 30 MB free"
+
+    release.set()
+    wait_for(lambda: not second.active)
+    assert (first.status, second.status, second.result) == ("done", "done", "ran")
+    assert jobs.job_counts()["reserved_memory"] == 0
+
+
+def test_job_larger_than_free_memory_runs_when_nothing_else_does(monkeypatch):
+    monkeypatch.setattr(jobs, "MEMORY_BUDGET", 100 * MB)
+    job = jobs.submit_job("test", lambda: "ran", cost=(100 * MB, 1.0))
+    wait_for(lambda: not job.active)
+    assert job.result == "ran"
+
+
+@pytest.mark.skipif(not hasattr(resource, "prlimit"), reason="needs prlimit")
+def test_children_get_memory_and_cpu_limits():
+    script = ("import resource; "
+              "print(resource.getrlimit(resource.RLIMIT_AS)[0], resource.getrlimit(resource.RLIMIT_CPU)[0])")
+    # The limits are applied right after the child starts; give it a moment before reading them
+    result = jobs.run_process([sys.executable, "-c", "import time; time.sleep(0.5); " + script], 30)
+    assert result.returncode == 0
+    assert list(map(int, result.stdout.split())) == [jobs.CHILD_MEMORY_LIMIT, 30]
+
+
+def test_cost_grows_with_size_and_pages():
+    small, large = make_pdf(2), make_pdf(200)
+    small_memory, small_cpu = operations.estimate_cost("compress", small)
+    large_memory, large_cpu = operations.estimate_cost("compress", large)
+    assert large_memory > small_memory and large_cpu > small_cpu
+    # Pages count even when the file sizes are equal
+    padded = small + b"\0" * (len(large) - len(small))
+    assert operations.estimate_cost("compress", padded)[1] < large_cpu
+    # Unreadable inputs count as having no pages
+    assert operations.estimate_cost("compress", b"not a pdf")[1] == pytest.approx(0.5 * 9 / MB)
+
+
+def test_merge_memory_is_capped_by_the_batch_size(monkeypatch):
+    monkeypatch.setattr(operations.pdf_ops, "MERGE_BATCH_BYTES", MB)
+    monkeypatch.setattr(operations.pdf_ops, "OPTIMIZE_MAX_BYTES", MB)
+    one = b"x" * MB
+    memory_two, cpu_two = operations.estimate_cost("merge", [one] * 2)
+    memory_ten, cpu_ten = operations.estimate_cost("merge", [one] * 10)
+    # Only one batch of inputs is held at a time, but CPU time still grows with every input
+    assert memory_ten == memory_two
+    assert cpu_ten == pytest.approx(5 * cpu_two)
+
+
+@pytest.fixture(autouse=True)
+def no_leftover_jobs():
+    yield
+    wait_for(lambda: jobs.job_counts()["running"] == 0 and jobs.job_counts()["queued"] == 0)
@@ -0,0 +1,156 @@
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import fitz
+import pytest
+
+pytest.importorskip("starlette")
+pytest.importorskip("multipart")
+
+import jobs  # noqa: E402
+import pdf_api  # noqa: E402
+import pdf_ops  # noqa: E402
+
+
+def call(method, path, chunks=(), headers=(), disconnect=False):
+    """Sends one request to the ASGI app; returns (status, headers, body).
+
+    The body is sent as `chunks`, without a content-length unless given in
+    `headers`; with `disconnect`, the client goes away after the last chunk.
+    """
+    path, _, query = path.partition("?")
+    messages = [{"type": "http.request", "body": chunk, "more_body": True} for chunk in chunks]
+    if disconnect:
+        messages.append({"type": "http.disconnect"})
+    else:
+        messages.append({"type": "http.request", "body": b"", "more_body": False})
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method, "scheme": "http",
+             "path": path, "raw_path": path.encode(), "query_string": query.encode(), "root_path": "",
+             "headers": [(name.lower().encode(), value.encode()) for name, value in headers],
+             "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 8000)}
+    asyncio.run(pdf_api.app(scope, receive, send))
+    start = next(message for message in sent if message["type"] == "http.response.start")
+    body = b"".join(message.get("body", b"") for message in sent if message["type"] == "http.response.body")
+    return start["status"], dict((k.decode(), v.decode()) for k, v in start["headers"]), body
+
+
+def multipart(files, boundary="pdftoolboundary"):
+    parts = []
+    for name, data in files:
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="files"; filename="{name}"\r\n'
+                     f"Content-Type: application/pdf\r\n\r\n".encode() + data + b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), ("content-type", f"multipart/form-data; boundary={boundary}")
+
+
+@pytest.fixture(autouse=True)
+def api(tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_ops, "SCRATCH_DIR", str(tmp_path))
+    pool = ThreadPoolExecutor(2)
+    monkeypatch.setattr(pdf_api, "_pool", pool)
+    monkeypatch.setattr(pdf_api, "_new_pool", lambda: ThreadPoolExecutor(2))
+    yield tmp_path
+    pool.shutdown()
+    assert not os.listdir(str(tmp_path)), "scratch files left behind"
+    assert jobs.job_counts()["reserved_memory"] == 0
+
+
+def test_rotate(sample_pdf):
+    status, headers, body = call("POST", "/rotate?degrees=180&pages=2", [sample_pdf[:1000], sample_pdf[1000:]])
+    assert status == 200
+    assert headers["content-type"] == "application/pdf"
+    with fitz.open("pdf", body) as doc:
+        assert [page.rotation for page in doc] == [0, 180, 0, 0, 0]
+
+
+def test_merge(sample_pdf):
+    body, content_type = multipart([("a.pdf", sample_pdf), ("b.pdf", sample_pdf)])
+    status, _, output = call("POST", "/merge?bookmarks=1", [body], [content_type])
+    assert status == 200
+    with fitz.open("pdf", output) as doc:
+        assert doc.page_count == 10
+
+
+@pytest.mark.parametrize("path, status", [
+    ("/nope", 404),
+    ("/rotate?degrees=45", 400),
+    ("/extract-pages", 400),
+    ("/convert?filename=a.doc", 400),
+])
+def test_invalid_parameters(sample_pdf, path, status):
+    assert call("POST", path, [sample_pdf])[0] == status
+
+
+def test_empty_body():
+    status, _, body = call("POST", "/compress")
+    assert status == 400
+    assert "Empty request body" in json.loads(body)["error"]
+
+
+def test_failed_operation_is_422():
+    assert call("POST", "/rotate", [b"not a pdf"])[0] == 422
+
+
+def test_upload_limit_without_content_length(sample_pdf, monkeypatch):
+    monkeypatch.setattr(pdf_api, "MAX_UPLOAD_BYTES", 100)
+    assert call("POST", "/rotate", [sample_pdf[:80], sample_pdf[80:160]])[0] == 413
+
+
+def test_merge_upload_limit_without_content_length(sample_pdf, monkeypatch):
+    monkeypatch.setattr(pdf_api, "MAX_UPLOAD_BYTES", 1000)
+    body, content_type = multipart([("a.pdf", sample_pdf)])
+    chunks = [body[i:i + 256] for i in range(0, len(body), 256)]
+    assert call("POST", "/merge", chunks, [content_type])[0] == 413
+
+
+def test_merge_requires_multipart(sample_pdf):
+    assert call("POST", "/merge", [sample_pdf], [("content-type", "application/pdf")])[0] == 400
+
+
+def test_client_disconnect_removes_partial_upload(sample_pdf):
+    assert call("POST", "/rotate", [sample_pdf[:1000]], disconnect=True)[0] == 400
+
+
+def test_merge_client_disconnect_removes_partial_upload(sample_pdf):
+    body, content_type = multipart([("a.pdf", sample_pdf)])
+    assert call("POST", "/merge", [body[:2000]], [content_type], disconnect=True)[0] == 400
+
+
+def test_broken_pool_is_replaced(sample_pdf, monkeypatch):
+    class BrokenPool:
+        def submit(self, *args, **kwargs):
+            raise BrokenProcessPool("worker died")
+
+        def shutdown(self, wait=True, cancel_futures=False):
+            pass
+
+    monkeypatch.setattr(pdf_api, "_pool", BrokenPool())
+    status, headers, _ = call("POST", "/rotate", [sample_pdf])
+    assert status == 503
+    assert headers["retry-after"] == "5"
+    assert not isinstance(pdf_api._pool, BrokenPool)
+    assert call("POST", "/rotate", [sample_pdf])[0] == 200
+    pdf_api._pool.shutdown()
+
+
+def test_too_large_for_memory_budget(sample_pdf, monkeypatch):
+    monkeypatch.setattr(jobs, "MEMORY_BUDGET", 1024)
+    assert call("POST", "/rotate", [sample_pdf])[0] == 413
+
+
+def test_ocr_dpi_is_clamped():
+    assert pdf_api.command_params("ocr", {"dpi": "100000"})["dpi"] == pdf_api.OCR_DPI_RANGE[1]
+    assert pdf_api.command_params("ocr", {"dpi": "1"})["dpi"] == pdf_api.OCR_DPI_RANGE[0]
@@ -0,0 +1,36 @@
+import resource
+
+import benchmark
+import pdf_ops
+from conftest import make_pdf
+
+
+def children_cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def test_run_case_counts_pool_workers(tmp_path):
+    path = tmp_path / "in.pdf"
+    path.write_bytes(make_pdf(4 * pdf_ops.TEXT_PAGES_PER_TASK))
+    cpu_before = children_cpu_seconds()
+
+    measurement = benchmark.run_case("extract-text", [str(path)], {"workers": 2})
+    assert measurement["status"] == "done", measurement.get("error")
+    # The workers were shut down and reaped, so their CPU time is in RUSAGE_CHILDREN
+    assert pdf_ops._process_pool is None
+    assert children_cpu_seconds() > cpu_before
+    assert measurement["cpu_seconds"] >= children_cpu_seconds() - cpu_before
+    assert measurement["peak_rss_mb"] > benchmark._peak_rss_mb()
+
+
+def test_regressions_are_flagged():
+    case = {"command": "compress", "status": "done", "wall_seconds": 1.0, "cpu_seconds": 1.0, "peak_rss_mb": 100,
+            "output_bytes": 100_000}
+    baseline = {"cases": {"compress/a.pdf": case, "split/a.pdf": case}}
+    current = {"cases": {"compress/a.pdf": dict(case, wall_seconds=1.5, output_bytes=100_500),
+                         "split/a.pdf": dict(case, status="failed", error="boom")}}
+
+    _, regressions = benchmark.compare_runs(baseline, current, threshold=0.1)
+    assert {(case_id, metric) for case_id, metric, *_ in regressions} == {
+        ("compress/a.pdf", "wall_seconds"), ("split/a.pdf", "status")}
@@ -0,0 +1,20 @@
+import fitz
+import pytest
+
+import pdf_ops
+
+
+@pytest.fixture
+def outlined_pdf():
+    """Five pages with top-level bookmarks on pages 1 and 3, a child on 4 and one pointing nowhere."""
+    with fitz.open() as doc:
+        for _ in range(5):
+            doc.new_page()
+        doc.set_toc([[1, "Intro", 1], [1, "Body", 3], [2, "Detail", 4], [1, "Dangling", -1]])
+        return doc.tobytes()
+
+
+@pytest.mark.parametrize("backend", ["pymupdf", "pypdf2"])
+def test_bookmarks_skip_unresolved_destinations(outlined_pdf, backend):
+    assert pdf_ops.BACKENDS[backend]["bookmarks"](outlined_pdf) == [("Intro", 1), ("Body", 3)]
+    assert pdf_ops.bookmark_ranges(outlined_pdf, backend) == [(1, 2), (3, 5)]
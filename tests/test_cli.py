@@ -0,0 +1,49 @@
+import json
+
+import fitz
+
+import pdf_cli
+from conftest import make_pdf
+
+
+def run(capsys, *argv):
+    assert pdf_cli.main(list(argv)) == 0
+    return json.loads(capsys.readouterr().out)
+
+
+def test_resume_skips_files_done_with_the_same_options(tmp_path, capsys):
+    (tmp_path / "in").mkdir()
+    for name in ("a", "b"):
+        (tmp_path / "in" / f"{name}.pdf").write_bytes(make_pdf(4))
+    out = str(tmp_path / "out")
+
+    first = run(capsys, "rotate", str(tmp_path / "in"), "-o", out, "--jobs", "1", "--degrees", "90")
+    assert (first["processed"], first["skipped"]) == (2, 0)
+    again = run(capsys, "rotate", str(tmp_path / "in"), "-o", out, "--jobs", "1", "--degrees", "90")
+    assert (again["processed"], again["skipped"]) == (0, 2)
+
+
+def test_resume_reprocesses_files_done_with_other_options(tmp_path, capsys):
+    (tmp_path / "in").mkdir()
+    (tmp_path / "in" / "a.pdf").write_bytes(make_pdf(12))
+    out = tmp_path / "out"
+
+    run(capsys, "extract-pages", str(tmp_path / "in"), "-o", str(out), "--jobs", "1", "--pages", "10-")
+    summary = run(capsys, "extract-pages", str(tmp_path / "in"), "-o", str(out), "--jobs", "1", "--pages", "1-3")
+    assert (summary["processed"], summary["skipped"]) == (1, 0)
+    [output] = summary["results"][0]["outputs"]
+    with fitz.open(output) as doc:
+        assert doc.page_count == 3
+
+    rotated = run(capsys, "rotate", str(tmp_path / "in"), "-o", str(out), "--jobs", "1", "--degrees", "180")
+    assert (rotated["processed"], rotated["skipped"]) == (1, 0)
+
+
+def test_extracted_pages_are_named_like_the_web_interface(tmp_path, capsys):
+    (tmp_path / "in").mkdir()
+    (tmp_path / "in" / "a.pdf").write_bytes(make_pdf(12))
+    out = tmp_path / "out"
+
+    summary = run(capsys, "extract-pages", str(tmp_path / "in"), "-o", str(out), "--jobs", "1", "--pages", "10-, 2")
+    assert summary["results"][0]["outputs"] == [str(out / "a_pages_10-12_2.pdf")]
+    assert (out / "a_pages_10-12_2.pdf").exists()
@@ -0,0 +1,143 @@
+import os
+
+import fitz
+import numpy as np
+
+import operations
+import pdf_ops
+from result_cache import ResultCache
+
+
+def write_pdf(path, pages, text="Page {page_num}", subset=False):
+    """Writes `pages` pages with an embedded font; with `subset`, the font is reduced to the glyphs used."""
+    font = fitz.Font("tiro").buffer
+    with fitz.open() as doc:
+        for page_num in pages:
+            page = doc.new_page()
+            page.insert_font(fontname="F0", fontbuffer=font)
+            page.insert_text((72, 72), text.format(page_num=page_num), fontname="F0")
+        if subset:
+            doc.subset_fonts()
+        doc.save(path, garbage=4, deflate=True)
+    return path
+
+
+def fake_ghostscript(cmd, input_path, output_path, stats=None):
+    """Stands in for gs: copies the page range, subsetting fonts per output like pdfwrite does."""
+    options = dict(arg[2:].split("=", 1) for arg in cmd if arg.startswith("-d") and "=" in arg)
+    with fitz.open(input_path) as source, fitz.open() as output:
+        first = int(options.get("FirstPage", 1))
+        last = int(options.get("LastPage", source.page_count))
+        output.insert_pdf(source, from_page=first - 1, to_page=last - 1)
+        output.subset_fonts()
+        output.save(output_path, garbage=4, deflate=True)
+    return True, None
+
+
+def test_stitch_keeps_document_level_data(tmp_path):
+    source_path = str(tmp_path / "source.pdf")
+    with fitz.open() as doc:
+        for _ in range(4):
+            doc.new_page()
+        doc.set_toc([[1, "One", 1], [2, "One.1", 2], [1, "Two", 3]])
+        doc.set_metadata({"title": "Report", "author": "Someone"})
+        doc.set_page_labels([{"startpage": 0, "prefix": "", "style": "r", "firstpagenum": 1},
+                             {"startpage": 2, "prefix": "", "style": "D", "firstpagenum": 1}])
+        doc.embfile_add("data.csv", b"a,b\n", filename="data.csv", desc="Data")
+        doc.save(source_path)
+    parts = []
+    for first, last in ((0, 1), (2, 3)):
+        with fitz.open(source_path) as doc, fitz.open() as part:
+            part.insert_pdf(doc, from_page=first, to_page=last, links=False, annots=False)
+            parts.append(str(tmp_path / f"part{first}.pdf"))
+            part.save(parts[-1])
+
+    output_path = str(tmp_path / "stitched.pdf")
+    pdf_ops.stitch_pdfs(parts, output_path, source_path)
+    with fitz.open(output_path) as doc:
+        assert doc.page_count == 4
+        assert doc.get_toc() == [[1, "One", 1], [2, "One.1", 2], [1, "Two", 3]]
+        assert doc.metadata["title"] == "Report"
+        assert [page.get_label() for page in doc] == ["i", "ii", "1", "2"]
+        assert doc.embfile_get("data.csv") == b"a,b\n"
+
+
+def test_duplicate_font_bytes(tmp_path):
+    once = write_pdf(str(tmp_path / "once.pdf"), range(1, 4), subset=True)
+    assert pdf_ops.duplicate_font_bytes(once) == 0
+
+    parts = [write_pdf(str(tmp_path / "a.pdf"), [1], "abc", subset=True),
+             write_pdf(str(tmp_path / "b.pdf"), [2], "xyz", subset=True)]
+    stitched = str(tmp_path / "stitched.pdf")
+    pdf_ops.stitch_pdfs(parts, stitched)
+    assert pdf_ops.duplicate_font_bytes(stitched) > 0
+
+
+def write_image_pdf(path, pages):
+    """Writes `pages` pages of text, each with its own incompressible image, so fonts are a small share."""
+    font = fitz.Font("tiro").buffer
+    random = np.random.default_rng(0)
+    with fitz.open() as doc:
+        for page_num in pages:
+            page = doc.new_page()
+            page.insert_font(fontname="F0", fontbuffer=font)
+            page.insert_text((72, 72), f"Page {page_num}", fontname="F0")
+            pixels = random.integers(0, 256, (256, 256, 3), dtype=np.uint8)
+            pixmap = fitz.Pixmap(fitz.csRGB, 256, 256, pixels.tobytes(), False)
+            page.insert_image(fitz.Rect(72, 100, 272, 300), pixmap=pixmap)
+        doc.save(path, garbage=4, deflate=True)
+    return path
+
+
+def compress_sharded(tmp_path, input_path):
+    output_path = str(tmp_path / "out" / "compressed.pdf")
+    os.mkdir(os.path.dirname(output_path))
+    success, error, timings = pdf_ops.compress_pdf_sharded(input_path, output_path, 150, "/ebook", workers=4)
+    assert success, error
+    assert sorted(os.listdir(os.path.dirname(output_path))) == ["compressed.pdf"]
+    return output_path, timings
+
+
+def test_sharded_keeps_stitched_output_when_font_overhead_is_small(tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_ops, "run_subprocess", fake_ghostscript)
+    output_path, timings = compress_sharded(tmp_path, write_image_pdf(str(tmp_path / "in.pdf"), range(1, 33)))
+
+    assert pdf_ops.duplicate_font_bytes(output_path) > 0
+    assert [(t["stage"], t["pages"]) for t in timings] == [
+        ("shard", "1-8"), ("shard", "9-16"), ("shard", "17-24"), ("shard", "25-32")]
+    with fitz.open(output_path) as doc:
+        assert doc.page_count == 32
+
+
+def test_sharded_falls_back_to_single_pass_when_fonts_dominate(tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_ops, "run_subprocess", fake_ghostscript)
+    input_path = write_pdf(str(tmp_path / "in.pdf"), range(1, 33))
+    output_path, timings = compress_sharded(tmp_path, input_path)
+
+    assert [(t["stage"], t["pages"]) for t in timings] == [
+        ("shard", "1-8"), ("shard", "9-16"), ("shard", "17-24"), ("shard", "25-32"), ("single pass", "1-32")]
+    assert timings[-1]["kept"]
+    single_path = str(tmp_path / "single.pdf")
+    fake_ghostscript(pdf_ops.ghostscript_cmd(input_path, single_path, 150, "/ebook"), input_path, single_path)
+    assert os.path.getsize(output_path) == os.path.getsize(single_path)
+
+
+def test_compress_cache_key_includes_sharded(sample_pdf, tmp_path, monkeypatch):
+    def single(input_path, output_path, dpi_value, pdf_setting):
+        with open(output_path, "wb") as f:
+            f.write(b"single")
+        return True, None
+
+    def sharded(input_path, output_path, dpi_value, pdf_setting):
+        with open(output_path, "wb") as f:
+            f.write(b"sharded")
+        return True, None, []
+
+    monkeypatch.setattr(pdf_ops, "compress_pdf", single)
+    monkeypatch.setattr(pdf_ops, "compress_pdf_sharded", sharded)
+    cache = ResultCache(str(tmp_path))
+    single_result = operations.compress(sample_pdf, 150, "/ebook", sharded=False, cache=cache)
+    sharded_result = operations.compress(sample_pdf, 150, "/ebook", sharded=True, cache=cache)
+    assert single_result["path"] != sharded_result["path"]
+    with open(sharded_result["path"], "rb") as f:
+        assert f.read() == b"sharded"
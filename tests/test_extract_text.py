@@ -0,0 +1,47 @@
+import re
+
+import operations
+import pdf_ops
+from conftest import make_pdf
+
+
+PAGES = 3 * pdf_ops.TEXT_PAGES_PER_TASK + 5
+
+
+def read_text(result):
+    if result["data"] is not None:
+        return result["data"].decode("utf-8")
+    with open(result["path"], encoding="utf-8") as f:
+        return f.read()
+
+
+def test_pool_yields_ranges_in_page_order():
+    pdf = make_pdf(PAGES)
+    ranges = list(pdf_ops.iter_extracted_text(pdf, workers=2))
+
+    assert [(first, last) for first, last, _ in ranges] == pdf_ops.chunk_ranges(PAGES, pdf_ops.TEXT_PAGES_PER_TASK)
+    texts = [text for _, _, page_texts in ranges for text in page_texts]
+    assert texts == [pdf_ops.extract_text(pdf, page_num, page_num)[0] for page_num in range(1, PAGES + 1)]
+    assert texts[0].startswith("Page 1 ") and texts[-1].startswith(f"Page {PAGES} ")
+
+
+def test_text_is_reported_as_ranges_finish(monkeypatch):
+    reports = []
+    monkeypatch.setattr(operations, "report_progress",
+                        lambda progress, message=None, preview=None: reports.append((progress, message, preview)))
+    result = operations.extract_text(make_pdf(PAGES), workers=2)
+
+    text = read_text(result["text"])
+    assert re.findall(r"--- Page (\d+) ---", text) == [str(page_num) for page_num in range(1, PAGES + 1)]
+    # One report per range, each with the pages done, the throughput and the newest text
+    assert [progress for progress, _, _ in reports] == [
+        last / PAGES for _, last in pdf_ops.chunk_ranges(PAGES, pdf_ops.TEXT_PAGES_PER_TASK)]
+    assert all(re.fullmatch(r"\d+/\d+ pages · \d+ pages/s", message) for _, message, _ in reports)
+    assert reports[0][2].startswith(f"--- Page {pdf_ops.TEXT_PAGES_PER_TASK} ---")
+    assert re.fullmatch(rf"Extracted {PAGES} pages in [\d.]+s \(\d+ pages/s\)", result["stats"])
+
+
+def test_serial_and_pooled_extraction_match():
+    pdf = make_pdf(PAGES)
+    assert read_text(operations.extract_text(pdf, workers=1)["text"]) == read_text(
+        operations.extract_text(pdf, workers=2)["text"])
@@ -0,0 +1,89 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+import jobs
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+def sleeper(seconds):
+    """A command whose tool name is this Python executable's."""
+    return [sys.executable, "-c", f"import time; print(time.time()); time.sleep({seconds}); print(time.time())"]
+
+
+def test_job_reports_progress_while_it_runs():
+    release = threading.Event()
+
+    def work():
+        jobs.report_progress(0.5, "Halfway", "partial text")
+        release.wait(10)
+        return "result"
+
+    job = jobs.submit_job("test", work)
+    assert jobs.get_job(job.id) is job
+    wait_for(lambda: job.progress == 0.5)
+    assert (job.status, job.message, job.preview) == ("running", "Halfway", "partial text")
+    release.set()
+    wait_for(lambda: not job.active)
+    assert (job.status, job.result, job.progress) == ("done", "result", 1.0)
+
+
+def test_failed_job_keeps_its_error():
+    def work():
+        raise ValueError("broken input")
+
+    job = jobs.submit_job("test", work)
+    wait_for(lambda: not job.active)
+    assert (job.status, job.error) == ("failed", "broken input")
+
+
+def test_cancel_kills_the_child_process():
+    job = jobs.submit_job("test", jobs.run_process, sleeper(30), 60)
+    wait_for(lambda: job._processes)
+    [process] = job._processes
+    start = time.monotonic()
+    jobs.cancel_job(job.id)
+    wait_for(lambda: not job.active)
+    assert job.status == "cancelled"
+    assert process.poll() is not None
+    assert time.monotonic() - start < 5
+
+
+def test_tool_limit_caps_concurrent_children(monkeypatch):
+    tool = os.path.basename(sys.executable)
+    monkeypatch.setitem(jobs._tool_semaphores, tool, threading.BoundedSemaphore(1))
+
+    def work():
+        started, finished = map(float, jobs.run_process(sleeper(0.3), 30).stdout.split())
+        return started, finished
+
+    submitted = [jobs.submit_job("test", work) for _ in range(3)]
+    wait_for(lambda: not any(job.active for job in submitted))
+    intervals = sorted(job.result for job in submitted)
+    assert all(job.status == "done" for job in submitted)
+    assert all(previous[1] <= following[0] for previous, following in zip(intervals, intervals[1:]))
+
+
+def test_cancelled_before_start_never_runs():
+    ran = []
+    job = jobs.Job("test")
+    job.cancel()
+    jobs._run(job, lambda: ran.append(True), (), {})
+    assert job.status == "cancelled"
+    assert not ran
+
+
+@pytest.fixture(autouse=True)
+def no_leftover_jobs():
+    yield
+    wait_for(lambda: jobs.job_counts()["running"] == 0 and jobs.job_counts()["queued"] == 0)
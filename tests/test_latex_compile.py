@@ -0,0 +1,114 @@
+import os
+import subprocess
+
+import pytest
+
+import latex_convert
+
+
+PREAMBLE = "\\documentclass{article}\n\\usepackage{tcolorbox}\n"
+TEX = PREAMBLE + "\\usepackage{iftex}\n\\title{Notebook}\n\\begin{document}\nHello\n\\end{document}\n"
+
+
+class FakeXelatex:
+    """Stands in for run_process: records every xelatex call and writes its outputs.
+
+    `logs` are written to the .log file of successive compile passes; a
+    format is only dumped when `dump_format` is set, and only loads when
+    `load_format` is set.
+    """
+
+    def __init__(self, logs=(), dump_format=True, load_format=True):
+        self.calls = []
+        self.logs = list(logs)
+        self.dump_format = dump_format
+        self.load_format = load_format
+
+    def __call__(self, cmd, timeout, cwd=None, env=None):
+        args = cmd[2:]
+        self.calls.append(args)
+        if "-ini" in args:
+            if self.dump_format:
+                jobname = next(arg for arg in args if arg.startswith("-jobname="))[len("-jobname="):]
+                open(os.path.join(cwd, f"{jobname}.fmt"), "wb").close()
+        else:
+            fmt = next((arg[len("-fmt="):] for arg in args if arg.startswith("-fmt=")), None)
+            if fmt is None or self.load_format and os.path.exists(os.path.join(env["TEXFORMATS"].rstrip(os.pathsep), f"{fmt}.fmt")):
+                stem = os.path.splitext(args[-1])[0]
+                open(os.path.join(cwd, f"{stem}.pdf"), "wb").close()
+                with open(os.path.join(cwd, f"{stem}.log"), "w") as f:
+                    f.write(self.logs.pop(0) if self.logs else "")
+        return subprocess.CompletedProcess(cmd, 0, "", "")
+
+    def passes(self):
+        return [args for args in self.calls if "-ini" not in args]
+
+
+@pytest.fixture
+def tex_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(latex_convert, "FORMAT_DIR", str(tmp_path / "formats"))
+    monkeypatch.setattr(latex_convert, "_format_state", {})
+    work_dir = tmp_path / "work"
+    work_dir.mkdir()
+    path = work_dir / "doc.tex"
+    path.write_text(TEX)
+    return str(path)
+
+
+def test_second_pass_skipped_when_log_is_settled(tex_path, monkeypatch):
+    xelatex = FakeXelatex(logs=["Output written on doc.pdf"])
+    monkeypatch.setattr(latex_convert, "run_process", xelatex)
+    assert latex_convert.compile_latex(tex_path, max_passes=2) == (True, None, "cold")
+    assert len(xelatex.passes()) == 1
+
+
+def test_second_pass_runs_when_log_asks_for_rerun(tex_path, monkeypatch):
+    xelatex = FakeXelatex(logs=["LaTeX Warning: Label(s) may have changed. Rerun to get cross-references right.", ""])
+    monkeypatch.setattr(latex_convert, "run_process", xelatex)
+    assert latex_convert.compile_latex(tex_path, max_passes=2)[0]
+    assert len(xelatex.passes()) == 2
+
+
+def test_passes_are_capped(tex_path, monkeypatch):
+    xelatex = FakeXelatex(logs=["Rerun to get cross-references right."] * 3)
+    monkeypatch.setattr(latex_convert, "run_process", xelatex)
+    assert latex_convert.compile_latex(tex_path, max_passes=2)[0]
+    assert len(xelatex.passes()) == 2
+
+
+def test_format_is_built_once_and_later_compiles_are_warm(tex_path, monkeypatch):
+    xelatex = FakeXelatex()
+    monkeypatch.setattr(latex_convert, "run_process", xelatex)
+    preamble, tex = latex_convert.split_preamble(TEX)
+    assert preamble == PREAMBLE
+    assert tex.index("endofdump") < tex.index("\\usepackage{iftex}")
+
+    stats_before = latex_convert.latex_latency_stats()
+    assert latex_convert.compile_latex(tex_path, preamble=preamble)[2] == "cold"
+    assert latex_convert.compile_latex(tex_path, preamble=preamble)[2] == "warm"
+
+    assert sum("-ini" in args for args in xelatex.calls) == 1
+    assert all(args[0].startswith("-fmt=preamble_") for args in xelatex.passes())
+    stats = latex_convert.latex_latency_stats()
+    assert stats["warm"]["count"] == stats_before["warm"]["count"] + 1
+    assert stats["cold"]["count"] == stats_before["cold"]["count"] + 1
+
+
+def test_compiles_cold_when_the_format_cannot_be_built(tex_path, monkeypatch):
+    xelatex = FakeXelatex(dump_format=False)
+    monkeypatch.setattr(latex_convert, "run_process", xelatex)
+    assert latex_convert.compile_latex(tex_path, preamble=PREAMBLE) == (True, None, "cold")
+    assert xelatex.passes() == [["doc.tex"]]
+
+
+def test_unusable_format_falls_back_to_cold_and_is_not_retried(tex_path, monkeypatch):
+    xelatex = FakeXelatex(load_format=False)
+    monkeypatch.setattr(latex_convert, "run_process", xelatex)
+    assert latex_convert.compile_latex(tex_path, preamble=PREAMBLE) == (True, None, "cold")
+    assert latex_convert.compile_latex(tex_path, preamble=PREAMBLE) == (True, None, "cold")
+    assert [args[0] for args in xelatex.passes()] == [xelatex.passes()[0][0], "doc.tex", "doc.tex"]
+    assert xelatex.passes()[0][0].startswith("-fmt=")
+
+
+def test_document_without_known_preamble_is_not_split():
+    assert latex_convert.split_preamble("\\begin{document}x\\end{document}") == (None, "\\begin{document}x\\end{document}")
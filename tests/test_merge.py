@@ -0,0 +1,91 @@
+from collections import OrderedDict
+
+import fitz
+import pytest
+
+import pdf_ops
+from conftest import make_pdf
+
+
+def image_pdf(image, text):
+    """Returns a one-page PDF showing `image` under a line of `text`."""
+    with fitz.open() as doc:
+        page = doc.new_page()
+        page.insert_text((72, 72), text)
+        page.insert_image(fitz.Rect(72, 100, 272, 300), stream=image)
+        return doc.tobytes()
+
+
+@pytest.fixture
+def image():
+    pixmap = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 64, 64), False)
+    pixmap.set_rect(pixmap.irect, (200, 40, 40))
+    pixmap.set_rect(fitz.IRect(16, 16, 48, 48), (40, 40, 200))
+    return pixmap.tobytes("png")
+
+
+def image_xrefs(doc):
+    return {image[0] for page in doc for image in page.get_images()}
+
+
+def test_repeated_images_are_stored_once(image, tmp_path):
+    sources = [image_pdf(image, "First"), image_pdf(image, "Second"), image_pdf(image, "Third")]
+    stats = {}
+    path = pdf_ops.merge_pdfs(sources, str(tmp_path / "merged.pdf"), stats=stats, backend="pymupdf")
+
+    assert stats["deduplicated_objects"] > 0
+    with fitz.open(path) as doc:
+        assert doc.page_count == 3
+        assert len(image_xrefs(doc)) == 1
+        assert [page.get_text().strip() for page in doc] == ["First", "Second", "Third"]
+        # The shared image still renders on every page
+        assert all(page.get_pixmap(dpi=36).pixel(80, 100) != (255, 255, 255) for page in doc)
+
+
+def test_different_inputs_keep_their_pages(tmp_path):
+    path = pdf_ops.merge_pdfs([make_pdf(2), make_pdf(3)], str(tmp_path / "merged.pdf"), backend="pymupdf")
+    with fitz.open(path) as doc:
+        assert doc.page_count == 5
+        assert len({page.xref for page in doc}) == 5
+        assert doc[2].get_text().startswith("Page 1")
+
+
+def test_dedup_across_batches(image, tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_ops, "MERGE_BATCH_INPUTS", 1)
+    sources = [image_pdf(image, "First"), image_pdf(image, "Second")]
+    stats = {}
+    path = pdf_ops.merge_pdfs(sources, str(tmp_path / "merged.pdf"), stats=stats, backend="pymupdf")
+
+    assert stats["deduplicated_objects"] > 0
+    with fitz.open(path) as doc:
+        assert len(image_xrefs(doc)) == 1
+
+
+def test_identical_annotations_are_not_shared(tmp_path):
+    with fitz.open() as doc:
+        page = doc.new_page()
+        page.insert_text((72, 72), "Annotated")
+        page.add_text_annot((72, 100), "Note")
+        source = doc.tobytes()
+    stats = {}
+    path = pdf_ops.merge_pdfs([source, source], str(tmp_path / "merged.pdf"), stats=stats, backend="pymupdf")
+
+    with fitz.open(path) as doc:
+        annots = [[annot.xref for annot in page.annots()] for page in doc]
+        assert all(len(page_annots) == 1 for page_annots in annots)
+        assert annots[0] != annots[1]
+        assert [annot.parent.number for page in doc for annot in page.annots()] == [0, 1]
+
+
+def test_remembered_resources_are_bounded(image, tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_ops, "MERGE_DEDUP_MAX_OBJECTS", 2)
+    seen = OrderedDict()
+    monkeypatch.setattr(pdf_ops, "OrderedDict", lambda: seen)
+    other = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 8, 8), False).tobytes("png")
+    sources = [image_pdf(image, "First"), image_pdf(other, "Second"), image_pdf(image, "Third")]
+    path = pdf_ops.merge_pdfs(sources, str(tmp_path / "merged.pdf"), backend="pymupdf")
+
+    assert len(seen) <= 2
+    with fitz.open(path) as doc:
+        assert doc.page_count == 3
+        assert [page.get_text().strip() for page in doc] == ["First", "Second", "Third"]
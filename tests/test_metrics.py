@@ -0,0 +1,91 @@
+import re
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import jobs
+import metrics
+
+
+def histogram(name, **labels):
+    """Returns (bucket counts, sum, count) of a histogram series, or None."""
+    with metrics._lock:
+        return metrics._values.get(metrics._key(name, labels))
+
+
+def test_nested_spans_add_up_to_the_operation():
+    with metrics.track_operation("test-spans") as outcome:
+        time.sleep(0.02)
+        with metrics.span("parse"):
+            time.sleep(0.05)
+            with metrics.span("serialize"):
+                time.sleep(0.03)
+        outcome["status"] = "done"
+
+    transform = histogram("pdf_tool_stage_seconds", operation="test-spans", stage="transform")[1]
+    parse = histogram("pdf_tool_stage_seconds", operation="test-spans", stage="parse")[1]
+    serialize = histogram("pdf_tool_stage_seconds", operation="test-spans", stage="serialize")[1]
+    total = histogram("pdf_tool_operation_seconds", operation="test-spans", status="done")[1]
+    assert transform >= 0.02 and parse >= 0.05 and serialize >= 0.03
+    # Each stage only counts its own time, not that of the stages inside it, so they add up to the total
+    assert abs(transform + parse + serialize - total) < 0.01
+
+
+def test_operation_status_and_peak_memory():
+    try:
+        with metrics.track_operation("test-failing"):
+            raise ValueError("broken")
+    except ValueError:
+        pass
+    assert histogram("pdf_tool_operation_seconds", operation="test-failing", status="failed")[2] == 1
+    with metrics._lock:
+        peak = metrics._values[metrics._key("pdf_tool_operation_peak_rss_bytes", {"operation": "test-failing"})]
+    assert peak > 0
+
+
+def test_subprocess_timing_and_exit_codes():
+    tool = sys.executable.rsplit("/", 1)[-1]
+    jobs.run_process([sys.executable, "-c", "import sys; sys.exit(3)"], 30)
+    output = metrics.render_prometheus()
+    assert re.search(rf'pdf_tool_subprocess_exits_total\{{exit_code="3",tool="{re.escape(tool)}"\}} \d+', output)
+    assert re.search(rf'pdf_tool_subprocess_seconds_count\{{tool="{re.escape(tool)}"\}} \d+', output)
+
+
+def test_prometheus_histograms_are_cumulative():
+    metrics.observe("pdf_tool_stage_seconds", {"operation": "test-buckets", "stage": "parse"}, 0.3)
+    metrics.observe("pdf_tool_stage_seconds", {"operation": "test-buckets", "stage": "parse"}, 7)
+    lines = [line for line in metrics.render_prometheus().splitlines() if 'operation="test-buckets"' in line]
+    buckets = {re.search(r'le="([^"]+)"', line)[1]: int(line.split()[-1]) for line in lines if "_bucket" in line}
+    assert (buckets["0.25"], buckets["0.5"], buckets["5"], buckets["10"], buckets["+Inf"]) == (0, 1, 1, 2, 2)
+    assert 'pdf_tool_stage_seconds_count{operation="test-buckets",stage="parse"} 2' in lines
+    assert "# TYPE pdf_tool_stage_seconds histogram" in metrics.render_prometheus()
+
+
+def test_metrics_file_and_endpoint(tmp_path):
+    path = tmp_path / "metrics.prom"
+    metrics.write_metrics_file(str(path))
+    assert "pdf_tool_process_resident_bytes" in path.read_text()
+    assert list(tmp_path.iterdir()) == [path]
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = metrics.start_metrics_server(port)
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            assert b"pdf_tool_process_resident_bytes" in response.read()
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert metrics.start_metrics_server(0) is None
+
+
+def test_debug_panel_summary():
+    with metrics.track_operation("test-summary"):
+        subprocess.run([sys.executable, "-c", "pass"])
+    rows = [row for row in metrics.stage_summary() if row["operation"] == "test-summary"]
+    assert [row["stage"] for row in rows] == ["transform"]
+    assert rows[0]["count"] == 1
@@ -0,0 +1,82 @@
+import json
+import shutil
+
+import pytest
+
+pytest.importorskip("nbconvert")
+
+from latex_convert import _cell_hashes, notebook_to_latex, prepare_notebook  # noqa: E402
+from result_cache import ResultCache  # noqa: E402
+
+needs_pandoc = pytest.mark.skipif(shutil.which("pandoc") is None, reason="nbconvert needs pandoc for markdown cells")
+
+
+def notebook_json(sources, language="python"):
+    cells = [{"cell_type": "code", "id": f"cell{i}", "metadata": {}, "source": source, "outputs": [],
+              "execution_count": None} for i, source in enumerate(sources)]
+    cells.insert(1, {"cell_type": "markdown", "id": "text", "metadata": {}, "source": "Some *text*"})
+    metadata = {"kernelspec": {"name": language, "display_name": language, "language": language},
+                "language_info": {"name": language, "pygments_lexer": language}}
+    return json.dumps({"cells": cells, "metadata": metadata, "nbformat": 4, "nbformat_minor": 5})
+
+
+def render(tmp_path, cache, name, source):
+    stats = {}
+    work_dir = tmp_path / name
+    work_dir.mkdir()
+    tex_path = notebook_to_latex(prepare_notebook(source, "Notebook"), str(work_dir), cache=cache, stats=stats)
+    with open(tex_path, encoding="utf-8") as f:
+        return f.read(), stats
+
+
+@needs_pandoc
+def test_only_changed_cells_are_rendered(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    first, stats = render(tmp_path, cache, "a", notebook_json(["x = 1", "print(x)"]))
+    assert stats == {"cells": 3, "cells_rendered": 3}
+    again, stats = render(tmp_path, cache, "b", notebook_json(["x = 1", "print(x)"]))
+    assert stats == {"cells": 3, "cells_rendered": 0}
+    assert again == first
+    _, stats = render(tmp_path, cache, "c", notebook_json(["x = 2", "print(x)"]))
+    assert stats == {"cells": 3, "cells_rendered": 1}
+
+
+@needs_pandoc
+def test_cached_output_matches_a_full_export(tmp_path):
+    source = notebook_json(["x = 1", "print(x)"])
+    full, _ = render(tmp_path, None, "full", source)
+    cache = ResultCache(str(tmp_path / "cache"))
+    render(tmp_path, cache, "warm", notebook_json(["x = 1", "y = 2"]))
+    cached, stats = render(tmp_path, cache, "cached", source)
+    assert stats["cells_rendered"] == 1
+    # Template indentation on blank lines between cells depends on the neighbouring cell
+    assert [line.rstrip() for line in cached.splitlines()] == [line.rstrip() for line in full.splitlines()]
+
+
+@needs_pandoc
+def test_language_change_renders_cells_again(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    render(tmp_path, cache, "python", notebook_json(["x = 1"], "python"))
+    _, stats = render(tmp_path, cache, "ruby", notebook_json(["x = 1"], "ruby"))
+    assert stats == {"cells": 2, "cells_rendered": 2}
+
+
+def test_cell_hashes_cover_language_and_kernel():
+    hashes = _cell_hashes(prepare_notebook(notebook_json(["x = 1", "print(x)"]), "Notebook"))
+    assert len(set(hashes)) == 3
+    assert _cell_hashes(prepare_notebook(notebook_json(["x = 1", "print(x)"]), "Other title")) == hashes
+
+    other_language = _cell_hashes(prepare_notebook(notebook_json(["x = 1", "print(x)"], language="julia"), "Notebook"))
+    assert not set(other_language) & set(hashes)
+
+    notebook = prepare_notebook(notebook_json(["x = 1", "print(x)"]), "Notebook")
+    notebook.metadata["kernelspec"]["display_name"] = "Python (venv)"
+    assert not set(_cell_hashes(notebook)) & set(hashes)
+
+
+def test_cell_ids_do_not_change_hashes():
+    notebook = prepare_notebook(notebook_json(["x = 1", "print(x)"]), "Notebook")
+    hashes = _cell_hashes(notebook)
+    for cell in notebook.cells:
+        cell["id"] = cell["id"] + "-renamed"
+    assert _cell_hashes(notebook) == hashes
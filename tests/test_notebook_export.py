@@ -0,0 +1,61 @@
+import base64
+import json
+import subprocess
+import threading
+
+import fitz
+import pytest
+
+pytest.importorskip("nbconvert")
+
+import latex_convert  # noqa: E402
+
+
+def png_bytes():
+    pixmap = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 4, 4), False)
+    pixmap.clear_with(200)
+    return pixmap.tobytes("png")
+
+
+def code_notebook():
+    output = {"output_type": "display_data", "metadata": {},
+              "data": {"image/png": base64.b64encode(png_bytes()).decode("ascii"), "text/plain": "<Figure>"}}
+    cells = [{"cell_type": "code", "id": "plot", "metadata": {}, "source": "plot()", "outputs": [output],
+              "execution_count": 1}]
+    return json.dumps({"cells": cells, "metadata": {}, "nbformat": 4, "nbformat_minor": 5})
+
+
+def test_exporter_is_created_once_per_process():
+    exporters = []
+    threads = [threading.Thread(target=lambda: exporters.append(latex_convert.get_latex_exporter())) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(exporter) for exporter in exporters}) == 1
+    assert latex_convert.get_latex_exporter() is exporters[0]
+
+
+def test_markdown_rules_become_html_rules():
+    source = json.dumps({"cells": [{"cell_type": "markdown", "id": "m", "metadata": {},
+                                    "source": "Intro\n---\nText\n - item --- dash\n  ---  \n"}],
+                         "metadata": {}, "nbformat": 4, "nbformat_minor": 5})
+    notebook = latex_convert.prepare_notebook(source, "Report")
+    assert notebook.metadata["title"] == "Report"
+    assert notebook.cells[0].source == "Intro\n<hr>\nText\n - item --- dash\n<hr>\n"
+
+
+def test_notebook_is_exported_in_process(tmp_path, monkeypatch):
+    def no_subprocess(*args, **kwargs):
+        raise AssertionError("notebook export started a process")
+
+    monkeypatch.setattr(subprocess, "Popen", no_subprocess)
+    notebook = latex_convert.prepare_notebook(code_notebook(), "Plots")
+    tex_path = latex_convert.notebook_to_latex(notebook, str(tmp_path), output_name="plots")
+
+    assert tex_path == str(tmp_path / "plots.tex")
+    tex = (tmp_path / "plots.tex").read_text(encoding="utf-8")
+    assert "\\title{Plots}" in tex
+    figures = list((tmp_path / "plots_files").iterdir())
+    assert len(figures) == 1 and figures[0].name in tex
+    assert figures[0].read_bytes() == png_bytes()
@@ -0,0 +1,135 @@
+import os
+import stat
+import sys
+
+import fitz
+import pytest
+
+import operations
+import pdf_ops
+
+FAKE_TESSERACT = """#!{python}
+import os
+import struct
+import sys
+
+image_path, dpi = sys.argv[1], int(sys.argv[sys.argv.index("--dpi") + 1])
+with open(image_path, "rb") as f:
+    width, height = struct.unpack(">II", f.read(24)[16:24])
+with open(os.environ["FAKE_TESSERACT_LOG"], "a") as log:
+    log.write(f"{{width}} {{height}} {{dpi}}\\n")
+print("level\\tpage_num\\tblock_num\\tpar_num\\tline_num\\tword_num\\tleft\\ttop\\twidth\\theight\\tconf\\ttext")
+print(f"1\\t1\\t0\\t0\\t0\\t0\\t0\\t0\\t{{width}}\\t{{height}}\\t-1\\t")
+print(f"5\\t1\\t1\\t1\\t1\\t1\\t{{dpi}}\\t{{dpi}}\\t{{2 * dpi}}\\t{{dpi // 4}}\\t95\\tScanned")
+"""
+
+
+@pytest.fixture
+def tesseract(tmp_path, monkeypatch):
+    """Puts a stand-in tesseract on PATH; returns a function listing its runs as (width, height, dpi)."""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    script = bin_dir / "tesseract"
+    script.write_text(FAKE_TESSERACT.format(python=sys.executable))
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    log = tmp_path / "tesseract.log"
+    log.touch()
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("FAKE_TESSERACT_LOG", str(log))
+    return lambda: [tuple(map(int, line.split())) for line in log.read_text().splitlines()]
+
+
+class DictCache:
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, data):
+        self.entries[key] = data
+
+
+def scanned_pdf():
+    """Returns a 3-page PDF whose middle page has a drawing but no text layer."""
+    with fitz.open() as doc:
+        for page_num in range(1, 4):
+            page = doc.new_page()
+            if page_num == 2:
+                page.draw_rect(fitz.Rect(72, 72, 300, 120), fill=(0, 0, 0))
+            else:
+                page.insert_text((72, 72), f"Page {page_num}")
+        return doc.tobytes()
+
+
+def output_bytes(result):
+    if result["data"] is not None:
+        return result["data"]
+    with open(result["path"], "rb") as f:
+        return f.read()
+
+
+def test_only_pages_without_text_are_ocred_at_the_configured_dpi(tesseract):
+    result = operations.extract_text(scanned_pdf(), workers=1, ocr=True, ocr_dpi=100)
+
+    # A4 page rendered at 100 dpi
+    assert tesseract() == [(827, 1170, 100)]
+    text = output_bytes(result["text"]).decode("utf-8")
+    assert "--- Page 1 ---\nPage 1" in text and "--- Page 2 ---\nScanned" in text and "--- Page 3 ---\nPage 3" in text
+    assert result["stats"].endswith(", 1 of them by OCR")
+
+
+def test_searchable_pdf_has_an_invisible_text_layer(tesseract):
+    pdf = scanned_pdf()
+    result = operations.extract_text(pdf, workers=1, ocr=True, ocr_dpi=100)
+
+    searchable = output_bytes(result["searchable"])
+    # The text layer is an incremental update; the original file is kept unchanged in front of it
+    assert searchable.startswith(pdf)
+    with fitz.open(stream=searchable, filetype="pdf") as doc:
+        assert doc[0].get_text().strip() == "Page 1"
+        [rect] = doc[1].search_for("Scanned")
+        # Word boxes are scaled from rendered pixels back to points
+        assert abs(rect.x0 - 72) < 1 and rect.x1 <= 72 + 144 and abs(rect.y0 - 72) < 2
+        assert {span["type"] for span in doc[1].get_texttrace()} == {3}
+
+
+def test_pages_are_cached_by_their_rendered_image(tesseract):
+    with fitz.open() as doc:
+        for _ in range(2):
+            doc.new_page().draw_rect(fitz.Rect(72, 72, 300, 120), fill=(0, 0, 0))
+        blank_twice = doc.tobytes()
+    cache = DictCache()
+
+    first = list(pdf_ops.ocr_pages(blank_twice, [1], dpi=50, cache=cache))
+    assert len(tesseract()) == 1 and len(cache.entries) == 1
+    # Page 2 renders to the same image as page 1, so neither is read again
+    again = list(pdf_ops.ocr_pages(blank_twice, [1, 2], dpi=50, cache=cache))
+    assert len(tesseract()) == 1
+    assert again == [(1, first[0][1]), (2, first[0][1])]
+    # A different dpi renders a different image
+    list(pdf_ops.ocr_pages(blank_twice, [1], dpi=60, cache=cache))
+    assert len(tesseract()) == 2
+
+
+def test_tsv_words_become_lines_and_blocks():
+    tsv = "\n".join([
+        "level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext",
+        "4\t1\t1\t1\t1\t0\t0\t0\t100\t10\t-1\t",
+        "5\t1\t1\t1\t1\t1\t0\t0\t40\t10\t96\tHello",
+        "5\t1\t1\t1\t1\t2\t50\t0\t40\t10\t96\tworld",
+        "5\t1\t1\t1\t2\t1\t0\t20\t40\t10\t96\tagain",
+        "5\t1\t2\t1\t1\t1\t0\t60\t40\t10\t96\tNext",
+        "5\t1\t2\t1\t1\t2\t50\t60\t40\t10\t96\t ",
+    ])
+    words = pdf_ops.parse_tesseract_tsv(tsv)
+    assert words[0] == (1, 1, 1, 0, 0, 40, 10, "Hello")
+    assert pdf_ops.ocr_text(words) == "Hello world\nagain\n\nNext"
+
+
+def test_bad_language_and_missing_tesseract(monkeypatch):
+    with pytest.raises(ValueError, match="Invalid OCR language"):
+        list(pdf_ops.ocr_pages(scanned_pdf(), [2], language="eng; rm -rf /"))
+    monkeypatch.setenv("PATH", "")
+    with pytest.raises(RuntimeError, match="not found: tesseract"):
+        list(pdf_ops.ocr_pages(scanned_pdf(), [2], dpi=50))
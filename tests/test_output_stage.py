@@ -0,0 +1,64 @@
+import os
+
+import fitz
+import pytest
+
+import operations
+import pdf_ops
+
+
+def pdf_bytes(result):
+    if result["data"] is not None:
+        return result["data"]
+    with open(result["path"], "rb") as f:
+        return f.read()
+
+
+@pytest.fixture(params=["pymupdf", "pypdf2"])
+def backend(request, monkeypatch):
+    monkeypatch.setattr(pdf_ops, "DEFAULT_BACKEND", request.param)
+    return request.param
+
+
+def test_optimize_pdf_report(backend, sample_pdf, tmp_path):
+    path = pdf_ops.extract_pages(sample_pdf, [1, 2, 3], str(tmp_path / "out.pdf"), backend=backend)
+    size = os.path.getsize(path)
+    report = pdf_ops.optimize_pdf(path, linearize=False)
+    assert report["bytes_before"] == size
+    assert report["bytes_after"] == os.path.getsize(path) <= size
+    assert report["bytes_saved"] == size - report["bytes_after"]
+    assert not report["linearized"]
+    with fitz.open(path) as doc:
+        assert doc.page_count == 3
+
+
+def test_optimize_pdf_linearize_reports_errors(sample_pdf, tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_ops, "_linearize", lambda path: "qpdf is not installed")
+    path = tmp_path / "in.pdf"
+    path.write_bytes(sample_pdf)
+    report = pdf_ops.optimize_pdf(str(path), linearize=True)
+    assert not report["linearized"]
+    assert report["linearize_error"] == "qpdf is not installed"
+
+
+def test_rotate_through_output_stage(backend, sample_pdf):
+    result = operations.rotate(sample_pdf, 90, pages=[1, 3], optimize=True)
+    assert result["output_report"]["bytes_after"] > 0
+    with fitz.open("pdf", pdf_bytes(result)) as doc:
+        assert [page.rotation for page in doc] == [90, 0, 90, 0, 0]
+
+
+def test_extract_pages_through_output_stage(backend, sample_pdf):
+    fitz.TOOLS.mupdf_warnings()
+    result = operations.extract_pages(sample_pdf, [3, 1, 1])
+    with fitz.open("pdf", pdf_bytes(result)) as doc:
+        assert doc.page_count == 3
+        assert doc[0].get_text().startswith("Page 3")
+    assert not fitz.TOOLS.mupdf_warnings()
+
+
+def test_merge_through_output_stage(backend, sample_pdf):
+    result = operations.merge([sample_pdf, sample_pdf], titles=["a", "b"])
+    with fitz.open("pdf", pdf_bytes(result)) as doc:
+        assert doc.page_count == 10
+        assert [entry[1:] for entry in doc.get_toc() if entry[0] == 1][:2] == [["a", 1], ["b", 6]]
@@ -0,0 +1,56 @@
+import pytest
+
+import pdf_ops
+
+
+@pytest.mark.parametrize("spec, pages", [
+    ("1-3,7", [1, 2, 3, 7]),
+    (" 2 , 4-5 ", [2, 4, 5]),
+    ("8-", [8, 9, 10]),
+    ("odd", [1, 3, 5, 7, 9]),
+    ("EVEN", [2, 4, 6, 8, 10]),
+    ("3,1,1", [3, 1, 1]),
+    ("5,,6", [5, 6]),
+])
+def test_parse_page_list(spec, pages):
+    assert pdf_ops.parse_page_list(spec, 10) == pages
+
+
+@pytest.mark.parametrize("spec, message", [
+    ("", "No pages selected"),
+    ("a-3", "Invalid page range"),
+    ("5-2", "Invalid page range"),
+    ("0", "outside 1-10"),
+    ("9-11", "outside 1-10"),
+])
+def test_parse_page_list_errors(spec, message):
+    with pytest.raises(ValueError, match=message):
+        pdf_ops.parse_page_list(spec, 10)
+
+
+def test_format_page_list_round_trips():
+    pages = [1, 2, 3, 7, 9, 10]
+    assert pdf_ops.page_runs(pages) == [(1, 3), (7, 7), (9, 10)]
+    assert pdf_ops.format_page_list(pages) == "1-3,7,9-10"
+    assert pdf_ops.parse_page_list(pdf_ops.format_page_list(pages), 10) == pages
+
+
+def test_page_selection_label_stays_short():
+    assert pdf_ops.page_selection_label([1, 2, 3, 7]) == "1-3_7"
+    odd_pages = pdf_ops.parse_page_list("odd", 2000)
+    assert pdf_ops.page_selection_label(odd_pages) == "1000_pages"
+
+
+def test_document_index(sample_pdf):
+    index = pdf_ops.DocumentIndex(sample_pdf, backend="pymupdf")
+    assert index.page_count == 5
+    assert index.thumbnail(1).startswith(b"\x89PNG")
+    index.close()
+    assert not index.has_thumbnails
+
+
+def test_document_index_pypdf2(sample_pdf):
+    index = pdf_ops.DocumentIndex(sample_pdf, backend="pypdf2")
+    assert index.page_count == 5
+    assert not index.has_thumbnails
+    index.close()
@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+
+from result_cache import ResultCache, make_cache_key
+
+
+def test_make_cache_key_depends_on_inputs_and_params():
+    key = make_cache_key("compress", [b"a"], level=1)
+    assert key == make_cache_key("compress", [b"a"], level=1)
+    assert key != make_cache_key("compress", [b"b"], level=1)
+    assert key != make_cache_key("compress", [b"a"], level=2)
+    assert key != make_cache_key("split", [b"a"], level=1)
+
+
+def test_put_and_get(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=1024)
+    assert cache.get("k") is None
+    cache.put("k", b"data")
+    assert cache.get("k") == b"data"
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_put_file_moves_into_cache(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=1024)
+    src = tmp_path / "out.pdf"
+    src.write_bytes(b"pdf")
+    path = cache.put_file("k", str(src))
+    assert not src.exists()
+    assert path == cache.get_path("k")
+    with open(path, "rb") as f:
+        assert f.read() == b"pdf"
+
+
+def test_put_file_over_budget_is_left_in_place(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=2)
+    src = tmp_path / "out.pdf"
+    src.write_bytes(b"too large")
+    assert cache.put_file("k", str(src)) is None
+    assert src.read_bytes() == b"too large"
+
+
+def test_lru_eviction_by_size(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=10)
+    cache.put("a", b"1234")
+    cache.put("b", b"1234")
+    cache.get("a")
+    cache.put("c", b"1234")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"1234"
+    assert cache.get("c") == b"1234"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_expiry(tmp_path):
+    cache = ResultCache(str(tmp_path), ttl_seconds=0)
+    cache.put("k", b"data")
+    time.sleep(0.01)
+    assert cache.get("k") is None
+    assert not os.path.exists(os.path.join(str(tmp_path), "k"))
+
+
+def test_index_is_reloaded_from_disk(tmp_path):
+    ResultCache(str(tmp_path)).put("k", b"data")
+    assert ResultCache(str(tmp_path)).get("k") == b"data"
+
+
+def test_concurrent_puts_of_the_same_key(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    errors = []
+
+    def writer(thread_num):
+        try:
+            for i in range(100):
+                src = tmp_path / f"{thread_num}_{i}.pdf"
+                src.write_bytes(b"same result")
+                cache.put_file("k", str(src))
+                cache.put("k", b"same result")
+        except Exception as e:  # noqa: BLE001 - collected and asserted below
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert cache.get("k") == b"same result"
+    assert not [name for name in os.listdir(cache.cache_dir) if name.endswith(".tmp")]
+
+
+def test_failed_replace_is_a_miss(tmp_path, monkeypatch):
+    cache = ResultCache(str(tmp_path / "cache"))
+    src = tmp_path / "out.pdf"
+    src.write_bytes(b"pdf")
+
+    def failing_replace(src_path, dst_path):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "replace", failing_replace)
+    assert cache.put_file("k", str(src)) is None
+    assert src.read_bytes() == b"pdf"
+    cache.put("k", b"data")
+    monkeypatch.undo()
+    assert cache.get("k") is None
+    assert not [name for name in os.listdir(cache.cache_dir) if name.endswith(".tmp")]
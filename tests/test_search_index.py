@@ -0,0 +1,72 @@
+import threading
+
+import pytest
+
+import search_index
+from search_index import SearchIndex, document_hash
+
+
+@pytest.fixture
+def index(tmp_path):
+    return SearchIndex(str(tmp_path / "index.sqlite3"))
+
+
+def test_add_and_search(index):
+    assert index.add_document("h1", "report.pdf", [(1, "quarterly invoice summary"), (2, ""), (3, "late payment notice")])
+    assert not index.add_document("h1", "report.pdf", [(1, "ignored")])
+    assert [match["page"] for match in index.search("invoice")] == [1]
+    assert [match["page"] for match in index.search('"late payment"')] == [3]
+    assert index.search("missing") == []
+    assert index.stats()["documents"] == 1
+    assert index.stats()["pages"] == 3
+
+
+def test_invalid_fts_syntax_falls_back_to_words(index):
+    index.add_document("h1", "a.pdf", [(1, "note: pay the invoice")])
+    assert [match["page"] for match in index.search("note: invoice")] == [1]
+    assert index.search('"unbalanced') == []
+
+
+def test_batches_and_interrupted_documents(index, monkeypatch):
+    monkeypatch.setattr(search_index, "BATCH_PAGES", 2)
+
+    def failing_pages():
+        yield 1, "first page"
+        yield 2, "second page"
+        yield 3, "third page"
+        raise RuntimeError("extraction failed")
+
+    with pytest.raises(RuntimeError):
+        index.add_document("h1", "a.pdf", failing_pages())
+    assert not index.has_document("h1")
+    assert index.search("first") == []
+    assert index.add_document("h1", "a.pdf", [(1, "first page"), (2, "second page"), (3, "third page")])
+    assert len(index.search("page")) == 3
+
+
+def test_search_is_not_blocked_while_indexing(index, monkeypatch):
+    monkeypatch.setattr(search_index, "BATCH_PAGES", 2)
+    index.add_document("h0", "old.pdf", [(1, "archived invoice")])
+    first_batch_written = threading.Event()
+    searched = threading.Event()
+
+    def slow_pages():
+        for page_num in range(1, 5):
+            if page_num == 3:
+                first_batch_written.set()
+                assert searched.wait(5), "search blocked by indexing"
+            yield page_num, f"page {page_num} invoice"
+
+    writer = threading.Thread(target=index.add_document, args=("h1", "new.pdf", slow_pages()))
+    writer.start()
+    assert first_batch_written.wait(5)
+    assert index.search("archived")[0]["name"] == "old.pdf"
+    assert not index.add_document("h1", "new.pdf", [])  # Already being indexed by the writer
+    searched.set()
+    writer.join()
+    assert index.has_document("h1")
+    assert len(index.search("invoice")) == 5
+
+
+def test_document_hash():
+    assert document_hash(b"pdf") == document_hash(b"pdf") != document_hash(b"other")
@@ -0,0 +1,60 @@
+import io
+import zipfile
+
+import fitz
+import pytest
+
+import operations
+import pdf_ops
+from conftest import make_pdf
+from result_cache import ResultCache
+
+
+@pytest.fixture(params=["pymupdf", "pypdf2"])
+def backend(request):
+    return request.param
+
+
+def zip_page_counts(zip_source):
+    with zipfile.ZipFile(zip_source) as zf:
+        counts = {}
+        for name in zf.namelist():
+            with fitz.open(stream=zf.read(name), filetype="pdf") as doc:
+                counts[name] = doc.page_count
+        return counts
+
+
+def test_chunk_ranges():
+    assert pdf_ops.chunk_ranges(5) == [(1, 1), (2, 2), (3, 3), (4, 4), (5, 5)]
+    assert pdf_ops.chunk_ranges(7, 3) == [(1, 3), (4, 6), (7, 7)]
+    assert pdf_ops.chunk_ranges(2, 10) == [(1, 2)]
+
+
+def test_bookmark_ranges(backend):
+    with_intro = make_pdf(6, toc=[[1, "One", 2], [2, "One.1", 3], [1, "Two", 5]])
+    assert pdf_ops.bookmark_ranges(with_intro, backend) == [(1, 1), (2, 4), (5, 6)]
+    assert pdf_ops.bookmark_ranges(make_pdf(3), backend) == [(1, 3)]
+
+
+def test_split_is_written_range_by_range(backend, sample_pdf):
+    parts = pdf_ops.split_pdf(sample_pdf, [(1, 2), (3, 5)], backend)
+    # A generator: each range is serialized only when the ZIP writer asks for it
+    assert next(parts)[:2] == (1, 2)
+
+    buffer = io.BytesIO()
+    assert pdf_ops.split_pdf_to_zip(sample_pdf, buffer, [(1, 1), (2, 3), (4, 5)], backend) == 3
+    assert zip_page_counts(buffer) == {"page_1.pdf": 1, "pages_2-3.pdf": 2, "pages_4-5.pdf": 2}
+
+
+def test_split_operation_modes(sample_pdf, tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    pages = operations.split(sample_pdf, "Single pages", cache=cache)
+    assert pages["total_files"] == 5
+    chunks = operations.split(sample_pdf, "Chunks of N pages", 2, cache=cache)
+    assert zip_page_counts(chunks["path"]) == {"pages_1-2.pdf": 2, "pages_3-4.pdf": 2, "page_5.pdf": 1}
+    sections = operations.split(sample_pdf, "Bookmark sections", cache=cache)
+    assert zip_page_counts(sections["path"]) == {"pages_1-2.pdf": 2, "pages_3-5.pdf": 3}
+
+    again = operations.split(sample_pdf, "Chunks of N pages", 2, cache=cache)
+    assert again["path"] == chunks["path"]
+    assert cache.hits == 1
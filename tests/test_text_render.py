@@ -0,0 +1,47 @@
+import fitz
+
+import text_render
+
+
+def render(tmp_path, lines, **kwargs):
+    path = str(tmp_path / "out.pdf")
+    page_total = text_render.render_text_pdf(lines, path, **kwargs)
+    return path, page_total
+
+
+def test_wrap_lines():
+    lines = ["short\n", "word " * 30 + "\r\n", "\tindented\n", " " * 50 + "\n"]
+    assert list(text_render.wrap_lines(lines, 40)) == [
+        "short", "word word word word word word word word", "word word word word word word word word",
+        "word word word word word word word word", "word word word word word word", "        indented", ""]
+
+
+def test_pages_hold_one_text_object_each(tmp_path):
+    path, page_total = render(tmp_path, (f"line {i}\n" for i in range(130)))
+    with fitz.open(path) as doc:
+        assert page_total == doc.page_count == 3
+        # All of a page's lines are placed by a single text matrix, not one draw call per line
+        assert [page.read_contents().count(b" Tm ") for page in doc] == [1, 1, 1]
+        lines = [line for page in doc for line in page.get_text().splitlines()]
+    assert lines == [f"line {i}" for i in range(130)]
+
+
+def test_long_lines_are_wrapped_not_truncated(tmp_path):
+    long_line = " ".join(f"w{i}" for i in range(600))
+    path, _ = render(tmp_path, [long_line])
+    with fitz.open(path) as doc:
+        text = " ".join(word for page in doc for word in page.get_text().split())
+    assert text == long_line
+
+
+def test_special_characters_are_escaped(tmp_path):
+    path, _ = render(tmp_path, ["(paren) back\\slash café 100€\n"])
+    with fitz.open(path) as doc:
+        assert doc[0].get_text().strip() == "(paren) back\\slash café 100€"
+
+
+def test_empty_input_gives_one_blank_page(tmp_path):
+    path, page_total = render(tmp_path, [])
+    with fitz.open(path) as doc:
+        assert page_total == doc.page_count == 1
+        assert doc[0].get_text() == ""
@@ -0,0 +1,240 @@
+import textwrap
+import threading
+
+from reportlab import rl_config
+from reportlab.lib.pagesizes import A4, letter
+from reportlab.lib.units import inch
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas
+
+from metrics import span
+
+
+FONT_NAME = "Courier"
+FONT_SIZE = 10
+LEADING = 12
+MARGIN = 0.75 * inch
+
+# Page streams are already Flate-compressed; the extra ASCII85 pass reportlab
+# adds by default is pure Python and makes the output a quarter larger
+rl_config.useA85 = 0
+
+
+# Standard PDF fonts use WinAnsi (cp1252); delimiters and anything outside
+# printable ASCII are written as escapes so the content stream stays ASCII
+_PDF_ESCAPES = {i: f"\\{i:03o}" for i in list(range(32)) + list(range(127, 256))}
+_PDF_ESCAPES.update({ord("\\"): "\\\\", ord("("): "\\(", ord(")"): "\\)"})
+
+
+def pdf_escape(line):
+    """Escapes a line for a PDF string literal in a standard font."""
+    return line.encode("cp1252", "replace").decode("latin-1").translate(_PDF_ESCAPES)
+
+
+def wrap_lines(lines, max_chars):
+    """Yields display lines, wrapping anything wider than `max_chars` columns.
+
+    The font is fixed-width, so a line's width is its length: lines that fit
+    (the vast majority) skip textwrap entirely.
+    """
+    wrapper = textwrap.TextWrapper(width=max_chars)
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if "\t" in line:
+            line = line.expandtabs()
+        if len(line) <= max_chars:
+            yield line
+        elif line.strip():
+            yield from wrapper.wrap(line)
+        else:
+            yield ""
+
+
+def render_text_pdf(lines, output_path, pagesize=letter, font_name=FONT_NAME,
+                    font_size=FONT_SIZE, leading=LEADING, margin=MARGIN):
+    """Lays out an iterable of text lines (e.g. an open file) as a PDF.
+
+    Lines are consumed as a stream and each page is drawn as a single text
+    object, so memory stays bounded by one page of text plus the compressed
+    page streams.
+    """
+    width, height = pagesize
+    # Every glyph of a fixed-width font has the same advance, so measure once
+    char_width = stringWidth("A", font_name, font_size)
+    max_chars = max(1, int((width - 2 * margin) / char_width))
+    lines_per_page = max(1, int((height - 2 * margin) / leading) + 1)
+
+    c = canvas.Canvas(output_path, pagesize=pagesize, pageCompression=1)
+    page_lines = []
+    page_total = 0
+
+    def emit_page():
+        # setFont registers the font on the page; the lines are then written as
+        # one pre-escaped text block instead of one reportlab call per line
+        c.setFont(font_name, font_size, leading)
+        font_ref = c._doc.getInternalFontName(font_name)
+        body = " T* ".join(f"({pdf_escape(page_line)}) Tj" for page_line in page_lines)
+        c.addLiteral(f"BT {font_ref} {font_size} Tf {leading} TL 1 0 0 1 {margin} {height - margin} Tm {body} ET")
+        c.showPage()
+
+    for line in wrap_lines(lines, max_chars):
+        page_lines.append(line)
+        if len(page_lines) == lines_per_page:
+            emit_page()
+            page_total += 1
+            page_lines = []
+    if page_lines or page_total == 0:
+        emit_page()
+        page_total += 1
+    with span("serialize"):
+        c.save()
+    return page_total
+
+
+# --- Source code ---
+# Syntax-highlighted rendering for .py files: Pygments tokenizes in-process
+# and the pages are laid out like plain text above, with one text object
+# per page that switches font and color between tokens. Page size and
+# margins match the former minted template.
+
+CODE_PAGESIZE = A4
+CODE_FONT_SIZE = 9.5
+CODE_LEADING = 11.5
+CODE_MARGINS = (0.6 * inch, 0.68 * inch, 0.5 * inch, 0.68 * inch)  # top, right, bottom, left
+CODE_STYLE = "default"
+LINE_NUMBER_GRAY = 0.55
+
+# (bold, italic) -> font; all Courier variants have the same advance width
+_CODE_FONTS = {
+    (False, False): "Courier",
+    (True, False): "Courier-Bold",
+    (False, True): "Courier-Oblique",
+    (True, True): "Courier-BoldOblique",
+}
+
+_lexers = {}
+_token_formats = {}
+_pygments_lock = threading.Lock()
+
+
+def get_lexer(language):
+    """Returns the shared Pygments lexer for `language`, creating it on first use."""
+    with _pygments_lock:
+        if language not in _lexers:
+            from pygments.lexers import get_lexer_by_name
+            _lexers[language] = get_lexer_by_name(language, stripnl=False, ensurenl=True)
+        return _lexers[language]
+
+
+def token_format(style_name, token_type):
+    """Returns the (bold, italic, fill color operator) of a token type in a Pygments style, cached."""
+    key = (style_name, token_type)
+    token_fmt = _token_formats.get(key)
+    if token_fmt is None:
+        from pygments.styles import get_style_by_name
+        style = get_style_by_name(style_name).style_for_token(token_type)
+        color = style["color"] or "000000"
+        rgb = " ".join(f"{int(color[i:i + 2], 16) / 255:.3g}" for i in (0, 2, 4))
+        token_fmt = _token_formats[key] = (style["bold"], style["italic"], f"{rgb} rg")
+    return token_fmt
+
+
+def highlighted_lines(source, language="python", style_name=CODE_STYLE):
+    """Yields each source line as a list of (bold, italic, color operator, text) runs.
+
+    Adjacent tokens with the same format, and whitespace, which looks the
+    same in any format, are merged into one run.
+    """
+    line = []
+    for token_type, value in get_lexer(language).get_tokens(source):
+        token_fmt = token_format(style_name, token_type)
+        parts = value.split("\n")
+        for i, part in enumerate(parts):
+            if i:
+                yield line
+                line = []
+            if not part:
+                continue
+            if "\t" in part:
+                part = part.expandtabs()
+            if line and (line[-1][:3] == token_fmt or part.isspace()):
+                line[-1] = (*line[-1][:3], line[-1][3] + part)
+            else:
+                line.append((*token_fmt, part))
+    if line:
+        yield line
+
+
+def _wrap_runs(runs, max_chars):
+    """Splits a line's runs into display lines of at most `max_chars` characters, breaking anywhere."""
+    display_line, width = [], 0
+    for bold, italic, color, text in runs:
+        while width + len(text) > max_chars:
+            cut = max_chars - width
+            if cut:
+                display_line.append((bold, italic, color, text[:cut]))
+            yield display_line
+            display_line, width, text = [], 0, text[cut:]
+        if text:
+            display_line.append((bold, italic, color, text))
+            width += len(text)
+    yield display_line
+
+
+def render_code_pdf(source, output_path, language="python", line_numbers=False, style_name=CODE_STYLE,
+                    pagesize=CODE_PAGESIZE, font_size=CODE_FONT_SIZE, leading=CODE_LEADING, margins=CODE_MARGINS):
+    """Lays out syntax-highlighted source code as a PDF and returns the page count.
+
+    Long lines are wrapped at the right margin; with `line_numbers`, each
+    source line is numbered in a gutter and its continuation lines are not.
+    """
+    width, height = pagesize
+    top, right, bottom, left = margins
+    source = source.rstrip()
+    char_width = stringWidth("A", "Courier", font_size)
+    gutter = len(str(source.count("\n") + 1)) + 2 if line_numbers else 0
+    max_chars = max(1, int((width - left - right) / char_width) - gutter)
+    lines_per_page = max(1, int((height - top - bottom) / leading) + 1)
+
+    c = canvas.Canvas(output_path, pagesize=pagesize, pageCompression=1)
+    fonts = {variant: c._doc.getInternalFontName(font_name) for variant, font_name in _CODE_FONTS.items()}
+    page_ops = []
+    page_lines = 0
+    page_total = 0
+
+    def emit_page():
+        # Registers the fonts on the page, then writes the page as one text block
+        for font_name in _CODE_FONTS.values():
+            c.setFont(font_name, font_size, leading)
+        body = " ".join(page_ops)
+        c.addLiteral(f"BT {leading} TL 1 0 0 1 {left} {height - top} Tm {body} ET")
+        c.showPage()
+
+    for number, runs in enumerate(highlighted_lines(source, language, style_name), start=1):
+        for continuation, display_line in enumerate(_wrap_runs(runs, max_chars)):
+            if page_lines == lines_per_page:
+                emit_page()
+                page_total += 1
+                page_ops, page_lines = [], 0
+            if page_lines:
+                page_ops.append("T*")
+            # Font and color are reset per line, so every line is self-contained
+            current = None
+            if gutter:
+                label = "" if continuation else str(number)
+                page_ops.append(f"{fonts[False, False]} {font_size} Tf {LINE_NUMBER_GRAY} g ({label.rjust(gutter - 2)}  ) Tj")
+                current = (False, False, None)
+            for bold, italic, color, text in display_line:
+                if current is None or (bold, italic) != current[:2]:
+                    page_ops.append(f"{fonts[bold, italic]} {font_size} Tf")
+                if current is None or color != current[2]:
+                    page_ops.append(color)
+                current = (bold, italic, color)
+                page_ops.append(f"({pdf_escape(text)}) Tj")
+            page_lines += 1
+    if page_ops or page_total == 0:
+        emit_page()
+        page_total += 1
+    with span("serialize"):
+        c.save()
+    return page_total